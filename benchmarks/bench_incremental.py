@@ -0,0 +1,100 @@
+#-----------------------------------------------------------------------------
+# Benchmark of the incremental update of the univariate feature selection:
+# adding a batch of new samples to the saved sufficient statistics against
+# recomputing the statistics of the whole cohort with the new samples
+#
+# Both cohorts are synthetic HDF5 files (see make_cohort.py). The new samples
+# are added to the training set of every fold, as with added_samples.
+#
+# Usage: python benchmarks/bench_incremental.py [num_samples] [num_new] [num_snps] [num_folds]
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+import tables as tb
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from make_cohort import make_cohort
+from utils.batched_pearson import pearson_moments, pearson_from_moments
+from utils.feature_statistics import sample_file_statistics
+
+
+def cohort_statistics(path, mask, labels, block_size):
+    '''
+    The statistics of the training samples of every fold of a cohort, as
+    computed by univ_feature_sel: (num_folds x num_snps) sums.
+    '''
+    hdf = tb.open_file(path, mode='r')
+    try:
+        num_snps = hdf.root.GTBox.gt.shape[1]
+        sums = np.zeros((3, mask.shape[1], num_snps))
+        for start in range(0, num_snps, block_size):
+            stop = min(start + block_size, num_snps)
+            _, sx, sxx, _, _, sxy = pearson_moments(hdf.root.GTBox.gt[:, start:stop], mask, labels)
+            sums[:, :, start:stop] = [sx.transpose(), sxx.transpose(), sxy.transpose()]
+    finally:
+        hdf.close()
+    return (mask.sum(axis=0), sums[0], sums[1], labels.sum(axis=0),
+            (labels * labels).sum(axis=0), sums[2])
+
+
+def ranking(statistics):
+    n, sx, sxx, sy, syy, sxy = statistics
+    pval = pearson_from_moments(n[:, np.newaxis], sx, sxx, sy[:, np.newaxis],
+                                syy[:, np.newaxis], sxy)[1]
+    return pval.argsort(axis=1)
+
+
+def main(num_samples=5000, num_new=200, num_snps=20000, num_folds=10, block_size=10000):
+    work_dir = tempfile.mkdtemp()
+    try:
+        cohort_file = os.path.join(work_dir, "cohort.h5")
+        new_file = os.path.join(work_dir, "new.h5")
+        all_file = os.path.join(work_dir, "all.h5")
+        make_cohort(cohort_file, num_samples, num_snps, seed=0)
+        make_cohort(new_file, num_new, num_snps, seed=1)
+        # The cohort with the new samples, for the full recomputation
+        with tb.open_file(cohort_file) as cohort, tb.open_file(new_file) as new:
+            with tb.open_file(all_file, mode='w') as hdf:
+                group = hdf.create_group('/', 'GTBox')
+                hdf.create_array(group, 'gt', np.vstack([cohort.root.GTBox.gt[:],
+                                                         new.root.GTBox.gt[:]]))
+                lbl = np.hstack([cohort.root.GTBox.lbl[:], new.root.GTBox.lbl[:]])
+                hdf.create_array(group, 'lbl', lbl)
+
+        rng = np.random.RandomState(0)
+        # About 80% of the cohort (sets I and II) trains every fold, with
+        # soft labels; the new samples train every fold with their phenotype
+        mask = (rng.rand(num_samples, num_folds) < 0.8).astype('float64')
+        labels = mask * rng.rand(num_samples, num_folds)
+        new_labels = (lbl[0, num_samples:] + 1.0) / 2
+        saved = cohort_statistics(cohort_file, mask, labels, block_size)
+
+        t0 = time.time()
+        added = sample_file_statistics(new_file, num_snps, num_folds, block_size)
+        incremental = ranking(tuple(total + new for total, new in zip(saved, added)))
+        t_incremental = time.time() - t0
+
+        t0 = time.time()
+        mask_all = np.vstack([mask, np.ones((num_new, num_folds))])
+        labels_all = np.vstack([labels, np.tile(new_labels[:, np.newaxis], (1, num_folds))])
+        full = ranking(cohort_statistics(all_file, mask_all, labels_all, block_size))
+        t_full = time.time() - t0
+    finally:
+        shutil.rmtree(work_dir)
+
+    print("samples=%d new=%d snps=%d folds=%d" % (num_samples, num_new, num_snps, num_folds))
+    print("full recomputation : %.3f s" % t_full)
+    print("incremental update : %.3f s (x%.1f)" % (t_incremental, t_full / t_incremental))
+    print("same ranking       : %s" % (full == incremental).all())
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
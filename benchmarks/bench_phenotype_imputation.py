@@ -0,0 +1,59 @@
+#-----------------------------------------------------------------------------
+# Benchmark of the phenotype imputation: scikit-learn BaggingClassifier of
+# LogisticRegression against the batched bagged logistic regression
+#
+# Usage: python benchmarks/bench_phenotype_imputation.py [n_train] [n_impute] [n_estimators]
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import numpy as np
+from sklearn import linear_model
+from sklearn import metrics
+from sklearn.ensemble import BaggingClassifier
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.bagged_logit import BaggedLogisticRegression
+
+
+def main(n_train=300, n_impute=2100, n_estimators=5000):
+    # 11 standardized clinical covariates, as in phenotype_imputation
+    rng = np.random.RandomState(0)
+    n = n_train + n_impute
+    labels = (rng.rand(n) < 0.3).astype('float64')
+    X = rng.randn(n, 11) + 0.5 * labels[:, np.newaxis] * (rng.rand(11) < 0.5)
+    X_trn, y_trn = X[:n_train], labels[:n_train]
+    X_tst, y_tst = X[n_train:], labels[n_train:]
+
+    t0 = time.time()
+    model = BaggingClassifier(base_estimator=linear_model.LogisticRegression(),
+                n_estimators=n_estimators, max_samples=0.632, max_features=5,
+                bootstrap=True, bootstrap_features=True, oob_score=False,
+                n_jobs=1, random_state=0, verbose=0)
+    soft_sklearn = model.fit(X_trn, y_trn).predict_proba(X_tst)[:, 1]
+    t_sklearn = time.time() - t0
+
+    t0 = time.time()
+    model = BaggedLogisticRegression(n_estimators=n_estimators, max_samples=0.632,
+                max_features=5, bootstrap=True, bootstrap_features=True,
+                random_state=0)
+    soft_batched = model.fit(X_trn, y_trn).predict_proba(X_tst)[:, 1]
+    t_batched = time.time() - t0
+
+    # The replicates are drawn differently, so the soft labels agree in
+    # distribution, not exactly
+    print("train=%d impute=%d n_estimators=%d" % (n_train, n_impute, n_estimators))
+    print("BaggingClassifier : %.3f s  AUC=%.4f" % (t_sklearn, metrics.roc_auc_score(y_tst, soft_sklearn)))
+    print("batched           : %.3f s  AUC=%.4f (x%.1f)" % (t_batched,
+          metrics.roc_auc_score(y_tst, soft_batched), t_sklearn / t_batched))
+    print("correlation       : %.5f" % np.corrcoef(soft_sklearn, soft_batched)[0, 1])
+    print("max |diff|        : %.4f" % np.abs(soft_sklearn - soft_batched).max())
+    print("mean (sklearn/batched) : %.4f / %.4f" % (soft_sklearn.mean(), soft_batched.mean()))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,222 @@
+#-----------------------------------------------------------------------------
+# Benchmark of the tasks of the pipeline on synthetic cohorts
+#
+# For every size of a grid (number of samples x number of SNPs), a cohort is
+# generated with make_cohort.py and the four tasks are run in order, each in
+# its own process, so that the peak memory (maximum resident set size) of
+# every task is measured separately. The wall time, CPU time and peak memory
+# of every task are written to a JSON file. Given the JSON file of an earlier
+# version (--baseline), the tasks that became slower or use more memory than
+# the tolerance allows are reported and the exit status is 1.
+#
+# The configuration is config_file.txt with smaller defaults for the
+# benchmark (see BENCHMARK_ENTRIES), which can be changed with --set.
+#
+# Usage: python benchmarks/bench_pipeline.py [--samples 500,2000]
+#            [--snps 1000,10000] [--set section.key=value ...]
+#            [--output results.json] [--baseline old.json] [--tolerance 0.2]
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+import yaml
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from make_cohort import make_cohort
+
+TASKS = ["cv_set_creation", "phenotype_imputation", "univ_feature_sel", "random_forest"]
+
+# Entries of config_file.txt changed for the benchmark
+BENCHMARK_ENTRIES = [
+    ("global", "seed", 0),
+    ("global", "checkpoint", False),
+    ("global", "use_cache", False),
+    ("cv_set_creation", "num_folds", 10),
+    ("phenotype_imputation", "n_estimators", 1000),
+    ("univ_feature_sel", "top_k", None),
+    ("random_forest", "n_estimators", 200),
+    ("random_forest", "n_select", 500),
+]
+
+# Increases below these are measurement noise, not regressions
+MIN_INCREASE = {"wall_time": 0.05, "peak_rss_mb": 5.0}
+
+
+def _peak_rss_mb(who):
+    '''
+    Peak resident set size of this process (or of its largest finished child
+    process) in MB. ru_maxrss is in KB on Linux and in bytes on OS X.
+    '''
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def run_task(config_file, task_name):
+    '''
+    Function to run one task as run_cotraining does (worker process) and
+    print its measurements as JSON.
+    '''
+    from classes.config_state import ConfigState
+    from classes.dataset import Dataset
+    from classes.lazy_dataset import LazyDataset
+    from run_cotraining import TASK_FUNCTIONS
+
+    config = ConfigState(config_file)
+    if config.get_entry("global", "genotype_storage") in ("int8", "mmap", "packed"):
+        data = LazyDataset()
+    else:
+        data = Dataset()
+    t0 = time.time()
+    data.load_dataset(config)
+    if task_name != "cv_set_creation":
+        data.add_fold_information(config)
+    load_time = time.time() - t0
+    load_rss = _peak_rss_mb(resource.RUSAGE_SELF)
+
+    cpu0 = time.clock()
+    t0 = time.time()
+    TASK_FUNCTIONS[task_name](data, config)
+    wall_time = time.time() - t0
+    # The CPU time of the worker processes (n_jobs) is counted in the
+    # children's resource usage
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_time = time.clock() - cpu0 + children.ru_utime + children.ru_stime
+
+    print(json.dumps({"wall_time": wall_time, "cpu_time": cpu_time, "load_time": load_time,
+                      "load_rss_mb": load_rss,
+                      "peak_rss_mb": max(_peak_rss_mb(resource.RUSAGE_SELF),
+                                         _peak_rss_mb(resource.RUSAGE_CHILDREN))}))
+
+
+def write_config(config_file, work_dir, input_file, entries):
+    '''
+    Function to write the configuration of a benchmark run: config_file.txt
+    with the benchmark entries.
+    '''
+    config = yaml.load(open(os.path.join(ROOT, "config_file.txt")))
+    config["global"]["input_dir"] = work_dir
+    config["global"]["input_file"] = input_file
+    config["global"]["output_dir"] = os.path.join(work_dir, "output")
+    for section, key, value in entries:
+        config[section][key] = value
+    with open(config_file, "w") as f:
+        yaml.dump(config, f, default_flow_style=False)
+    if not os.path.exists(config["global"]["output_dir"]):
+        os.makedirs(config["global"]["output_dir"])
+
+
+def parse_entry(entry):
+    '''
+    Parse an entry "section.key=value" of the command line (the value is read
+    as YAML).
+    '''
+    name, _, value = entry.partition("=")
+    section, _, key = name.partition(".")
+    return section, key, yaml.safe_load(value)
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Function to report the tasks that are slower, or use more memory, than in
+    the baseline by more than the tolerance (a fraction) and by more than
+    MIN_INCREASE. Returns the number of regressions.
+    '''
+    previous = dict(((r["num_samples"], r["num_snps"], r["task"]), r) for r in baseline["results"])
+    regressions = 0
+    for r in results:
+        old = previous.get((r["num_samples"], r["num_snps"], r["task"]))
+        if old is None:
+            continue
+        for measure in ["wall_time", "peak_rss_mb"]:
+            if (r[measure] > old[measure] * (1.0 + tolerance) and
+                    r[measure] - old[measure] > MIN_INCREASE[measure]):
+                print("REGRESSION samples=%d snps=%d %s %s: %.3f -> %.3f" % (
+                      r["num_samples"], r["num_snps"], r["task"], measure, old[measure], r[measure]))
+                regressions += 1
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tasks of the pipeline")
+    parser.add_argument("--samples", default="500,2000",
+                        help="comma-separated numbers of samples")
+    parser.add_argument("--snps", default="1000,10000",
+                        help="comma-separated numbers of SNPs")
+    parser.add_argument("--case-fraction", type=float, default=0.3)
+    parser.add_argument("--set", action="append", default=[], metavar="SECTION.KEY=VALUE",
+                        help="change an entry of the configuration")
+    parser.add_argument("--output", default="bench_pipeline.json")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative increase of time and memory")
+    parser.add_argument("--work-dir", help="keep the cohorts and outputs in this directory")
+    parser.add_argument("--worker", nargs=2, metavar=("CONFIG", "TASK"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        run_task(*args.worker)
+        return
+
+    entries = BENCHMARK_ENTRIES + [parse_entry(entry) for entry in args.set]
+    work_root = args.work_dir or tempfile.mkdtemp(prefix="bench_pipeline_")
+    results = []
+    try:
+        for num_samples in [int(n) for n in args.samples.split(",")]:
+            for num_snps in [int(m) for m in args.snps.split(",")]:
+                work_dir = os.path.join(work_root, "n%d_m%d" % (num_samples, num_snps))
+                if not os.path.exists(work_dir):
+                    os.makedirs(work_dir)
+                make_cohort(os.path.join(work_dir, "cohort.h5"), num_samples, num_snps,
+                            args.case_fraction)
+                config_file = os.path.join(work_dir, "config.txt")
+                write_config(config_file, work_dir, "cohort.h5", entries)
+
+                for task_name in TASKS:
+                    output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                                      "--worker", config_file, task_name], cwd=ROOT)
+                    result = json.loads(output.strip().splitlines()[-1])
+                    result.update({"num_samples": num_samples, "num_snps": num_snps,
+                                   "task": task_name})
+                    results.append(result)
+                    print("samples=%d snps=%d %-20s %8.2f s %8.1f MB" % (
+                          num_samples, num_snps, task_name, result["wall_time"], result["peak_rss_mb"]))
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_root)
+
+    report = {"git_commit": git_commit(), "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "python": platform.python_version(), "numpy": np.__version__,
+              "platform": platform.platform(),
+              "configuration": [list(entry) for entry in entries], "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
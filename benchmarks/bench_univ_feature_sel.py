@@ -0,0 +1,79 @@
+#-----------------------------------------------------------------------------
+# Benchmark of the univariate feature selection: the per-SNP, per-fold
+# scipy.stats.pearsonr loop against the batched Pearson engine
+#
+# Usage: python benchmarks/bench_univ_feature_sel.py [num_samples] [num_snps] [num_folds]
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import numpy as np
+from scipy.stats import pearsonr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.batched_pearson import pearson_pval_block
+
+
+def per_snp_loop(genotype, mask, labels):
+    '''
+    The reference implementation: one call of pearsonr per SNP and fold.
+    Constant SNPs have an undefined correlation; older versions of scipy
+    report a p-value of 1 for them, the batched engine reports NaN.
+    '''
+    feature_pval = np.ones((mask.shape[1], genotype.shape[1]))
+    for i in range(mask.shape[1]):
+        sel_trn = np.nonzero(mask[:, i])[0]
+        trn_labels = labels[sel_trn, i]
+        j = 0
+        for genotype_snp in genotype.transpose():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                r, pval = pearsonr(genotype_snp[sel_trn], trn_labels)
+            feature_pval[i, j] = np.nan if np.isnan(r) else pval
+            j += 1
+    return feature_pval
+
+
+def batched(genotype, mask, labels, block_size=10000):
+    '''
+    The batched engine, as called by univ_feature_sel.
+    '''
+    num_snps = genotype.shape[1]
+    feature_pval = np.ones((mask.shape[1], num_snps))
+    for start in range(0, num_snps, block_size):
+        stop = min(start + block_size, num_snps)
+        feature_pval[:, start:stop] = pearson_pval_block(genotype[:, start:stop],
+            mask, labels).transpose()
+    return feature_pval
+
+
+def main(num_samples=2000, num_snps=2000, num_folds=10):
+    rng = np.random.RandomState(0)
+    genotype = rng.binomial(2, 0.3, size=(num_samples, num_snps)).astype('float64')
+    # Every 100th SNP is constant (monomorphic in the cohort)
+    genotype[:, ::100] = rng.randint(3, size=len(range(0, num_snps, 100)))
+    # Sets I and II (about 80% of the samples) are used for training
+    mask = (rng.rand(num_samples, num_folds) < 0.8).astype('float64')
+    labels = mask * rng.rand(num_samples, num_folds)
+
+    t0 = time.time()
+    pval_loop = per_snp_loop(genotype, mask, labels)
+    t_loop = time.time() - t0
+
+    t0 = time.time()
+    pval_batched = batched(genotype, mask, labels)
+    t_batched = time.time() - t0
+
+    print("samples=%d snps=%d folds=%d" % (num_samples, num_snps, num_folds))
+    print("per-SNP loop : %.3f s" % t_loop)
+    print("batched      : %.3f s (x%.1f)" % (t_batched, t_loop / t_batched))
+    print("max |diff|   : %.3g" % np.nanmax(np.abs(pval_loop - pval_batched)))
+    print("same NaN     : %s" % (np.isnan(pval_loop) == np.isnan(pval_batched)).all())
+    print("same ranking : %s" % (pval_loop.argsort() == pval_batched.argsort()).all())
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,92 @@
+#-----------------------------------------------------------------------------
+# Check of the task cache when the folds are created again: with seed null,
+# running cv_set_creation again gives other folds, and every task downstream
+# of it must then be run again instead of being reported up to date.
+#
+# A small synthetic cohort is run through the pipeline, the folds are created
+# again (run_cotraining.py --prepare after discarding the key of
+# cv_set_creation) and the plan and the saved keys of the downstream tasks
+# are checked. The exit status is 1 if a check fails.
+#
+# Usage: python benchmarks/check_fold_cache.py [num_samples] [num_snps]
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import os
+import sys
+import shutil
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from make_cohort import make_cohort
+from bench_pipeline import write_config
+
+# Entries of config_file.txt changed for the check
+CHECK_ENTRIES = [
+    ("global", "seed", None),
+    ("global", "checkpoint", False),
+    ("global", "use_cache", True),
+    ("cv_set_creation", "num_folds", 3),
+    ("phenotype_imputation", "n_estimators", 20),
+    ("univ_feature_sel", "top_k", None),
+    ("random_forest", "n_estimators", 20),
+    ("random_forest", "n_select", 50),
+]
+
+DOWNSTREAM_TASKS = ["phenotype_imputation", "univ_feature_sel", "random_forest"]
+
+
+def main(num_samples=300, num_snps=500):
+    from run_cotraining import run_pipeline, plan_tasks, load_configuration
+    from utils.task_cache import dataset_digest, load_key, save_key
+
+    work_dir = tempfile.mkdtemp(prefix="check_fold_cache_")
+    failures = 0
+    try:
+        make_cohort(os.path.join(work_dir, "cohort.h5"), num_samples, num_snps)
+        config_file = os.path.join(work_dir, "config.txt")
+        write_config(config_file, work_dir, "cohort.h5", CHECK_ENTRIES)
+        config = load_configuration(config_file)
+
+        run_pipeline(config_file)
+        keys = dict((task_name, load_key(config, task_name)) for task_name in DOWNSTREAM_TASKS)
+        seeds = config.load_variable("cv_set_creation", "fold_seeds")
+        plan = dict(plan_tasks(config, dataset_digest(config)))
+        print("before     : %s" % ", ".join("%s %s" % item for item in sorted(plan.items())))
+
+        # Create the folds again (new seeds, since the global seed is null)
+        save_key(config, "cv_set_creation", None)
+        run_pipeline(config_file, prepare=True)
+        if (config.load_variable("cv_set_creation", "fold_seeds") == seeds).all():
+            print("the folds did not change (same seeds)")
+            return 1
+
+        plan = dict(plan_tasks(config, dataset_digest(config)))
+        print("new folds  : %s" % ", ".join("%s %s" % item for item in sorted(plan.items())))
+        for task_name in DOWNSTREAM_TASKS:
+            if plan[task_name] != "run":
+                print("FAIL %s is planned as '%s' on new folds" % (task_name, plan[task_name]))
+                failures += 1
+
+        run_pipeline(config_file)
+        for task_name in DOWNSTREAM_TASKS:
+            if load_key(config, task_name) == keys[task_name]:
+                print("FAIL %s kept the key of the old folds" % task_name)
+                failures += 1
+        plan = dict(plan_tasks(config, dataset_digest(config)))
+        print("after run  : %s" % ", ".join("%s %s" % item for item in sorted(plan.items())))
+        if any(action != "up to date" for action in plan.values()):
+            print("FAIL the tasks are not up to date after the run")
+            failures += 1
+    finally:
+        shutil.rmtree(work_dir)
+
+    print("downstream tasks invalidated : %s" % (failures == 0))
+    return 1 if failures > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:]]))
@@ -0,0 +1,87 @@
+#-----------------------------------------------------------------------------
+# Generator of synthetic cohorts in the layout of the input file of the
+# pipeline (an HDF5 file with the group GTBox):
+#   gt    : (num_samples x num_snps) genotype calls [0, 1, 2]
+#   covar : (12 x num_samples) covariates, the regular covariate in row 0 and
+#           the clinical covariates in rows 1-11
+#   lbl   : (1 x num_samples) phenotype, 1 for cases and -1 for controls
+#
+# The first num_causal SNPs and the clinical covariates are associated with
+# the phenotype, so that every task of the pipeline has a signal to find.
+# The genotype is written in blocks of SNPs, so large cohorts can be
+# generated with little memory.
+#
+# Usage: python benchmarks/make_cohort.py output_file num_samples num_snps
+#            [--case-fraction 0.3] [--num-causal 20] [--seed 0]
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import argparse
+import numpy as np
+import tables as tb
+
+
+def make_cohort(output_file, num_samples, num_snps, case_fraction=0.3,
+                num_causal=20, seed=0, block_size=10000):
+    '''
+    Function to write a synthetic cohort to an HDF5 file.
+
+    Parameters
+    ----------
+    output_file : the path of the HDF5 file (overwritten if it exists)
+
+    num_samples, num_snps : the size of the genotype matrix
+
+    case_fraction : the fraction of the samples that are cases
+
+    num_causal : the number of SNPs (the first ones) associated with the
+        phenotype
+
+    seed : the seed of the random number generator. The same arguments give
+        the same file
+
+    block_size : the number of SNPs generated and written at once
+    '''
+    rng = np.random.RandomState(seed)
+    is_case = np.zeros(num_samples, dtype='bool')
+    is_case[rng.permutation(num_samples)[:int(round(case_fraction * num_samples))]] = True
+    lbl = np.where(is_case, 1.0, -1.0)[np.newaxis, :]
+
+    # The clinical covariates are shifted in cases, the regular one is not
+    covar = rng.randn(12, num_samples)
+    covar[1:12] += 0.5 * is_case
+
+    hdf = tb.open_file(output_file, mode='w')
+    try:
+        group = hdf.create_group('/', 'GTBox')
+        hdf.create_array(group, 'covar', covar)
+        hdf.create_array(group, 'lbl', lbl)
+        gt = hdf.create_carray(group, 'gt', tb.Float64Atom(), shape=(num_samples, num_snps))
+        for start in range(0, num_snps, block_size):
+            stop = min(start + block_size, num_snps)
+            maf = rng.uniform(0.05, 0.5, size=stop - start)
+            block = rng.binomial(2, maf, size=(num_samples, stop - start))
+            # Cases carry one more copy of the minor allele of causal SNPs
+            # with probability 0.3
+            causal = max(0, min(num_causal, stop) - start)
+            if causal > 0:
+                extra = rng.binomial(1, 0.3, size=(num_samples, causal)) * is_case[:, np.newaxis]
+                block[:, :causal] = np.minimum(block[:, :causal] + extra, 2)
+            gt[:, start:stop] = block
+    finally:
+        hdf.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic cohort in the GTBox layout")
+    parser.add_argument("output_file")
+    parser.add_argument("num_samples", type=int)
+    parser.add_argument("num_snps", type=int)
+    parser.add_argument("--case-fraction", type=float, default=0.3)
+    parser.add_argument("--num-causal", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    make_cohort(args.output_file, args.num_samples, args.num_snps, args.case_fraction,
+                args.num_causal, args.seed)
@@ -1,7 +1,11 @@
 import os
+import shutil
 import yaml
+import cPickle as pickle
 import numpy as np 
 
+from utils import perf_metrics
+
 class ConfigState:
     '''
     A class object that contains the parameters to run the pipeline and allows
@@ -24,6 +28,8 @@ class ConfigState:
         config_file : full path to the file
         '''
         self.config = yaml.load(file(config_file, 'r'))
+        # Variables of the tasks kept in memory (see keep_in_memory)
+        self.memory = {}
 
 
     def load_configuration(config_file):
@@ -50,6 +56,21 @@ class ConfigState:
         return self.config[group_name][key_name]
 
 
+    def keep_in_memory(self, task_names):
+        '''
+        Function to keep the variables of some tasks in memory instead of
+        saving them (e.g. the intermediate results of one fold, see
+        utils/fused.py). save_variable, load_variable and has_variable then use
+        a dictionary for these tasks, and remove_models and remove_checkpoints
+        leave their files alone (the caller manages them).
+
+        Parameters
+        ----------
+        task_names : the names of the tasks
+        '''
+        self.memory = dict((task_name, {}) for task_name in task_names)
+
+
     def _create_directory(self, path_dir):
         '''
         Function to create a directory if it does not previously exist.
@@ -59,74 +80,242 @@ class ConfigState:
         path_dir : the full path of the directory
         '''
         if not os.path.exists(path_dir):
-            os.makedirs(path_dir)
+            try:
+                os.makedirs(path_dir)
+            except OSError:
+                # It may have been created by another worker process
+                if not os.path.isdir(path_dir):
+                    raise
+
+
+    def _save_option(self):
+        '''
+        Function to get the format of the saved variables (save_option in the
+        configuration file): npy or csv.
+        '''
+        extension = self.config["global"]["save_option"]
+        if extension not in ("npy", "csv"):
+            raise ValueError("Unknown save_option %s (npy or csv)" % extension)
+        return extension
 
 
     def save_variable(self, task_name, format_string=None, **kwargs):
         '''
-        Function to save a variable as a text file (tab-separated). The name of the
-        file will correspond with the name of the variable + extension. The
-        extension is a parameter in the configuration file.
+        Function to save a variable. The name of the file will correspond with
+        the name of the variable + extension. The extension is a parameter in
+        the configuration file:
+        csv : text file (tab-separated), written with format_string
+        npy : binary NumPy file. Keeps the dtype and the memory layout of the
+              variable and can be memory-mapped by load_variable. When
+              csv_export is set, a tab-separated copy is written as well
         
         Parameters
         ----------
         task_name : name of the task for which output data needs to be saved
 
-        format_string : name of the task for which output data needs to be saved
+        format_string : format of the values in the text (csv) files
 
         kwargs : keyword argument with the variable name(s) of the variable(s) to 
                  save
         '''
+        if task_name in self.memory:
+            self.memory[task_name].update(kwargs)
+            return
+
         # Parameters
         # Global output directory and subdirectory for this task
         output_dir = self.config["global"]["output_dir"]
         output_subdir = self.config[task_name]["output_subdir"]
         # Type of file to save
-        extension = self.config["global"]["save_option"]    
+        extension = self._save_option()
+        csv_export = self.config["global"]["csv_export"]
 
         # Create the directory, only if necessary
         out_dir = "%s/%s" % (output_dir, output_subdir)
         self._create_directory(out_dir)
 
-        # Set the delimiter
-        if extension == "csv":
-            delimiter_char = '\t'
-
         # Iterate through the variables and save them
         for var_obj in kwargs.items():
             # Get the variable name and its contents
-            file_name = "%s/%s.%s" % (out_dir, var_obj[0], extension)
-            np.savetxt(file_name, var_obj[1], fmt=format_string, delimiter=delimiter_char)
+            file_name = "%s/%s" % (out_dir, var_obj[0])
+            if extension == "npy":
+                np.save("%s.npy" % file_name, var_obj[1])
+                perf_metrics.add_file_size("bytes_written", "%s.npy" % file_name)
+            if extension == "csv" or csv_export:
+                np.savetxt("%s.csv" % file_name, var_obj[1], fmt=format_string, delimiter='\t')
+                perf_metrics.add_file_size("bytes_written", "%s.csv" % file_name)
 
 
-    def load_variable(self, task_name, var_name):
+    def load_variable(self, task_name, var_name, mmap=False):
         '''
-        Function to load a variable that was saved as a text file (tab-separated).
-        The name of the file with the contents of the variable corresponds will correspond with the name of the variable + extension. The
-        extension is a parameter in the configuration file.
+        Function to load a variable that was saved with save_variable. The name
+        of the file with the contents of the variable will correspond with the
+        name of the variable + extension. The extension is a parameter in the
+        configuration file.
         
         Parameters
         ----------
         task_name : name of the task for which saved variable needs to be restored
 
-        kwargs : keyword argument with the variable name(s) of the variable(s) to 
-                 load
+        var_name : name of the variable to load
+
+        mmap : if True and the variable was saved as npy, the file is memory-mapped
+               (read-only) instead of read. Only the rows/columns that are
+               accessed are then read from disk
         '''
+        if task_name in self.memory:
+            return self.memory[task_name][var_name]
+
         # Parameters
         # Global output directory and subdirectory for this task
         input_dir = self.config["global"]["output_dir"]
         input_subdir = self.config[task_name]["output_subdir"]
         # Type of file to save
-        extension = self.config["global"]["save_option"]    
+        extension = self._save_option()
 
-        # Create the directory, only if necessary
         in_dir = "%s/%s" % (input_dir, input_subdir)
 
-        # Set the delimiter
-        if extension == "csv":
-            delimiter_char = '\t'
-
         # Get the variable name and its contents
         file_name = "%s/%s.%s" % (in_dir, var_name, extension)
-        return np.loadtxt(file_name, delimiter=delimiter_char)
+        perf_metrics.add_file_size("bytes_read", file_name)
+        if extension == "npy":
+            return np.load(file_name, mmap_mode='r' if mmap else None)
+        return np.loadtxt(file_name, delimiter='\t')
+
+
+    def has_variable(self, task_name, var_name):
+        '''
+        Function to check whether a variable has been saved with save_variable.
+        '''
+        if task_name in self.memory:
+            return var_name in self.memory[task_name]
+        return os.path.exists("%s/%s/%s.%s" % (self.config["global"]["output_dir"],
+                                               self.config[task_name]["output_subdir"],
+                                               var_name, self.config["global"]["save_option"]))
+
+
+    def _checkpoint_dir(self, task_name):
+        '''
+        Function to get the directory with the checkpoints of a task.
+        '''
+        return "%s/%s/checkpoint" % (self.config["global"]["output_dir"],
+                                     self.config[task_name]["output_subdir"])
+
+
+    def save_checkpoint(self, task_name, key, **kwargs):
+        '''
+        Function to save the partial results of a task (e.g. of one fold) as
+        binary NumPy files in the checkpoint subdirectory of the task. Each
+        file is written under a temporary name and then renamed, so that an
+        interrupted run never leaves a truncated checkpoint.
+
+        Parameters
+        ----------
+        task_name : name of the task
+
+        key : name of the partial result, e.g. "fold_1"
+
+        kwargs : keyword argument with the variable name(s) of the variable(s) to
+                 save
+        '''
+        check_dir = self._checkpoint_dir(task_name)
+        self._create_directory(check_dir)
+        for var_obj in kwargs.items():
+            file_name = "%s/%s.%s.npy" % (check_dir, var_obj[0], key)
+            tmp_name = "%s.tmp.npy" % file_name[:-4]
+            np.save(tmp_name, var_obj[1])
+            os.rename(tmp_name, file_name)
+            perf_metrics.add_file_size("bytes_written", file_name)
+
+
+    def has_checkpoint(self, task_name, key, var_names):
+        '''
+        Function to check whether all the variables of a partial result have
+        been saved with save_checkpoint.
+        '''
+        check_dir = self._checkpoint_dir(task_name)
+        return all(os.path.exists("%s/%s.%s.npy" % (check_dir, var_name, key))
+                   for var_name in var_names)
+
+
+    def load_checkpoint(self, task_name, key, var_name):
+        '''
+        Function to load a variable saved with save_checkpoint.
+        '''
+        file_name = "%s/%s.%s.npy" % (self._checkpoint_dir(task_name), var_name, key)
+        perf_metrics.add_file_size("bytes_read", file_name)
+        return np.load(file_name)
+
 
+    def remove_checkpoints(self, task_name):
+        '''
+        Function to delete all the checkpoints of a task, once its output has
+        been saved.
+        '''
+        if task_name in self.memory:
+            return
+        check_dir = self._checkpoint_dir(task_name)
+        if os.path.exists(check_dir):
+            shutil.rmtree(check_dir)
+
+
+    def _model_dir(self, task_name):
+        '''
+        Function to get the directory with the fitted models of a task.
+        '''
+        return "%s/%s/models" % (self.config["global"]["output_dir"],
+                                 self.config[task_name]["output_subdir"])
+
+
+    def save_model(self, task_name, key, model):
+        '''
+        Function to save a fitted model (any picklable object) of a task in
+        the models subdirectory of the task. As for checkpoints, the file is
+        written under a temporary name and then renamed.
+
+        Parameters
+        ----------
+        task_name : name of the task
+
+        key : name of the model, e.g. "fold_1"
+
+        model : the object to save
+        '''
+        model_dir = self._model_dir(task_name)
+        self._create_directory(model_dir)
+        file_name = "%s/%s.pkl" % (model_dir, key)
+        with open("%s.tmp" % file_name, "wb") as f:
+            pickle.dump(model, f, pickle.HIGHEST_PROTOCOL)
+        os.rename("%s.tmp" % file_name, file_name)
+        perf_metrics.add_file_size("bytes_written", file_name)
+
+
+    def load_model(self, task_name, key):
+        '''
+        Function to load a model saved with save_model.
+        '''
+        file_name = "%s/%s.pkl" % (self._model_dir(task_name), key)
+        perf_metrics.add_file_size("bytes_read", file_name)
+        with open(file_name, "rb") as f:
+            return pickle.load(f)
+
+
+    def model_keys(self, task_name):
+        '''
+        Function to get the names of the models saved for a task.
+        '''
+        model_dir = self._model_dir(task_name)
+        if not os.path.exists(model_dir):
+            return []
+        return sorted(name[:-4] for name in os.listdir(model_dir) if name.endswith(".pkl"))
+
+
+    def remove_models(self, task_name, keep=()):
+        '''
+        Function to delete the saved models of a task, except those in keep.
+        '''
+        if task_name in self.memory:
+            return
+        for key in self.model_keys(task_name):
+            if key not in keep:
+                os.remove("%s/%s.pkl" % (self._model_dir(task_name), key))
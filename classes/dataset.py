@@ -1,5 +1,9 @@
+import numpy as np
 import tables as tb
 
+from classes.fold_index import FoldIndex
+from utils.cv_set_creation import generate_folds
+
 class Dataset:
     '''
     A class object that contains the entire dataset.
@@ -10,6 +14,10 @@ class Dataset:
     covariate: The clinical data. The genotype and covariate data do not 
                overlap.
     labels   : Phenotype information for each sample.
+
+    The genotype is either held in memory or, when genotype_storage is "hdf5",
+    streamed from the input file in blocks of SNP columns (see
+    genotype_blocks and genotype_columns).
     '''
 
     def __init__(self):
@@ -17,8 +25,13 @@ class Dataset:
         self.covariate = []
         self.labels = []
         self.num_samples = 0 
+        self.num_snps = 0
         self.folds = []
         self.num_folds = 0
+        self.fold_index = None
+        self.fold_offset = 0
+        self.input_path = None
+        self.genotype_storage = "memory"
 
     def load_dataset(self, config):
         '''
@@ -33,18 +46,125 @@ class Dataset:
         # Get the parameters from the config file
         input_dir  = config.get_entry("global", "input_dir")
         input_file = config.get_entry("global", "input_file")
+        self.genotype_storage = config.get_entry("global", "genotype_storage")
+        self.input_path = "%s/%s" % (input_dir, input_file)
 
         # Read the data from HDF5
-        hdf = tb.open_file("%s/%s" % (input_dir, input_file), mode='r')
-        self.genotype = hdf.root.GTBox.gt[:]
+        hdf = tb.open_file(self.input_path, mode='r')
+        if self.genotype_storage == "memory":
+            self.genotype = hdf.root.GTBox.gt[:]
+        self.num_snps = hdf.root.GTBox.gt.shape[1]
         self.clin_covariate = hdf.root.GTBox.covar[range(1,12),:]
         self.regular_covariate = hdf.root.GTBox.covar[[0,], :]
         self.labels = (hdf.root.GTBox.lbl[:] + 1) / 2
+        hdf.close()
         
         # Get the number of samples
         self.num_samples = self.labels.shape[1]
         
 
+    def genotype_blocks(self, block_size):
+        '''
+        Generator over consecutive blocks of SNP columns of the genotype. When
+        the genotype is not held in memory, only one block at a time is read
+        from the HDF5 file.
+
+        :param block_size : The (maximum) number of SNPs in a block
+
+        Yields tuples (start, stop, block) where block is the
+        (num_samples x (stop - start)) genotype matrix of SNPs start..stop-1.
+        '''
+        if self.genotype_storage != "hdf5":
+            for start in range(0, self.num_snps, block_size):
+                stop = min(start + block_size, self.num_snps)
+                yield start, stop, self.genotype[:, start:stop]
+        else:
+            hdf = tb.open_file(self.input_path, mode='r')
+            try:
+                for start in range(0, self.num_snps, block_size):
+                    stop = min(start + block_size, self.num_snps)
+                    yield start, stop, hdf.root.GTBox.gt[:, start:stop]
+            finally:
+                hdf.close()
+
+
+    def genotype_block(self, start, stop):
+        '''
+        Get the genotype of the SNPs start..stop-1 (a single block, see
+        genotype_blocks).
+
+        Returns a (num_samples x (stop - start)) matrix.
+        '''
+        if self.genotype_storage != "hdf5":
+            return self.genotype[:, start:stop]
+        hdf = tb.open_file(self.input_path, mode='r')
+        try:
+            return hdf.root.GTBox.gt[:, start:stop]
+        finally:
+            hdf.close()
+
+
+    def genotype_moments(self, start, stop, mask, labels):
+        '''
+        Get the sufficient statistics of the Pearson correlation between the
+        SNPs start..stop-1 and the labels of every fold (see
+        batched_pearson.pearson_moments). A packed genotype computes them
+        without decoding the block.
+
+        :param mask : (num_samples x num_folds) matrix, 1 for the samples used
+
+        :param labels : (num_samples x num_folds) matrix with the labels
+        '''
+        if hasattr(self.genotype, "moments"):
+            return self.genotype.moments(start, stop, mask, labels)
+        # Imported here: scipy is only needed by univ_feature_sel
+        from utils.batched_pearson import pearson_moments
+        return pearson_moments(self.genotype_block(start, stop), mask, labels)
+
+
+    def genotype_products(self, start, stop, weights, squared_weights):
+        '''
+        Get the products G' * weights and (G * G)' * squared_weights of the
+        genotype G of the SNPs start..stop-1. A packed genotype computes them
+        without decoding the block.
+
+        :param weights, squared_weights : (num_samples x columns) matrices
+        '''
+        if hasattr(self.genotype, "products"):
+            return self.genotype.products(start, stop, weights, squared_weights)
+        x = np.asarray(self.genotype_block(start, stop), dtype='float64')
+        return np.dot(x.transpose(), weights), np.dot((x * x).transpose(), squared_weights)
+
+
+    def genotype_columns(self, snp_index, block_size=10000):
+        '''
+        Get the genotype of a subset of SNPs.
+
+        :param snp_index : The indices of the SNPs, in the order in which they
+                           should appear in the result
+
+        :param block_size : When the genotype is streamed, the number of SNPs
+                            read from the HDF5 file at once
+
+        Returns a (num_samples x len(snp_index)) matrix.
+        '''
+        snp_index = np.asarray(snp_index, dtype='int64')
+        if self.genotype_storage != "hdf5":
+            return self.genotype[:, snp_index]
+
+        columns = None
+        for start, stop, block in self.genotype_blocks(block_size):
+            in_block = np.nonzero((snp_index >= start) & (snp_index < stop))[0]
+            if in_block.shape[0] == 0:
+                continue
+            if columns is None:
+                columns = np.zeros((self.num_samples, snp_index.shape[0]), dtype=block.dtype)
+            columns[:, in_block] = block[:, snp_index[in_block] - start]
+        if columns is None:
+            columns = np.zeros((self.num_samples, 0))
+        return columns
+
+
     def add_fold_information(self, config):
         '''
         Load the information about the random folds.
@@ -55,7 +175,44 @@ class Dataset:
                         See the config_file parameter in the main script for more
                         details.
         '''
-        # Add the fold information to the Dataset object
-        self.folds = config.load_variable("cv_set_creation", "folds")
+        # Add the fold information to the Dataset object. Folds that were not
+        # materialized are regenerated from their seeds
+        task_name = "cv_set_creation"
+        materialized = config.get_entry(task_name, "materialize")
+        if materialized or not config.has_variable(task_name, "fold_seeds"):
+            self.folds = config.load_variable(task_name, "folds")
+        else:
+            seeds = np.atleast_1d(config.load_variable(task_name, "fold_seeds"))
+            stratified = config.get_entry(task_name, "stratified")
+            self.folds = generate_folds(self.num_samples, config.get_entry(task_name, "sizes"),
+                                        seeds, self.labels[0] if stratified else None)
         self.num_folds = 1 if (self.folds.ndim == 1) else self.folds.shape[1]
 
+        # The samples of every set of every fold (saved by cv_set_creation,
+        # built here for folds created by older versions or not materialized)
+        self.fold_index = FoldIndex()
+        if materialized and config.has_variable(task_name, "fold_index_indptr"):
+            self.fold_index.load(config, self.num_folds)
+        if self.fold_index.num_sets == 0 or self.fold_index.indptr[-1] != self.folds.size:
+            self.fold_index.build(self.folds)
+
+
+    def load_attributes(self, names):
+        '''
+        Make sure that the attributes in names are read (see LazyDataset). The
+        attributes of a Dataset are all read by load_dataset.
+        '''
+        pass
+
+
+    def select_folds(self, start, stop):
+        '''
+        Keep only the folds start..stop-1 (a shard of the folds, see
+        utils/shards.py). Fold i of the tasks is then fold fold_offset + i of
+        the whole run.
+        '''
+        folds = self.folds[:, np.newaxis] if self.folds.ndim == 1 else self.folds
+        self.folds = folds[:, start:stop]
+        self.num_folds = stop - start
+        self.fold_offset = start
+        self.fold_index = FoldIndex(self.folds)
@@ -0,0 +1,87 @@
+import numpy as np
+
+class FoldIndex:
+    '''
+    A class object with the samples of every set (I, II, III, or 0 for the
+    samples that are not assigned) of every fold, built once from the matrix
+    of folds.
+
+    The samples are stored in a compact CSR-like layout:
+    indices : the sample indices, grouped by fold and then by set, ascending
+              within each group
+    indptr  : the samples of set s in fold i are
+              indices[indptr[i * num_sets + s] : indptr[i * num_sets + s + 1]]
+    '''
+
+    def __init__(self, folds=None):
+        self.indptr = []
+        self.indices = []
+        self.num_sets = 0
+        self.num_folds = 0
+        if folds is not None:
+            self.build(folds)
+
+    def build(self, folds):
+        '''
+        Build the index from the matrix of folds.
+
+        :param folds : (num_samples x num_folds) matrix with the set of every
+                       sample in every fold
+        '''
+        folds = np.asarray(folds, dtype='int64')
+        if folds.ndim == 1:
+            folds = folds[:, np.newaxis]
+        self.num_folds = folds.shape[1]
+        self.num_sets = int(folds.max()) + 1
+
+        # A stable sort keeps the samples of a set in ascending order
+        order = np.argsort(folds, axis=0, kind='mergesort')
+        self.indices = np.asarray(order.transpose().ravel(), dtype='int32')
+        counts = np.zeros((self.num_folds, self.num_sets), dtype='int64')
+        for i in range(self.num_folds):
+            counts[i] = np.bincount(folds[:, i], minlength=self.num_sets)
+        self.indptr = np.concatenate([[0], np.cumsum(counts.ravel())])
+
+    def get(self, fold, romans):
+        '''
+        Get the samples of a fold that are in the given sets. Returns the same
+        indices as find_vec_entries_that_contain(folds[:, fold], romans).
+
+        :param fold   : the index of the fold
+
+        :param romans : a set number or a list of set numbers
+        '''
+        romans = sorted(set(int(r) for r in np.ravel(romans) if 0 <= r < self.num_sets))
+        parts = [self.indices[self.indptr[fold * self.num_sets + r]:
+                              self.indptr[fold * self.num_sets + r + 1]]
+                 for r in romans]
+        if len(parts) == 1:
+            return parts[0]
+        if len(parts) == 0:
+            return np.zeros(0, dtype='int32')
+        return np.sort(np.concatenate(parts))
+
+    def size(self, fold, romans):
+        '''
+        Get the number of samples of a fold that are in the given sets.
+        '''
+        return sum(self.indptr[fold * self.num_sets + r + 1] - self.indptr[fold * self.num_sets + r]
+                   for r in set(int(r) for r in np.ravel(romans) if 0 <= r < self.num_sets))
+
+    def save(self, config):
+        '''
+        Save the index next to the folds (output of cv_set_creation).
+        '''
+        config.save_variable("cv_set_creation", "%d", fold_index_indptr=self.indptr,
+                             fold_index_indices=self.indices)
+
+    def load(self, config, num_folds):
+        '''
+        Load an index saved with save.
+
+        :param num_folds : the number of folds of the index
+        '''
+        self.indptr = np.asarray(config.load_variable("cv_set_creation", "fold_index_indptr"), dtype='int64')
+        self.indices = np.asarray(config.load_variable("cv_set_creation", "fold_index_indices"), dtype='int32')
+        self.num_folds = num_folds
+        self.num_sets = (self.indptr.shape[0] - 1) // num_folds
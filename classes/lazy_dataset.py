@@ -0,0 +1,169 @@
+import os
+import numpy as np
+import tables as tb
+
+from classes.dataset import Dataset
+from classes.packed_genotype import PackedGenotype
+
+class LazyDataset(Dataset):
+    '''
+    A Dataset that reads nothing from the input file until it is used and
+    stores the genotype in a compact form.
+
+    The genotype calls [0, 1, 2] are stored as int8 or packed in 2 bits:
+    int8   : The matrix is read block by block from the HDF5 file into an int8
+             array when the genotype is first used.
+    mmap   : The matrix is written once, block by block, to an int8 .npy cache
+             file in the output directory and then memory-mapped (read-only).
+             Later runs on the same input file (same path, size and
+             modification time) reuse the cache.
+    packed : The matrix is read block by block into a PackedGenotype (4 calls
+             per byte). Blocks and columns are decoded to int8 when they are
+             used and the Pearson statistics are computed from the packed
+             bytes (see genotype_moments).
+
+    The covariates and the labels are read on first use. With int8 and mmap,
+    blocks of SNPs returned by genotype_blocks are views of the stored matrix
+    (no copy).
+    '''
+
+    # Attributes that are read from the input file on first use
+    _lazy_attributes = ["genotype", "clin_covariate", "regular_covariate", "labels"]
+
+    # Number of SNPs read from the HDF5 file at once when filling the genotype
+    read_block_size = 10000
+
+    def __init__(self):
+        Dataset.__init__(self)
+        self.genotype_cache = None
+        # Remove the placeholders so that __getattr__ loads them on first use
+        del self.genotype
+        del self.labels
+
+    def load_dataset(self, config):
+        '''
+        Record where the dataset is and read its dimensions. The data itself
+        is read on first use.
+
+        :param config : A YAML object with user-entered parameters. One of these
+                        parameters is the full path to an HDF5 file with the entire
+                        dataset to process.
+                        See the config_file parameter in the main script for more
+                        details.
+        '''
+        input_dir  = config.get_entry("global", "input_dir")
+        input_file = config.get_entry("global", "input_file")
+        self.genotype_storage = config.get_entry("global", "genotype_storage")
+        self.input_path = "%s/%s" % (input_dir, input_file)
+        self.genotype_cache = "%s/genotype.int8.npy" % config.get_entry("global", "output_dir")
+
+        # Only the shapes are read here
+        hdf = tb.open_file(self.input_path, mode='r')
+        self.num_snps = hdf.root.GTBox.gt.shape[1]
+        self.num_samples = hdf.root.GTBox.lbl.shape[1]
+        hdf.close()
+
+
+    def __getattr__(self, name):
+        '''
+        Read a lazy attribute from the input file the first time it is used.
+        '''
+        if name not in LazyDataset._lazy_attributes:
+            raise AttributeError(name)
+        if name == "genotype":
+            self.genotype = self._load_genotype()
+        elif name == "labels":
+            hdf = tb.open_file(self.input_path, mode='r')
+            self.labels = (hdf.root.GTBox.lbl[:] + 1) / 2
+            hdf.close()
+        else:
+            # Both covariates are views of the same matrix, read once
+            hdf = tb.open_file(self.input_path, mode='r')
+            covar = hdf.root.GTBox.covar[:]
+            hdf.close()
+            self.regular_covariate = covar[0:1, :]
+            self.clin_covariate = covar[1:12, :]
+        return self.__dict__[name]
+
+
+    def load_attributes(self, names):
+        '''
+        Read the lazy attributes in names that are not read yet, e.g. before
+        the dataset is copied or shared with forked workers (which would
+        otherwise read their own copy).
+        '''
+        for name in names:
+            getattr(self, name)
+
+
+    def _load_genotype(self):
+        '''
+        Get the int8 genotype matrix, either in memory or memory-mapped from
+        the cache file, or the packed genotype.
+        '''
+        shape = (self.num_samples, self.num_snps)
+        if self.genotype_storage == "packed":
+            genotype = PackedGenotype(self.num_samples, self.num_snps)
+            hdf = tb.open_file(self.input_path, mode='r')
+            for start in range(0, self.num_snps, self.read_block_size):
+                stop = min(start + self.read_block_size, self.num_snps)
+                genotype.set_block(start, hdf.root.GTBox.gt[:, start:stop])
+            hdf.close()
+            return genotype
+        if self.genotype_storage == "mmap":
+            if self._valid_cache(shape):
+                return np.load(self.genotype_cache, mmap_mode='r')
+            cache_dir = os.path.dirname(self.genotype_cache)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            # The cache is only valid once it is complete (see _valid_cache)
+            if os.path.exists(self._cache_stamp_file()):
+                os.remove(self._cache_stamp_file())
+            genotype = np.lib.format.open_memmap(self.genotype_cache, mode='w+',
+                                                 dtype='int8', shape=shape)
+        else:
+            genotype = np.zeros(shape, dtype='int8')
+
+        hdf = tb.open_file(self.input_path, mode='r')
+        for start in range(0, self.num_snps, self.read_block_size):
+            stop = min(start + self.read_block_size, self.num_snps)
+            genotype[:, start:stop] = hdf.root.GTBox.gt[:, start:stop]
+        hdf.close()
+
+        if self.genotype_storage == "mmap":
+            # Flush the cache, record its input and reopen it read-only
+            del genotype
+            with open(self._cache_stamp_file(), "w") as f:
+                f.write("%s\n" % self._input_stamp())
+            return np.load(self.genotype_cache, mmap_mode='r')
+        return genotype
+
+
+    def _cache_stamp_file(self):
+        '''
+        Get the file that records the input file of the cache.
+        '''
+        return "%s.stamp" % self.genotype_cache
+
+
+    def _input_stamp(self):
+        '''
+        Get the path, size and modification time of the input file.
+        '''
+        return "%s %d %d" % (os.path.abspath(self.input_path), os.path.getsize(self.input_path),
+                             int(os.path.getmtime(self.input_path)))
+
+
+    def _valid_cache(self, shape):
+        '''
+        Check that the cache file exists, was written from the input file as
+        it is now (same path, size and modification time) and has the shape
+        of the genotype matrix.
+        '''
+        stamp_file = self._cache_stamp_file()
+        if not os.path.exists(self.genotype_cache) or not os.path.exists(stamp_file):
+            return False
+        with open(stamp_file) as f:
+            if f.read().strip() != self._input_stamp():
+                return False
+        return np.load(self.genotype_cache, mmap_mode='r').shape == shape
@@ -0,0 +1,101 @@
+import numpy as np
+
+# Value of the 4 samples of a byte, for every byte (2 bits per sample, the
+# first sample in the lowest bits)
+_DECODE = np.array([[(byte >> (2 * k)) & 3 for k in range(4)] for byte in range(256)],
+                   dtype='int8')
+
+class PackedGenotype:
+    '''
+    A class object that stores the genotype calls [0, 1, 2] in 2 bits each,
+    SNP-major as in PLINK .bed files: row j of packed holds the calls of SNP
+    j, 4 samples per byte. This is 4 times smaller than int8 and 32 times
+    smaller than float64.
+
+    It can be indexed like the (num_samples x num_snps) genotype matrix for
+    the accesses of the pipeline, which return decoded int8 matrices:
+    genotype[:, start:stop] (a block of SNPs) and genotype[:, snp_index] (a
+    gather of SNPs).
+
+    Properties:
+    packed      : (num_snps x ceil(num_samples / 4)) uint8 matrix
+    num_samples : the number of samples
+    shape       : the shape of the unpacked matrix
+    '''
+
+    def __init__(self, num_samples, num_snps):
+        self.num_samples = num_samples
+        self.shape = (num_samples, num_snps)
+        self.packed = np.zeros((num_snps, (num_samples + 3) // 4), dtype='uint8')
+
+    def set_block(self, start, block):
+        '''
+        Pack a block of SNPs.
+
+        :param start : the index of the first SNP of the block
+
+        :param block : (num_samples x block_size) matrix with the calls
+        '''
+        calls = np.zeros((block.shape[1], self.packed.shape[1] * 4), dtype='uint8')
+        calls[:, :self.num_samples] = np.asarray(block, dtype='uint8').transpose()
+        calls = calls.reshape(block.shape[1], -1, 4)
+        self.packed[start:start + block.shape[1]] = (calls[:, :, 0] | (calls[:, :, 1] << 2) |
+                                                     (calls[:, :, 2] << 4) | (calls[:, :, 3] << 6))
+
+    def decode(self, packed_rows):
+        '''
+        Decode packed rows to a (num_samples x num_rows) int8 matrix.
+        '''
+        calls = _DECODE[packed_rows].reshape(packed_rows.shape[0], -1)
+        return calls[:, :self.num_samples].transpose()
+
+    def __getitem__(self, index):
+        '''
+        Get a decoded block or gather of SNPs: genotype[:, snps]. All samples
+        must be selected.
+        '''
+        samples, snps = index
+        if samples != slice(None):
+            raise IndexError("PackedGenotype only supports genotype[:, snps]")
+        return self.decode(self.packed[snps])
+
+    def products(self, start, stop, weights, squared_weights):
+        '''
+        Compute the products G' * weights and (G * G)' * squared_weights of the
+        block G of SNPs start..stop-1 directly from the packed bytes.
+
+        The k-th sample of every byte (samples k, k + 4, ...) is extracted with
+        a shift and a mask, and its contribution is a matrix product with the
+        corresponding rows of the weights, so the block is never decoded to a
+        samples x SNPs matrix.
+
+        :param weights, squared_weights : (num_samples x columns) matrices
+
+        Returns the (block_size x columns) products.
+        '''
+        packed = self.packed[start:stop]
+        product = np.zeros((stop - start, weights.shape[1]))
+        squared_product = np.zeros((stop - start, squared_weights.shape[1]))
+        for k in range(4):
+            rows = weights[k::4]
+            codes = ((packed[:, :rows.shape[0]] >> (2 * k)) & 3).astype('float64')
+            product += np.dot(codes, rows)
+            squared_product += np.dot(codes * codes, squared_weights[k::4])
+        return product, squared_product
+
+    def moments(self, start, stop, mask, labels):
+        '''
+        Compute the sufficient statistics of the Pearson correlation of the
+        SNPs start..stop-1 from the packed bytes (see
+        batched_pearson.pearson_moments, which returns the same tuple).
+
+        :param mask : (num_samples x num_folds) matrix, 1 for training samples
+
+        :param labels : (num_samples x num_folds) training labels
+        '''
+        num_folds = mask.shape[1]
+        sx_sxy, sxx = self.products(start, stop, np.hstack([mask, labels]), mask)
+        n = mask.sum(axis=0)
+        sy = labels.sum(axis=0)
+        syy = (labels * labels).sum(axis=0)
+        return n, sx_sxy[:, :num_folds], sxx, sy, syy, sx_sxy[:, num_folds:]
@@ -3,6 +3,16 @@
 # 
 # Augment training dataset by imputing phenotypes
 #
+# Usage: python run_cotraining.py config_file
+#        To spread the folds over several jobs (see utils/shards.py):
+#        python run_cotraining.py config_file --prepare
+#        python run_cotraining.py config_file --shard I/N   (or --folds START:STOP)
+#        python run_cotraining.py config_file --merge
+#        To run a grid of configurations on the same dataset (see utils/sweep.py):
+#        python run_cotraining.py config_file --sweep sweep_file
+#        To print the tasks that would be run, without running them:
+#        python run_cotraining.py config_file --dry-run
+#
 # Authors: Menno Witteveen
 #          Damian Roqueiro
 #-----------------------------------------------------------------------------
@@ -11,100 +21,427 @@
 import yaml
 import sys
 import logging
+import copy
+import argparse
+import importlib
 
 # Class imports
 from classes.dataset import Dataset
+from classes.lazy_dataset import LazyDataset
 from classes.config_state import ConfigState
 
-# Pipeline modules
-from utils.cv_set_creation import *
-from utils.phenotype_imputation import *
-from utils.univ_feature_sel import *
-from utils.random_forest import *
+# Pipeline modules (the modules of the tasks, and their dependencies such as
+# scikit-learn, are only imported when the task is run, see task_function)
+from utils.task_cache import *
+from utils.shards import parse_fold_range, use_shard, merge_shards, SHARDED_TASKS
+from utils.sweep import load_grid, sweep_config, link_shared_outputs, write_summary
+from utils.resources import dataset_shapes, estimate_resources, check_resources, resource_messages
+from utils import perf_metrics
+
+def task_function(task_name):
+    '''
+    Import the module of a task (utils/<task_name>.py) and return the function
+    that runs it, with the same name.
+    '''
+    return getattr(importlib.import_module("utils.%s" % task_name), task_name)
+
+# The function that runs each task
+TASK_FUNCTIONS = {
+    "cv_set_creation"      : lambda data, config: task_function("cv_set_creation")(
+                                 data.num_samples, config, data.labels[0]),
+    "phenotype_imputation" : lambda data, config: task_function("phenotype_imputation")(data, config),
+    "univ_feature_sel"     : lambda data, config: task_function("univ_feature_sel")(data, config),
+    "random_forest"        : lambda data, config: task_function("random_forest")(data, config),
+}
 
 # -----------------------------------------------------------------------------
 # Main
 # -----------------------------------------------------------------------------
-def run_pipeline(config_file):
+def load_configuration(config_file):
+    '''
+    Create the configuration object. It will contain all the parameters
+    entered by the user.
+    '''
+    try:
+        return ConfigState(config_file)
+    except yaml.YAMLError, exc:
+        print "Err: Cannot open configuration file: %s" % config_file, exc
+        sys.exit(1)
+
+def task_action(config, task_name, key, saved_key):
+    '''
+    Function to decide what to do with a task: "off" (switched off in the
+    configuration), "up to date" (its output on disk is reused) or "run".
+
+    Parameters
+    ----------
+    key : the current key of the task output (None if unknown)
+
+    saved_key : the key saved with its output on disk (None if none)
+    '''
+    if not config.get_entry("global", task_name):
+        return "off"
+    if config.get_entry("global", "use_cache") and key is not None and saved_key == key:
+        return "up to date"
+    return "run"
+
+def plan_tasks(config, digest, fold_range=None, prepare=False):
+    '''
+    Function to decide what run_pipeline will do with every task, before
+    anything is run.
+
+    Parameters
+    ----------
+    config : an object of class ConfigState (not changed)
+
+    digest : the digest of the dataset file, or None if it is not known (the
+        outputs on disk are then not checked)
+
+    fold_range, prepare : see run_pipeline
+
+    Returns
+    -------
+    A list of (task_name, action). The actions of the tasks that will be run
+    start with "run".
+    '''
+    config = copy.deepcopy(config)
+    execution = config.get_entry("global", "execution")
+    keys = {}
+    actions = {}
+    for task_name, dependencies in TASK_DEPENDENCIES:
+        key = None
+        if digest is not None and all(keys[name] is not None for name in dependencies):
+            key = task_key(config, task_name, [keys[name] for name in dependencies], digest)
+            if task_name == "cv_set_creation":
+                key = folds_key(config, key)
+        saved_key = load_key(config, task_name)
+        actions[task_name] = task_action(config, task_name, key, saved_key)
+        keys[task_name] = saved_key if (actions[task_name] == "off" and saved_key is not None) else key
+        if task_name == "cv_set_creation":
+            if actions[task_name] == "run" and fold_range is None:
+                # The keys of the downstream tasks depend on the folds, which
+                # are only known once they are created
+                keys[task_name] = None
+            if prepare:
+                break
+            if fold_range is not None:
+                # The shards never create the folds (see run_tasks)
+                if key is not None and saved_key == key:
+                    actions[task_name] = "up to date"
+                else:
+                    actions[task_name] = "error: the shards need up to date folds (run --prepare)"
+                use_shard(config, *fold_range)
+
+    if execution == "fused":
+        for task_name in ["phenotype_imputation", "univ_feature_sel"]:
+            if task_name in actions and actions[task_name] != "off":
+                actions[task_name] = ("run, fused with random_forest"
+                                      if actions.get("random_forest") == "run" else "not needed")
+    plan = []
+    for task_name, _ in TASK_DEPENDENCIES:
+        action = actions.get(task_name, "not run (--prepare)")
+        if fold_range is not None and task_name in SHARDED_TASKS and action == "run":
+            action = "run on folds %d:%d" % fold_range
+        plan.append((task_name, action))
+    return plan
+
+def run_pipeline(config_file, folds=None, shard=None, prepare=False):
     '''
     Main function to execute the entire cotraining pipeline. For each task to be
-    executed, a different module is invoked.
+    executed, a different module is invoked. Tasks whose output is up to date
+    with the dataset and the configuration are not run again.
     
     Parameters
     ----------
     config_file : The full path to a a YAML file with the parameters to execute
         the pipeline.
-    '''
 
-    # Create the configuration object. It will contain all the parameters 
-    # entered by the user
-    try:
-        config = ConfigState(config_file)
-    except yaml.YAMLError, exc:
-        print "Err: Cannot open configuration file: %s" % config_file, exc
-        sys.exit(1)
+    folds, shard : Run only the folds start:stop (folds) or the folds of the
+        shard "i/n" (shard), see utils/shards.py. The folds must have been
+        created before (prepare)
+
+    prepare : Only run cv_set_creation (before the shard jobs)
+    '''
+    config = load_configuration(config_file)
     
     # Parameter
     output_dir          = config.get_entry("global", "output_dir")
-    # Tasks to run
-    do_cv_set_creation  = config.get_entry("global", "cv_set_creation")
-    do_pheno_imputation = config.get_entry("global", "phenotype_imputation")
-    do_univ_feature_sel = config.get_entry("global", "univ_feature_sel")
-    do_random_forest    = config.get_entry("global", "random_forest")
+    fold_range = parse_fold_range(folds, shard, config.get_entry("cv_set_creation", "num_folds"))
     
     # -------------------------------------------------------------------------
-    # Create the log file
-    logging.basicConfig(filename="%s/exec.log" % output_dir, filemode='w',
+    # Create the log file (one per shard)
+    log_file = "exec.log" if fold_range is None else "exec.shard_%d_%d.log" % fold_range
+    logging.basicConfig(filename="%s/%s" % (output_dir, log_file), filemode='w',
                         level=logging.INFO,
                         format="[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 
+    # -------------------------------------------------------------------------
+    # Estimate the resources of the tasks to run (from the shape of the
+    # dataset) before loading it
+    digest = dataset_digest(config)
+    check_plan(config, digest, fold_range, prepare)
+
     # -------------------------------------------------------------------------
     # Load dataset in Dataset class object
+    data = load_data(config)
+
+    # -------------------------------------------------------------------------
+    # Run the tasks
+    run_tasks(config, data, digest, fold_range, prepare)
+
+def check_plan(config, digest, fold_range=None, prepare=False):
+    '''
+    Function to log the estimated resources of the tasks that will be run and
+    to check them against the limits of the configuration (see
+    utils/resources.py).
+    '''
+    tasks = [task_name for task_name, action in plan_tasks(config, digest, fold_range, prepare)
+             if action.startswith("run")]
+    num_folds = config.get_entry("cv_set_creation", "num_folds")
+    estimates, _ = estimate_resources(config, tasks, *dataset_shapes(config),
+                                      num_folds=num_folds if fold_range is None
+                                      else fold_range[1] - fold_range[0])
+    for task_name, memory_mb, disk_mb, time_s in estimates:
+        logging.info("Estimate %s: %.0f MB memory, %.0f MB disk, %.0f s"
+                     % (task_name, memory_mb, disk_mb, time_s))
+    check_resources(config, estimates)
+
+def load_data(config):
+    '''
+    Function to load the dataset in a Dataset class object (a LazyDataset for
+    the int8, mmap and packed genotype storages).
+    '''
     logging.info("Loading dataset")
-    data = Dataset()
+    if config.get_entry("global", "genotype_storage") in ("int8", "mmap", "packed"):
+        data = LazyDataset()
+    else:
+        data = Dataset()
     data.load_dataset(config)
     logging.info("End")
+    return data
 
-    # -------------------------------------------------------------------------
-    # Create the cotraining folds
-    # This step creates an index indicating what records are randomly assigned 
-    # to sets I, II and III
-    if do_cv_set_creation:
-        logging.info("Starting task: cv_set_creation")
-        cv_set_creation(data.num_samples, config)
-        logging.info("End")
-    else:
-        logging.info("Skipping task: cv_set_creation")
+def run_tasks(config, data, digest, fold_range=None, prepare=False, computed=None):
+    '''
+    Function to run the tasks of the pipeline on a loaded dataset.
+
+    Parameters
+    ----------
+    config : an object of class ConfigState
+
+    data : the dataset (see load_data)
+
+    digest : the digest of the dataset file (see dataset_digest)
+
+    fold_range, prepare : see run_pipeline
+
+    computed : a set with the keys of the task outputs computed earlier by
+        this process (see run_sweep), updated with the keys of the tasks run.
+        These outputs are reused even without use_cache
+    '''
+    checkpoint          = config.get_entry("global", "checkpoint")
+    execution           = config.get_entry("global", "execution")
+    if execution not in ("staged", "fused"):
+        raise ValueError("Unknown execution %s (staged or fused)" % execution)
+    if execution == "fused" and fold_range is not None:
+        raise ValueError("The shards use the staged execution (set execution: staged)")
 
     # -------------------------------------------------------------------------
-    # Get the random folds saved by the previous process and add them to
-    # the Dataset object
-    data.add_fold_information(config)
-
-    # Performing the phenotype imputation
-    if do_pheno_imputation:
-        logging.info("Starting task: phenotype_imputation")
-        phenotype_imputation(data, config)
-        logging.info("End")
-    else:
-        logging.info("Skipping task: phenotype_imputation")
-    
-    # Performing univariate feature selection
-    if do_univ_feature_sel:
-        logging.info("Starting task: univ_feature_sel")
-        univ_feature_sel(data, config)
-        logging.info("End")
-    else:
-        logging.info("Skipping task: univ_feature_sel")
-    
-    # Executing random forest
-    if do_random_forest:
-        logging.info("Starting task: random_forest")
-        random_forest(data, config)
-        logging.info("End")
-    else:
-        logging.info("Skipping task: random_forest")
+    # Run the tasks in the order of the dependency graph:
+    # 1. cv_set_creation: creates an index indicating what records are randomly
+    #    assigned to sets I, II and III (the cotraining folds)
+    # 2. phenotype_imputation: imputes the labels of set II
+    # 3. univ_feature_sel: ranks the SNPs in every fold
+    # 4. random_forest: the genotype classifier
+    # A task is run when it is switched on and its output is missing or was
+    # computed from other inputs (see utils/task_cache.py). In the fused
+    # execution, tasks 2-4 are run fold by fold when random_forest is run
+    # (see utils/fused.py)
+    keys = {}
+    for task_name, dependencies in TASK_DEPENDENCIES:
+        key = task_key(config, task_name, [keys[name] for name in dependencies], digest)
+        saved_key = load_key(config, task_name)
+        if task_name == "cv_set_creation":
+            # The output of cv_set_creation is keyed by the folds on disk, so
+            # that the downstream tasks are run again when the folds change
+            # (see task_cache.folds_key)
+            input_key = key
+            key = folds_key(config, input_key)
+
+        if execution == "fused" and task_name in ("phenotype_imputation", "univ_feature_sel"):
+            if not config.get_entry("global", task_name):
+                raise ValueError("The fused execution runs %s with random_forest: switch it on "
+                                 "(or set execution: staged)" % task_name)
+            keys[task_name] = key
+            continue
+        if task_name == "cv_set_creation" and fold_range is not None:
+            # The shards must share the folds: they use the prepared folds and
+            # never create them (even without use_cache)
+            if key is None or saved_key != key:
+                raise ValueError("The folds are not up to date: create them first "
+                                 "(run_cotraining.py config_file --prepare)")
+            action = "up to date"
+        else:
+            action = task_action(config, task_name, key, saved_key)
+        if action == "run" and computed is not None and key in computed and saved_key == key:
+            action = "up to date"
+        if action == "off":
+            logging.info("Skipping task: %s" % task_name)
+            # Downstream tasks depend on the output that is on disk
+            keys[task_name] = saved_key if saved_key is not None else key
+        elif action == "up to date":
+            logging.info("Skipping task: %s (up to date)" % task_name)
+            keys[task_name] = key
+        else:
+            logging.info("Starting task: %s" % task_name)
+            save_key(config, task_name, None)
+            if checkpoint and task_name in CHECKPOINTED_TASKS:
+                prepare_checkpoints(config, task_name, key)
+            with perf_metrics.measure(config, task_name), perf_metrics.profile(config, task_name):
+                if execution == "fused" and task_name == "random_forest":
+                    from utils.fused import run_fused
+                    run_fused(data, config)
+                else:
+                    TASK_FUNCTIONS[task_name](data, config)
+            if task_name == "cv_set_creation":
+                key = folds_key(config, input_key)
+            save_key(config, task_name, key)
+            keys[task_name] = key
+            if computed is not None:
+                computed.add(key)
+            logging.info("End")
+
+        if task_name == "cv_set_creation":
+            if prepare:
+                break
+            # Get the random folds saved by the previous process and add them to
+            # the Dataset object
+            data.add_fold_information(config)
+            if fold_range is not None:
+                # Only the folds of the shard, with outputs in its subdirectories
+                data.select_folds(*fold_range)
+                use_shard(config, *fold_range)
+
+def plan_pipeline(config_file, folds=None, shard=None, prepare=False):
+    '''
+    Function to print what run_pipeline would do with the same arguments (dry
+    run): the size of the dataset, read from the shapes of the arrays of the
+    HDF5 file, the action of every task and the estimated resources of the
+    tasks to run (see utils/resources.py). No data is loaded, no task module
+    is imported and nothing is written.
+
+    The outputs on disk can only be checked if the digest of the dataset file
+    is cached (see dataset_digest): otherwise every switched on task is
+    reported as run.
+    '''
+    config = load_configuration(config_file)
+    num_folds = config.get_entry("cv_set_creation", "num_folds")
+    fold_range = parse_fold_range(folds, shard, num_folds)
+    num_samples, num_snps, itemsize = dataset_shapes(config)
+    print "Dataset: %s/%s (%d samples x %d SNPs)" % (config.get_entry("global", "input_dir"),
+        config.get_entry("global", "input_file"), num_samples, num_snps)
+    print "Folds: %d%s, execution: %s, genotype storage: %s, n_jobs: %d" % (
+        num_folds, "" if fold_range is None else " (running %d:%d)" % fold_range,
+        config.get_entry("global", "execution"), config.get_entry("global", "genotype_storage"),
+        config.get_entry("global", "n_jobs"))
+
+    digest = dataset_digest(config, cached_only=True)
+    if digest is None:
+        print "The digest of the dataset is not cached: the outputs on disk are not checked"
+    plan = plan_tasks(config, digest, fold_range, prepare)
+    estimates, (load_mb, load_time) = estimate_resources(
+        config, [task_name for task_name, action in plan if action.startswith("run")],
+        num_samples, num_snps, itemsize,
+        num_folds if fold_range is None else fold_range[1] - fold_range[0])
+    messages = resource_messages(config, estimates)
+    estimates = dict((estimate[0], estimate[1:]) for estimate in estimates)
+
+    print "  %-22s %-32s %10s %10s %10s" % ("task", "action", "memory MB", "disk MB", "time s")
+    print "  %-22s %-32s %10.0f %10s %10.0f" % ("(load dataset)", "", load_mb, "", load_time)
+    for task_name, action in plan:
+        if task_name in estimates:
+            print "  %-22s %-32s %10.0f %10.0f %10.0f" % ((task_name, action) + estimates[task_name])
+        else:
+            print "  %-22s %s" % (task_name, action)
+    for message in messages:
+        print "Warning: %s" % message
+
+def run_sweep(config_file, sweep_file):
+    '''
+    Function to run the pipeline for every configuration of a sweep (see
+    utils/sweep.py). The dataset is loaded once, and the outputs of the
+    upstream tasks are computed once for the configurations that share them.
+
+    Parameters
+    ----------
+    config_file : The base configuration
+
+    sweep_file : The YAML file with the values of the swept entries
+    '''
+    config = load_configuration(config_file)
+    output_dir = config.get_entry("global", "output_dir")
+    logging.basicConfig(filename="%s/exec.sweep.log" % output_dir, filemode='w',
+                        level=logging.INFO,
+                        format="[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    grid = load_grid(config, sweep_file)
+    names = ["config_%03d" % (k + 1) for k in range(len(grid))]
+    configs = [sweep_config(config, overrides, "%s/%s" % (output_dir, name))
+               for name, overrides in zip(names, grid)]
+    digest = dataset_digest(config)
+
+    # Check every configuration before loading the dataset
+    for name, overrides, sweep in zip(names, grid, configs):
+        logging.info("Configuration %s: %s" % (name, ", ".join(
+            "%s.%s=%s" % (section, key, value) for section, key, value in overrides)))
+        link_shared_outputs(sweep, digest, "%s/shared" % output_dir)
+        check_plan(sweep, digest)
+
+    data = load_data(config)
+    computed = set()
+    for name, sweep in zip(names, configs):
+        logging.info("Running configuration %s" % name)
+        run_tasks(sweep, data, digest, computed=computed)
+        write_summary(output_dir, names, grid, configs)
+
+def merge_pipeline(config_file):
+    '''
+    Function to merge the outputs of the shard jobs (see utils/shards.py).
+
+    Parameters
+    ----------
+    config_file : The configuration of the shard jobs
+    '''
+    config = load_configuration(config_file)
+    logging.basicConfig(filename="%s/exec.merge.log" % config.get_entry("global", "output_dir"),
+                        filemode='w', level=logging.INFO,
+                        format="[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    merge_shards(config, config.get_entry("cv_set_creation", "num_folds"), dataset_digest(config))
+    logging.info("End")
         
 if __name__ in "__main__":
-    # TODO check command line arguments. Add syntax/usage output
-    run_pipeline(sys.argv[1])
+    parser = argparse.ArgumentParser(description="Run the co-training pipeline")
+    parser.add_argument("config_file", help="YAML file with the parameters of the pipeline")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--folds", metavar="START:STOP",
+                      help="only run the folds START..STOP-1 (0-based)")
+    mode.add_argument("--shard", metavar="I/N",
+                      help="only run the folds of shard I (0-based) of N shards")
+    mode.add_argument("--prepare", action="store_true",
+                      help="only create the folds, before running the shards")
+    mode.add_argument("--merge", action="store_true",
+                      help="merge the outputs of the shards")
+    mode.add_argument("--sweep", metavar="SWEEP_FILE",
+                      help="run every configuration of the grid of SWEEP_FILE")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="print the tasks that would be run, without running them")
+    args = parser.parse_args()
+    if args.dry_run and (args.merge or args.sweep):
+        parser.error("--dry-run cannot be combined with --merge or --sweep")
+
+    if args.dry_run:
+        plan_pipeline(args.config_file, args.folds, args.shard, args.prepare)
+    elif args.merge:
+        merge_pipeline(args.config_file)
+    elif args.sweep:
+        run_sweep(args.config_file, args.sweep)
+    else:
+        run_pipeline(args.config_file, args.folds, args.shard, args.prepare)
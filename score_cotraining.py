@@ -0,0 +1,45 @@
+#-----------------------------------------------------------------------------
+# Script to score new samples with the models of a co-training run
+#
+# Usage: python score_cotraining.py config_file input_file output_file
+#            [--batch-size 10000]
+#
+# config_file is the configuration of the run that saved the models (with
+# save_models set), input_file an HDF5 file with the new samples (same layout
+# as the input of the pipeline) and output_file the tab-separated file with
+# the averaged predictions (see utils/score.py). No model is refitted.
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+# System imports
+import yaml
+import sys
+import logging
+import argparse
+
+# Class imports
+from classes.config_state import ConfigState
+
+# Pipeline modules
+from utils.score import score_samples
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score new samples with the saved fold models")
+    parser.add_argument("config_file")
+    parser.add_argument("input_file")
+    parser.add_argument("output_file")
+    parser.add_argument("--batch-size", type=int, default=10000,
+                        help="number of samples scored at once")
+    args = parser.parse_args()
+
+    try:
+        config = ConfigState(args.config_file)
+    except yaml.YAMLError, exc:
+        print "Err: Cannot open configuration file: %s" % args.config_file, exc
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(message)s",
+                        datefmt="%Y-%m-%d %H:%M:%S")
+    score_samples(config, args.input_file, args.output_file, args.batch_size)
@@ -0,0 +1,144 @@
+#-----------------------------------------------------------------------------
+# Bagged logistic regression, fitted as one batched optimization problem
+#
+# Equivalent to
+#   BaggingClassifier(base_estimator=LogisticRegression(), max_samples=0.632,
+#                     max_features=5, bootstrap=True, bootstrap_features=True)
+# but instead of thousands of separate fits on tiny bootstrap samples, the
+# replicates are stacked and fitted together by Newton's method: the
+# gradients and Hessians of a batch of replicates are computed with a few
+# array operations and the Newton steps with one batched linear solve.
+#
+# Every replicate minimizes the objective of LogisticRegression (liblinear,
+# L2 penalty, the intercept being a penalized constant feature):
+#   0.5 * w'w + C * sum_i c_i * log(1 + exp(-y_i * w'z_i))
+# where c_i is the number of times sample i is drawn in the bootstrap.
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import numpy as np
+
+
+def _sigmoid(eta):
+    return 0.5 * (1.0 + np.tanh(0.5 * eta))
+
+
+class BaggedLogisticRegression:
+    '''
+    A bagged ensemble of L2-penalized logistic regressions on bootstrapped
+    samples and features, with the interface of a scikit-learn classifier
+    (fit / predict_proba).
+
+    Properties:
+    features  : (n_estimators x max_features) indices of the features of each
+                replicate
+    coef      : (n_estimators x (max_features + 1)) weights of each replicate,
+                the last column being the intercept
+    classes_  : the two class labels
+    '''
+
+    def __init__(self, n_estimators=10, max_samples=0.632, max_features=5,
+                 bootstrap=True, bootstrap_features=True, C=1.0,
+                 random_state=None, batch_size=1000, max_iter=100, tol=1e-8):
+        self.n_estimators = n_estimators
+        self.max_samples = max_samples
+        self.max_features = max_features
+        self.bootstrap = bootstrap
+        self.bootstrap_features = bootstrap_features
+        self.C = C
+        self.random_state = random_state
+        self.batch_size = batch_size
+        self.max_iter = max_iter
+        self.tol = tol
+
+
+    def _draw_replicates(self, n_samples, n_features, rng):
+        '''
+        Draw the samples (as counts) and the features of every replicate, as
+        BaggingClassifier does.
+        '''
+        max_samples = self.max_samples
+        if isinstance(max_samples, float):
+            max_samples = int(max_samples * n_samples)
+        counts = np.zeros((self.n_estimators, n_samples))
+        features = np.zeros((self.n_estimators, self.max_features), dtype='int64')
+        for b in range(self.n_estimators):
+            if self.bootstrap_features:
+                features[b] = rng.randint(0, n_features, self.max_features)
+            else:
+                features[b] = rng.permutation(n_features)[:self.max_features]
+            if self.bootstrap:
+                counts[b] = np.bincount(rng.randint(0, n_samples, max_samples),
+                                        minlength=n_samples)
+            else:
+                counts[b, rng.permutation(n_samples)[:max_samples]] = 1
+        return counts, features
+
+
+    def _design(self, X, features):
+        '''
+        Stack the design matrices of a batch of replicates:
+        (batch x n_samples x (max_features + 1)), with a constant last column.
+        '''
+        Z = np.ones((features.shape[0], X.shape[0], self.max_features + 1))
+        Z[:, :, :-1] = X.transpose()[features].transpose(0, 2, 1)
+        return Z
+
+
+    def fit(self, X, y):
+        '''
+        Fit all the replicates.
+
+        Parameters
+        ----------
+        X : (n_samples x n_features) matrix
+
+        y : the binary labels of the samples
+        '''
+        X = np.asarray(X, dtype='float64')
+        y = np.ravel(y)
+        self.classes_ = np.unique(y)
+        y01 = (y == self.classes_[-1]).astype('float64')
+        rng = np.random.RandomState(self.random_state)
+
+        counts, self.features = self._draw_replicates(X.shape[0], X.shape[1], rng)
+        dim = self.max_features + 1
+        self.coef = np.zeros((self.n_estimators, dim))
+        for start in range(0, self.n_estimators, self.batch_size):
+            stop = min(start + self.batch_size, self.n_estimators)
+            Z = self._design(X, self.features[start:stop])
+            c = counts[start:stop]
+            w = np.zeros((stop - start, dim))
+            Zt = Z.transpose(0, 2, 1)
+            for _ in range(self.max_iter):
+                p = _sigmoid(np.matmul(Z, w[:, :, np.newaxis])[:, :, 0])
+                grad = w + self.C * np.matmul(Zt, (c * (p - y01))[:, :, np.newaxis])[:, :, 0]
+                hess = self.C * np.matmul(Zt, Z * (c * p * (1.0 - p))[:, :, np.newaxis])
+                hess += np.eye(dim)
+                step = np.linalg.solve(hess, grad[:, :, np.newaxis])[:, :, 0]
+                w -= step
+                if np.abs(step).max() < self.tol:
+                    break
+            self.coef[start:stop] = w
+        return self
+
+
+    def predict_proba(self, X):
+        '''
+        Average of the class probabilities predicted by the replicates.
+
+        Returns
+        -------
+        A (n_samples x 2) matrix, the columns ordered as classes_.
+        '''
+        X = np.asarray(X, dtype='float64')
+        proba = np.zeros(X.shape[0])
+        for start in range(0, self.n_estimators, self.batch_size):
+            stop = min(start + self.batch_size, self.n_estimators)
+            Z = self._design(X, self.features[start:stop])
+            eta = np.matmul(Z, self.coef[start:stop, :, np.newaxis])[:, :, 0]
+            proba += _sigmoid(eta).sum(axis=0)
+        proba /= self.n_estimators
+        return np.column_stack([1.0 - proba, proba])
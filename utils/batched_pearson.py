@@ -0,0 +1,189 @@
+#-----------------------------------------------------------------------------
+# Batched Pearson correlation between blocks of SNPs and the training labels
+# of many folds at once
+#
+# Every fold is described by two (num_samples x num_folds) matrices:
+#   mask   : 1 if the sample is in the training set of the fold, 0 otherwise
+#   labels : the training label of the sample in the fold (0 when masked out)
+# With these, the sums needed by the Pearson correlation of all SNPs in a
+# block against all folds reduce to three matrix products.
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import numpy as np
+from scipy.special import betainc
+
+
+def pearson_moments(genotype_block, mask, labels):
+    '''
+    Function to compute the sufficient statistics of the Pearson correlation
+    between every SNP of a block and the training labels of every fold.
+
+    Parameters
+    ----------
+    genotype_block : (num_samples x block_size) matrix with SNP calls
+
+    mask : (num_samples x num_folds) matrix, 1 for training samples of a fold
+
+    labels : (num_samples x num_folds) matrix with the training labels of each
+        fold, 0 for samples that are not used for training
+
+    Returns
+    -------
+    A tuple (n, sx, sxx, sy, syy, sxy). n, sy and syy have one entry per fold,
+    sx, sxx and sxy are (block_size x num_folds) matrices.
+    '''
+    x = np.asarray(genotype_block, dtype='float64')
+    n = mask.sum(axis=0)
+    sy = labels.sum(axis=0)
+    syy = (labels * labels).sum(axis=0)
+    sx = np.dot(x.transpose(), mask)
+    sxx = np.dot((x * x).transpose(), mask)
+    sxy = np.dot(x.transpose(), labels)
+    return n, sx, sxx, sy, syy, sxy
+
+
+def pearson_from_moments(n, sx, sxx, sy, syy, sxy):
+    '''
+    Function to compute the Pearson correlation coefficient and its two-sided
+    p-value from the sufficient statistics returned by pearson_moments. The
+    p-value is computed as in scipy.stats.pearsonr. SNPs that are constant in
+    the training set of a fold get a NaN correlation and p-value.
+
+    Returns
+    -------
+    A tuple (r, pval) of (block_size x num_folds) matrices.
+    '''
+    # The variance terms of constant SNPs (or labels) are only zero up to
+    # rounding errors, while the numerator keeps its own rounding noise; the
+    # correlation is undefined below a tolerance relative to n * sxx
+    num = n * sxy - sx * sy
+    var_x = n * sxx - sx * sx
+    var_y = n * syy - sy * sy
+    constant = (var_x <= 1e-10 * n * sxx) | (var_y <= 1e-10 * n * syy)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.where(constant, np.nan, num / np.sqrt(np.where(constant, 1.0, var_x * var_y)))
+    return r, pearson_pval_from_r(r, n)
+
+
+def pearson_pval_from_r(r, n):
+    '''
+    Function to compute the two-sided p-value of Pearson correlation
+    coefficients r computed on n samples (n broadcasts against r).
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.clip(r, -1.0, 1.0)
+        df = n - 2.0
+        t_squared = r * r * (df / ((1.0 - r) * (1.0 + r)))
+        return betainc(0.5 * df, 0.5, df / (df + t_squared))
+
+
+def pearson_pval_block(genotype_block, mask, labels):
+    '''
+    Function to compute the p-values of the Pearson correlation between every
+    SNP of a block and the training labels of every fold.
+
+    Parameters
+    ----------
+    genotype_block : (num_samples x block_size) matrix with SNP calls
+
+    mask : (num_samples x num_folds) matrix, 1 for training samples of a fold
+
+    labels : (num_samples x num_folds) matrix with the training labels of each
+        fold, 0 for samples that are not used for training
+
+    Returns
+    -------
+    A (block_size x num_folds) matrix of p-values.
+    '''
+    return pearson_from_moments(*pearson_moments(genotype_block, mask, labels))[1]
+
+
+def permuted_labels(labels, mask, seed, num_permutations):
+    '''
+    Function to permute the training labels of a fold among its training
+    samples.
+
+    Parameters
+    ----------
+    labels, mask : the columns of labels and mask of the fold
+
+    seed : the seed of the permutations (an integer or a list of integers).
+        The same seed gives the same permutations
+
+    num_permutations : the number of permutations
+
+    Returns
+    -------
+    A (num_samples x num_permutations) matrix, 0 for the samples that are not
+    used for training.
+    '''
+    rng = np.random.RandomState(seed)
+    trn = np.nonzero(mask)[0]
+    order = np.argsort(rng.rand(num_permutations, trn.shape[0]), axis=1)
+    permuted = np.zeros((labels.shape[0], num_permutations))
+    permuted[trn, :] = labels[trn][order].transpose()
+    return permuted
+
+
+def pearson_permutations(genotype_block, moments, mask, labels, seeds, num_permutations,
+                         test, batch_size=500):
+    '''
+    Function to score permutations of the training labels of every fold
+    against a block of SNPs. Permuting the labels among the training samples
+    only changes sxy, so every batch of permutations costs one matrix product
+    (genotype_block' * permuted labels); the other sufficient statistics are
+    those of the observed labels. The permutations of a batch depend only on
+    the seed of the fold and the batch, so every block sees the same
+    permutations.
+
+    Parameters
+    ----------
+    genotype_block : (num_samples x block_size) matrix with SNP calls
+
+    moments : the sufficient statistics of the block and the observed labels
+        (see pearson_moments)
+
+    mask, labels : the (num_samples x num_folds) training mask and labels
+
+    seeds : the seed of the permutations of every fold
+
+    num_permutations : the number of permutations per fold
+
+    test : "empirical" or "maxT"
+
+    batch_size : the number of permutations of a fold scored at once
+
+    Returns
+    -------
+    empirical : a (block_size x num_folds) matrix with the number of
+        permutations whose |r| is at least the observed |r| of the SNP
+    maxT : a (num_folds x num_permutations) matrix with the maximum |r| over
+        the SNPs of the block in every permutation
+    '''
+    n, sx, sxx, sy, syy, sxy = moments
+    x = np.asarray(genotype_block, dtype='float64')
+    num_snps, num_folds = sxy.shape
+    if test == "empirical":
+        result = np.zeros((num_snps, num_folds), dtype='int64')
+    else:
+        result = np.zeros((num_folds, num_permutations))
+
+    for i in range(num_folds):
+        # |r| is compared through its numerator (the denominator does not
+        # change), with a relative tolerance for rounding errors
+        observed = np.abs(n[i] * sxy[:, i] - sx[:, i] * sy[i])[:, np.newaxis] * (1.0 - 1e-10)
+        den = (n[i] * sxx[:, i] - sx[:, i] * sx[:, i]) * (n[i] * syy[i] - sy[i] * sy[i])
+        scale = np.where(den > 0, 1.0 / np.sqrt(np.where(den > 0, den, 1.0)), 0.0)[:, np.newaxis]
+        for start in range(0, num_permutations, batch_size):
+            stop = min(start + batch_size, num_permutations)
+            permuted = permuted_labels(labels[:, i], mask[:, i], [seeds[i], start], stop - start)
+            num = np.abs(n[i] * np.dot(x.transpose(), permuted) -
+                         (sx[:, i] * sy[i])[:, np.newaxis])
+            if test == "empirical":
+                result[:, i] += (num >= observed).sum(axis=1)
+            else:
+                result[i, start:stop] = (num * scale).max(axis=0)
+    return result
@@ -1,20 +1,91 @@
 #-----------------------------------------------------------------------------
 # Creation of cross-validation datasets
 #  
+# Every fold is generated from its own seed (derived from the global seed),
+# so any single fold can be reproduced on demand from its seed. All folds
+# are generated at once with one batched permutation.
+#
 # Authors: Menno Witteveen
 #          Damian Roqueiro
 #-----------------------------------------------------------------------------
 
 import numpy as np
 from math import floor
-from sklearn import cross_validation
 
-def cv_set_creation(n, config):   
+from classes.fold_index import FoldIndex
+
+# Pipeline auxiliary functions
+from generic_functions import fold_seeds
+
+def _set_template(n, set_sizes):
+    '''
+    Function to get the set of every position of a random permutation of n
+    samples: the first floor(size_III * n) samples go to set III, the next
+    floor(size_II * n) to set II and the rest to set I. If the sizes of I, II
+    and III do not add up to 100%, only floor(size_I * n) samples go to set I
+    and the rest are not assigned (0).
+    '''
+    size_1 = set_sizes["set_I"]
+    size_2 = set_sizes["set_II"]
+    size_3 = set_sizes["set_III"]
+    full_partition = True if (size_1 + size_2 + size_3 == 1.0) else False
+
+    n_3 = int(floor(size_3 * n))
+    n_2 = int(floor(size_2 * n))
+    n_1 = n - n_3 - n_2 if full_partition else int(floor(size_1 * n))
+    template = np.zeros(n, 'int32')
+    template[0:n_3] = 3
+    template[n_3:n_3 + n_2] = 2
+    template[n_3 + n_2:n_3 + n_2 + n_1] = 1
+    return template
+
+def generate_folds(n, set_sizes, seeds, labels=None):
+    '''
+    Function to generate the folds from their seeds. Fold i is a random
+    permutation of the samples drawn with seeds[i], cut into sets III, II and
+    I. With labels, the samples of every class are permuted and cut
+    separately (stratified folds).
+
+    Parameters
+    ----------
+    n : the number of samples
+
+    set_sizes : the relative sizes of the sets I, II and III (set_I, set_II,
+        set_III)
+
+    seeds : the seed of every fold
+
+    labels : if given, the class of every sample
+
+    Returns
+    -------
+    A (n x len(seeds)) matrix with the set of every sample in every fold.
+    '''
+    # One row of random keys per fold; sorting them gives the permutations
+    keys = np.vstack([np.random.RandomState(seed).rand(n) for seed in seeds])
+    mat_folds = np.zeros((n, len(seeds)), 'int32')
+    if labels is None:
+        strata = [np.arange(n)]
+    else:
+        labels = np.ravel(labels)
+        strata = [np.nonzero(labels == c)[0] for c in np.unique(labels)]
+
+    for samples in strata:
+        template = _set_template(samples.shape[0], set_sizes)
+        order = np.argsort(keys[:, samples], axis=1)
+        mat_folds[samples[order], np.arange(len(seeds))[:, np.newaxis]] = template
+    return mat_folds
+
+def cv_set_creation(n, config, labels=None):   
     '''
     Function to generate the cross-validation data. Samples are randomly 
     assigned to one of three sets: I, II or III. Each assignment of all samples
     is called a fold. Cross-validation is performed by randomly generating many
     folds.
+
+    The seeds of the folds are always saved. The matrix of folds is only saved
+    when materialize is set; otherwise it is regenerated from the seeds when
+    it is loaded (see Dataset.add_fold_information).
     
     Parameters
     ----------
@@ -23,56 +94,28 @@ def cv_set_creation(n, config):
     config : an object of class ConfigState. It contains the user-entered 
         parameters in a YAML format.
         See the config_file parameter in the main script for more details.
+
+    labels : the class of every sample, used for stratified folds
     '''
     
     # Parameters:
     task_name = "cv_set_creation"
     num_folds = config.get_entry(task_name, "num_folds")
     set_sizes = config.get_entry(task_name, "sizes")
+    stratified = config.get_entry(task_name, "stratified")
+    materialize = config.get_entry(task_name, "materialize")
+    seed = config.get_entry("global", "seed")
 
-    # Get the sizes of the sets
-    size_1 = set_sizes["set_I"]
-    size_2 = set_sizes["set_II"]
-    size_3 = set_sizes["set_III"]
-
-    # Initialize the matrix with folds.
-    # Each row is a sample and the columns indicate if the sample is assigned to
-    # set I, II or III
-    mat_folds = np.zeros((n, num_folds), 'int32')
-
-    # To partition data into 3 sets, perform shuffle split in 3 steps:
-    # 1. Split the data into III and <rest_1>, use the indices of III
-    # 2. Split <rest_1> into II and <rest_2>, use the indices for II
-    # 3. If size of I+II+III is not 100%, then split <rest_2> into I and <rest_3>, use the indices for I
-    full_partition = True if (size_1 + size_2 + size_3 == 1.0) else False
-
-    # 1. Split the data into III and <rest_1>, use the indices of III
-#    rs1 = cross_validation.ShuffleSplit(n, n_iter=num_folds, test_size=int(floor(size_3 * n)), random_state=0)
-    rs1 = cross_validation.ShuffleSplit(n, n_iter=num_folds, test_size=int(floor(size_3 * n)))
-    for i, (train_index, test_index) in zip(range(num_folds), rs1):
-        # Assign to set III
-        mat_folds[test_index, i] = 3
-
-        # 2. Split <rest_1> into II and <rest_2>, use the indices for II
-        orig_index = train_index
-        rs2 = cross_validation.ShuffleSplit(len(orig_index), n_iter=1, test_size=int(floor(size_2 * n)))
-        for train_index, test_index in rs2:
-            # Assign to set II
-            mat_folds[orig_index[test_index], i] = 2
-
-            # 3. If size of I+II+III is not 100%, then split <rest_2> into I and <rest_3>, use the indices for I
-            if full_partition:
-                # Assign to set I
-                # The data is fully partitioned, take the remaining from rs2
-                mat_folds[orig_index[train_index], i] = 1
-            else:
-                # Not fully partitioned. Split one more time
-                orig_index = orig_index[train_index]
-                rs3 = cross_validation.ShuffleSplit(len(orig_index), n_iter=1, test_size=int(floor(size_1 * n)))
-                for train_index, test_index in rs3:
-                    # Assign to set I and the rest remains 0
-                    mat_folds[orig_index[test_index], i] = 1
+    # The seeds of the folds are saved, so they must be fixed even without a
+    # global seed
+    if seed is None:
+        seed = np.random.randint(0, 2**31 - 1)
+    seeds = np.asarray(fold_seeds(seed, num_folds, task_name), dtype='int64')
 
     # Save the output of this task (format = integers)
-    config.save_variable(task_name, "%d", folds=mat_folds)
-    
+    config.save_variable(task_name, "%d", fold_seeds=seeds)
+    if materialize:
+        mat_folds = generate_folds(n, set_sizes, seeds, labels if stratified else None)
+        config.save_variable(task_name, "%d", folds=mat_folds)
+        # and the index of the samples of every set, used by the other tasks
+        FoldIndex(mat_folds).save(config)
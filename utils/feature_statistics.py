@@ -0,0 +1,186 @@
+#-----------------------------------------------------------------------------
+# Sufficient statistics of the univariate feature selection, updated
+# incrementally with new samples
+#
+# The Pearson correlation of a SNP x with the training labels y of a fold
+# only depends on the sums n, sx, sxx, sy, syy and sxy over the training
+# samples of the fold (see batched_pearson.py). These sums are additive:
+# the statistics of a cohort with new samples are the statistics of the
+# cohort plus those of the new samples, so the p-values and the ranking of
+# the SNPs can be updated by reading the new samples only.
+#
+# With save_statistics, univ_feature_sel saves the statistics of every fold
+# (stat_n, stat_sy, stat_syy with one entry per fold and stat_sx, stat_sxx,
+# stat_sxy as (num_folds x num_snps) matrices) and a description of their
+# content in statistics.json: the base (the dataset, the training samples and
+# the labels of the folds it was computed from) and the files of new samples
+# that were added. The files listed in added_samples (HDF5 files in the
+# layout of the input file, with the same SNPs) are added to the training
+# set of every fold, with their phenotype (GTBox/lbl) as label. When the
+# saved statistics have the same base and the files already added are the
+# first ones of added_samples, only the other files are read.
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+import tables as tb
+
+from task_cache import dataset_digest, file_digest, input_file_paths
+
+# The statistics, in the order of the arguments of pearson_from_moments
+STATISTICS = ["n", "sx", "sxx", "sy", "syy", "sxy"]
+
+# Name of the description of the saved statistics, in the output directory of
+# univ_feature_sel
+STATISTICS_FILE = "statistics.json"
+
+
+def statistics_base(config, mask, trn_labels):
+    '''
+    Function to identify the cohort part of the statistics: a digest of the
+    dataset and of the training samples and labels of the folds.
+    '''
+    sha = hashlib.sha1(dataset_digest(config))
+    sha.update(np.ascontiguousarray(mask, dtype='float64').tostring())
+    sha.update(np.ascontiguousarray(trn_labels, dtype='float64').tostring())
+    return sha.hexdigest()
+
+
+def cohort_statistics(mask, trn_labels, sx, sxx, sxy):
+    '''
+    Function to assemble the statistics of the cohort from the training
+    matrices of the folds (see univ_feature_sel.training_label_matrix) and the
+    (num_folds x num_snps) sums of the genotype.
+
+    Returns
+    -------
+    A tuple with the statistics (see STATISTICS).
+    '''
+    return (mask.sum(axis=0), sx, sxx, trn_labels.sum(axis=0),
+            (trn_labels * trn_labels).sum(axis=0), sxy)
+
+
+def sample_file_statistics(path, num_snps, num_folds, block_size):
+    '''
+    Function to compute the statistics of the samples of an HDF5 file, added
+    to the training set of every fold with their phenotype as label. The
+    genotype is read in blocks of block_size SNPs.
+
+    Returns
+    -------
+    A tuple with the statistics (see STATISTICS).
+    '''
+    hdf = tb.open_file(path, mode='r')
+    try:
+        if hdf.root.GTBox.gt.shape[1] != num_snps:
+            raise ValueError("%s has %d SNPs, the dataset has %d"
+                             % (path, hdf.root.GTBox.gt.shape[1], num_snps))
+        labels = (hdf.root.GTBox.lbl[0, :] + 1.0) / 2
+        sx, sxx, sxy = np.zeros(num_snps), np.zeros(num_snps), np.zeros(num_snps)
+        for start in range(0, num_snps, block_size):
+            stop = min(start + block_size, num_snps)
+            x = np.asarray(hdf.root.GTBox.gt[:, start:stop], dtype='float64')
+            sx[start:stop] = x.sum(axis=0)
+            sxx[start:stop] = (x * x).sum(axis=0)
+            sxy[start:stop] = np.dot(labels, x)
+    finally:
+        hdf.close()
+    ones = np.ones(num_folds)
+    return (labels.shape[0] * ones, np.outer(ones, sx), np.outer(ones, sxx),
+            labels.sum() * ones, (labels * labels).sum() * ones, np.outer(ones, sxy))
+
+
+def load_statistics(config, task_name, base, added_samples):
+    '''
+    Function to load the saved statistics of a task if they can be updated to
+    the current ones: same base, and their files are the first ones of
+    added_samples (with the same content).
+
+    Returns
+    -------
+    A tuple (statistics, num_added) with the statistics and the number of
+    files of added_samples they include, or None.
+    '''
+    description_file = "%s/%s/%s" % (config.get_entry("global", "output_dir"),
+                                     config.get_entry(task_name, "output_subdir"),
+                                     STATISTICS_FILE)
+    if not os.path.exists(description_file):
+        return None
+    with open(description_file) as f:
+        description = json.load(f)
+    added = description["added_samples"]
+    if description["base"] != base or len(added) > len(added_samples):
+        return None
+    for (path, digest), saved in zip(added_samples, added):
+        if [path, digest] != saved:
+            return None
+    statistics = tuple(np.array(config.load_variable(task_name, "stat_%s" % name))
+                       for name in STATISTICS)
+    return statistics, len(added)
+
+
+def save_statistics(config, task_name, statistics, base, added_samples):
+    '''
+    Function to save the statistics of a task with their description (see
+    load_statistics). added_samples is the list of (path, digest) of the
+    files they include.
+    '''
+    config.save_variable(task_name, "%.17g",
+                         **dict(("stat_%s" % name, value)
+                                for name, value in zip(STATISTICS, statistics)))
+    description_file = "%s/%s/%s" % (config.get_entry("global", "output_dir"),
+                                     config.get_entry(task_name, "output_subdir"),
+                                     STATISTICS_FILE)
+    with open(description_file, "w") as f:
+        json.dump({"base": base, "added_samples": [list(added) for added in added_samples]}, f)
+
+
+def update_statistics(config, task_name, mask, trn_labels, cohort_sums, persist):
+    '''
+    Function to get the statistics of the training sets of the folds with the
+    samples of the files of added_samples, reusing the saved statistics when
+    possible (see load_statistics).
+
+    Parameters
+    ----------
+    config : an object of class ConfigState
+
+    task_name : the task (univ_feature_sel)
+
+    mask, trn_labels : the training matrices of the folds
+
+    cohort_sums : function that computes the (num_folds x num_snps) sums sx,
+        sxx and sxy of the cohort (called only if the saved statistics cannot
+        be used)
+
+    persist : save the statistics and their description
+
+    Returns
+    -------
+    A tuple with the statistics (see STATISTICS).
+    '''
+    block_size = config.get_entry(task_name, "block_size")
+    added_samples = [(path, file_digest(path)) for path in input_file_paths(config, task_name)]
+    base = statistics_base(config, mask, trn_labels) if persist else None
+    saved = load_statistics(config, task_name, base, added_samples) if persist else None
+    if saved is None:
+        statistics = cohort_statistics(mask, trn_labels, *cohort_sums())
+        num_added = 0
+    else:
+        statistics, num_added = saved
+        logging.info("Statistics of the cohort and %d added file(s) loaded" % num_added)
+
+    num_folds, num_snps = statistics[1].shape
+    for path, _ in added_samples[num_added:]:
+        logging.info("Adding the samples of %s" % path)
+        added = sample_file_statistics(path, num_snps, num_folds, block_size)
+        statistics = tuple(total + new for total, new in zip(statistics, added))
+    if persist and (saved is None or num_added < len(added_samples)):
+        save_statistics(config, task_name, statistics, base, added_samples)
+    return statistics
@@ -0,0 +1,147 @@
+#-----------------------------------------------------------------------------
+# Fold-parallel execution of the pipeline tasks
+#
+# The folds (or blocks of SNPs) of a task are distributed over a pool of
+# worker processes. The workers are forked after the shared state (Dataset,
+# configuration, loaded artifacts) has been set up, so they inherit it
+# instead of receiving a pickled copy: the genotype matrix is shared with
+# the parent process (copy-on-write pages or, with genotype_storage "mmap",
+# the page cache of the memory-mapped file); the attributes of a LazyDataset
+# used by the folds are read before. Only the fold index goes to the
+# workers and only the per-fold results come back.
+#
+# With checkpointing (run_task_folds), every worker saves the result of a
+# fold as soon as it is done, and folds whose results are already saved are
+# not run again. Every fold run by run_task_folds is measured (see
+# perf_metrics.py).
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import logging
+import multiprocessing
+
+import perf_metrics
+
+# State inherited by the forked workers (see map_folds)
+_shared_state = {}
+
+def _call_fold(i):
+    '''
+    Entry point of the workers: run the fold function on fold i with the
+    inherited keyword arguments.
+    '''
+    return _shared_state["function"](i, **_shared_state["kwargs"])
+
+def map_folds(fold_function, fold_ids, n_jobs, data_attributes=(), **kwargs):
+    '''
+    Generator that runs fold_function(i, **kwargs) for every fold i in
+    fold_ids, either serially (n_jobs=1) or in a pool of n_jobs worker
+    processes.
+
+    Parameters
+    ----------
+    fold_function : a module-level function. Its first argument is the fold
+        index and it returns the (picklable) result of the fold
+
+    fold_ids : the indices of the folds to run
+
+    n_jobs : the number of worker processes
+
+    data_attributes : the attributes of the dataset (kwargs["data"]) read by
+        the folds. They are read before the workers are forked, so that a
+        LazyDataset shares them with the workers (see Dataset.load_attributes)
+
+    kwargs : the arguments shared by all folds (e.g. data and config). They
+        are inherited by the workers, not pickled
+
+    Yields
+    ------
+    The results, in the order of fold_ids, as soon as they are available (the
+    results are not all kept in memory).
+    '''
+    fold_ids = list(fold_ids)
+    if len(fold_ids) > 0 and "data" in kwargs:
+        kwargs["data"].load_attributes(data_attributes)
+    if n_jobs == 1 or len(fold_ids) <= 1:
+        for i in fold_ids:
+            yield fold_function(i, **kwargs)
+        return
+
+    _shared_state["function"] = fold_function
+    _shared_state["kwargs"] = kwargs
+    pool = multiprocessing.Pool(min(n_jobs, len(fold_ids)))
+    try:
+        for result in pool.imap(_call_fold, fold_ids):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+        _shared_state.clear()
+
+def _run_fold(i, task_function, config, task_name, var_names, keys, **kwargs):
+    '''
+    Run task_function on fold i, record its metrics and, if checkpoint is set,
+    save its result as a checkpoint.
+    '''
+    with perf_metrics.measure(config, task_name, keys[i]):
+        result = task_function(i, config=config, **kwargs)
+        if config.get_entry("global", "checkpoint"):
+            config.save_checkpoint(task_name, keys[i], **dict(zip(var_names, result)))
+    return result
+
+def run_task_folds(fold_function, fold_ids, keys, n_jobs, config, task_name,
+                   var_names, data_attributes=(), **kwargs):
+    '''
+    Generator like map_folds. If checkpoint is set in the configuration, the
+    result of every fold is saved as a checkpoint of the task as soon as the
+    fold is done, and folds with a saved checkpoint are not run again: their
+    result is loaded from disk. Once the task has saved its output, it should
+    remove its checkpoints (ConfigState.remove_checkpoints).
+
+    Parameters
+    ----------
+    fold_function : a module-level function. Its first argument is the fold
+        index, it takes config as a keyword argument and it returns a tuple
+        of arrays, one per name in var_names
+
+    fold_ids : the indices of the folds to run
+
+    keys : dictionary with the name of the checkpoint of every fold index
+
+    n_jobs : the number of worker processes
+
+    config : an object of class ConfigState
+
+    task_name : the task whose checkpoints are used
+
+    var_names : the names of the variables in the result of fold_function
+
+    data_attributes : see map_folds
+
+    kwargs : the arguments shared by all folds, besides config
+
+    Yields
+    ------
+    The results (tuples of arrays), in the order of fold_ids.
+    '''
+    fold_ids = list(fold_ids)
+    todo = fold_ids
+    if config.get_entry("global", "checkpoint"):
+        todo = [i for i in fold_ids if not config.has_checkpoint(task_name, keys[i], var_names)]
+    if len(todo) < len(fold_ids):
+        logging.info("Resuming %s: %d of %d done" % (task_name, len(fold_ids) - len(todo), len(fold_ids)))
+
+    computed = map_folds(_run_fold, todo, n_jobs, task_function=fold_function,
+                         config=config, task_name=task_name, var_names=var_names,
+                         keys=keys, data_attributes=data_attributes, **kwargs)
+    todo = set(todo)
+    for i in fold_ids:
+        if i in todo:
+            yield next(computed)
+        else:
+            yield tuple(config.load_checkpoint(task_name, keys[i], var_name)
+                        for var_name in var_names)
+    # Shut down the pool
+    computed.close()
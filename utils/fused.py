@@ -0,0 +1,112 @@
+#-----------------------------------------------------------------------------
+# Fused execution of the fold tasks: every fold flows through
+# phenotype_imputation, univ_feature_sel and random_forest in one pass
+#
+# In the staged execution (the default), every task runs on all the folds and
+# saves its output before the next task starts, so the soft labels and the
+# SNP rankings of all folds are written to disk and read again. In the fused
+# execution (global entry execution: fused), the three tasks are run on one
+# fold at a time and the intermediate results of the fold (its soft labels
+# and SNP ranking) are kept in memory only (ConfigState.keep_in_memory). The
+# results of a fold are logged, and saved as a checkpoint if checkpoint is
+# set, as soon as the fold is done; the folds are run by a pool of n_jobs
+# worker processes.
+#
+# Only the outputs of random_forest are saved, as in the staged execution,
+# together with the AUC of the imputation of every fold
+# (imputation_roc_auc). The outputs of phenotype_imputation and
+# univ_feature_sel are not saved.
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import copy
+import logging
+import numpy as np
+
+from phenotype_imputation import phenotype_imputation
+from univ_feature_sel import univ_feature_sel
+from random_forest import random_forest, mean_roc_curve
+from fold_parallel import run_task_folds
+
+# The tasks run on every fold, in order
+FUSED_TASKS = [("phenotype_imputation", phenotype_imputation),
+               ("univ_feature_sel", univ_feature_sel),
+               ("random_forest", random_forest)]
+
+# The attributes of the dataset used by the fold tasks
+FUSED_ATTRIBUTES = ["genotype", "clin_covariate", "regular_covariate", "labels"]
+
+# The results of a fold
+FUSED_VARIABLES = ["results", "tpr", "roc_auc", "n_trees", "imputation_roc_auc"]
+
+
+def fused_fold(i, data, config):
+    '''
+    Function to run the fold tasks on fold i. The tasks run on a copy of the
+    dataset restricted to the fold (sharing its arrays, read beforehand by
+    run_fused) and on a copy of the configuration that keeps their outputs in
+    memory (serially: the folds are the unit of parallelism). Every fold
+    scans the genotype in univ_feature_sel on its own.
+
+    Returns
+    -------
+    A tuple with the results of the fold (see FUSED_VARIABLES).
+    '''
+    fold_data = copy.copy(data)
+    fold_data.select_folds(i, i + 1)
+    fold_config = copy.deepcopy(config)
+    fold_config.config["global"]["n_jobs"] = 1
+    fold_config.config["global"]["checkpoint"] = False
+    fold_config.keep_in_memory([task_name for task_name, _ in FUSED_TASKS])
+    for task_name, task_function in FUSED_TASKS:
+        task_function(fold_data, fold_config)
+
+    outputs = fold_config.memory["random_forest"]
+    imputation_roc_auc = fold_config.memory["phenotype_imputation"]["roc_auc"]
+    logging.info("Fold=%d: imputation AUC=%.4f, genotype AUC=%.4f"
+                 % (i + 1, imputation_roc_auc[0], outputs["roc_auc"][0]))
+    return (outputs["results"][0], outputs["tpr"][0], outputs["roc_auc"][0],
+            outputs["n_trees"][0], imputation_roc_auc[0])
+
+
+def run_fused(data, config):
+    '''
+    Function to run phenotype_imputation, univ_feature_sel and random_forest
+    fold by fold and save the outputs of random_forest.
+
+    Parameters
+    ----------
+    data : an object of class Dataset with the fold information
+
+    config : an object of class ConfigState
+    '''
+    task_name = "random_forest"
+    num_folds = data.num_folds
+    results = np.zeros((num_folds, data.fold_index.size(0, 3)))
+    mean_fpr = np.linspace(0, 1, 100)
+    tpr = np.zeros((num_folds, mean_fpr.shape[0]))
+    roc_auc = np.zeros(num_folds)
+    n_trees = np.zeros(num_folds, dtype='int64')
+    imputation_roc_auc = np.zeros(num_folds)
+
+    keys = dict((i, "fold_%d" % (i + 1)) for i in range(num_folds))
+    # The dataset is read before it is copied for the folds (see fused_fold)
+    fold_results = run_task_folds(fused_fold, range(num_folds), keys,
+                                  config.get_entry("global", "n_jobs"), config, task_name,
+                                  FUSED_VARIABLES, data_attributes=FUSED_ATTRIBUTES, data=data)
+    for i, fold_result in enumerate(fold_results):
+        results[i,:], tpr[i,:], roc_auc[i], n_trees[i], imputation_roc_auc[i] = fold_result
+
+    mean_tpr, mean_auc = mean_roc_curve(mean_fpr, tpr)
+    config.save_variable(task_name, "%f", results=results, roc_auc=roc_auc, tpr=tpr,
+                         mean_fpr=mean_fpr, mean_tpr=mean_tpr, mean_auc=mean_auc,
+                         imputation_roc_auc=imputation_roc_auc)
+    config.save_variable(task_name, "%d", n_trees=n_trees)
+    # The models of the folds were saved by the fold tasks (remove those of
+    # other runs)
+    for fused_task in ["phenotype_imputation", "random_forest"]:
+        config.remove_models(fused_task, keys.values() if config.get_entry(fused_task, "save_models")
+                             else ())
+    config.remove_checkpoints(task_name)
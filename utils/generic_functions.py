@@ -5,6 +5,7 @@
 #          Damian Roqueiro
 #-----------------------------------------------------------------------------
 
+import zlib
 import numpy as np
       
 def harden_labels(soft_labels, p_class):
@@ -22,3 +23,28 @@ def find_vec_entries_that_contain(x,y):
     entries = np.nonzero(z)[0]
     return entries
 
+
+def fold_seeds(seed, num_folds, task_name, offset=0):
+    '''
+    Derive one seed per fold for the random number generators of a task. The
+    seeds only depend on the global seed, the task and the fold, so a fold
+    gives the same result whether the folds run serially, in parallel or in
+    shards (the seeds of folds offset..offset+num_folds-1).
+    If seed is None, no seeds are fixed (None for every fold).
+    '''
+    if seed is None:
+        return [None] * num_folds
+    rng = np.random.RandomState([seed, zlib.crc32(task_name) & 0xffffffff])
+    return list(rng.randint(0, 2**31 - 1, size=offset + num_folds)[offset:])
+
+
+def scale_parameters(x):
+    '''
+    Get the mean and standard deviation of every row of x (variables x
+    samples) used by preprocessing.scale, so that new samples can be scaled
+    in the same way: (x - mean) / std. Constant rows get a std of 1.
+    '''
+    mean = x.mean(axis=1)
+    std = x.std(axis=1)
+    std[std == 0.0] = 1.0
+    return mean, std
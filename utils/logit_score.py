@@ -0,0 +1,127 @@
+#-----------------------------------------------------------------------------
+# Batched logistic regression score test of blocks of SNPs against the
+# training labels of many folds at once
+#
+# The null model (an intercept and the covariates, without the SNP) is
+# fitted once per fold by iteratively reweighted least squares. The score
+# test of a SNP g then needs no fit of its own:
+#   U = g' (y - mu)
+#   V = g' W g - g' W X (X' W X)^-1 X' W g
+#   U^2 / V ~ chi2 with 1 degree of freedom
+# where mu are the fitted probabilities of the null model, W = mu (1 - mu)
+# and X the covariates, all restricted to the training samples of the fold.
+# With the Cholesky factor X' W X = R' R and Q = W X R^-1, the second term of
+# V is |Q' g|^2, so a block of SNPs is scored against all folds with the
+# products G' (y - mu), (G * G)' W and G' Q.
+#
+# The folds are described by a mask and the training labels, as in
+# batched_pearson. Soft labels (imputed silver labels) are used as they are,
+# as a fractional response (quasi-likelihood).
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import numpy as np
+from scipy.special import erfc
+
+
+def _sigmoid(eta):
+    return 1.0 / (1.0 + np.exp(-eta))
+
+
+def fit_null_models(covariates, mask, labels, max_iter=25, tol=1e-8):
+    '''
+    Function to fit the logistic regression null model of every fold by
+    iteratively reweighted least squares (all folds at once).
+
+    Parameters
+    ----------
+    covariates : (num_samples x num_covariates) matrix with the (scaled)
+        covariates, without the intercept (a column of ones is added)
+
+    mask : (num_samples x num_folds) matrix, 1 for training samples of a fold
+
+    labels : (num_samples x num_folds) matrix with the training labels of each
+        fold in [0, 1], 0 for samples that are not used for training
+
+    max_iter, tol : the maximum number of Newton steps and the convergence
+        threshold on the largest change of a coefficient
+
+    Returns
+    -------
+    A tuple (residual, weights, projection): the (num_samples x num_folds)
+    matrices mask * (y - mu) and mask * mu * (1 - mu), and the (num_samples x
+    num_folds * num_parameters) matrix with the columns of Q of every fold
+    (fold after fold).
+    '''
+    x = np.column_stack([np.ones(covariates.shape[0]), covariates])
+    num_folds = mask.shape[1]
+    beta = np.zeros((num_folds, x.shape[1]))
+    for iteration in range(max_iter):
+        mu = _sigmoid(np.dot(x, beta.transpose()))
+        weights = mask * mu * (1.0 - mu)
+        gradient = np.dot(x.transpose(), mask * (labels - mu)).transpose()
+        hessian = np.einsum('ni,nf,nj->fij', x, weights, x)
+        step = np.linalg.solve(hessian, gradient[:, :, np.newaxis])[:, :, 0]
+        beta += step
+        if np.abs(step).max() < tol:
+            break
+
+    mu = _sigmoid(np.dot(x, beta.transpose()))
+    residual = mask * (labels - mu)
+    weights = mask * mu * (1.0 - mu)
+    projection = np.zeros((x.shape[0], num_folds * x.shape[1]))
+    for i in range(num_folds):
+        wx = weights[:, i:i + 1] * x
+        r = np.linalg.cholesky(np.dot(x.transpose(), wx)).transpose()
+        # Q = W X R^-1, i.e. Q' = R'^-1 (W X)'
+        columns = slice(i * x.shape[1], (i + 1) * x.shape[1])
+        projection[:, columns] = np.linalg.solve(r.transpose(), wx.transpose()).transpose()
+    return residual, weights, projection
+
+
+def score_test_pval(products, num_folds, rtol=1e-8):
+    '''
+    Function to compute the score test p-values of a block of SNPs from the
+    products of the block with the matrices of fit_null_models.
+
+    Parameters
+    ----------
+    products : a tuple (G' [residual, projection], (G * G)' weights) of
+        (block_size x num_folds * (1 + num_parameters)) and (block_size x
+        num_folds) matrices (see Dataset.genotype_products)
+
+    num_folds : the number of folds
+
+    rtol : SNPs whose variance V is below rtol * g' W g (SNPs that are
+        constant, or nearly a linear function of the covariates, in the
+        training set of a fold) get a NaN p-value
+
+    Returns
+    -------
+    The (block_size x num_folds) matrix of p-values.
+    '''
+    linear, gwg = products
+    u = linear[:, :num_folds]
+    qg = linear[:, num_folds:]
+    block_size = qg.shape[0]
+    qg = qg.reshape(block_size, num_folds, qg.shape[1] // num_folds)
+    v = gwg - (qg * qg).sum(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        statistic = np.where(v > rtol * gwg, u * u / v, np.nan)
+        # The chi2 survival function with 1 degree of freedom
+        return erfc(np.sqrt(0.5 * statistic))
+
+
+def score_test_block(genotype_block, null_models, rtol=1e-8):
+    '''
+    Function to compute the score test p-values of every SNP of a (num_samples
+    x block_size) genotype block in every fold, with the null models returned
+    by fit_null_models.
+    '''
+    x = np.asarray(genotype_block, dtype='float64')
+    residual, weights, projection = null_models
+    products = (np.dot(x.transpose(), np.hstack([residual, projection])),
+                np.dot((x * x).transpose(), weights))
+    return score_test_pval(products, residual.shape[1], rtol)
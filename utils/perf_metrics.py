@@ -0,0 +1,188 @@
+#-----------------------------------------------------------------------------
+# Performance metrics of the pipeline tasks and of their folds
+#
+# Every task run by run_cotraining and every fold run by run_task_folds is
+# measured and appended as one JSON object per line to the file metrics.jsonl
+# in the output subdirectory of the task:
+#   task, fold    : the task and the fold (key of its checkpoint), fold is
+#                   null for the task as a whole
+#   pid, start    : the process that ran it and its start time (seconds
+#                   since the epoch)
+#   wall_time     : elapsed time (s)
+#   cpu_time      : user + system time (s). For a task, the time of its
+#                   worker processes is included
+#   peak_rss_mb   : maximum resident set size (MB) while it ran (on Linux;
+#                   elsewhere, the peak of the process so far)
+#   bytes_read    : size of the files read by load_variable/load_checkpoint
+#   bytes_written : size of the files written by save_variable/save_checkpoint
+#   fit_time      : time spent fitting models (s)
+#   predict_time  : time spent predicting with the fitted models (s)
+# For a task, the bytes, fit/predict times and peak memory are those of the
+# main process (the folds run by worker processes have their own records).
+#
+# The tasks listed in the global entry profile are also run under cProfile.
+# The statistics are saved in profile.prof (see the pstats module) and the
+# 30 most expensive functions (cumulative time) in profile.txt.
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import resource
+import cProfile
+import pstats
+from contextlib import contextmanager
+
+# Counters of the current process, increased by add and timer
+_counters = {"bytes_read": 0, "bytes_written": 0, "fit_time": 0.0, "predict_time": 0.0}
+
+# Records of the measurements in progress in this process (task, then fold)
+_active = []
+
+METRICS_FILE = "metrics.jsonl"
+
+
+def add(name, value):
+    '''
+    Function to increase a counter of the current process.
+    '''
+    _counters[name] += value
+
+
+def add_file_size(name, file_name):
+    '''
+    Function to increase a byte counter by the size of a file.
+    '''
+    if os.path.exists(file_name):
+        _counters[name] += os.path.getsize(file_name)
+
+
+@contextmanager
+def timer(name):
+    '''
+    Context manager that adds the time spent in it to a counter (fit_time or
+    predict_time).
+    '''
+    t0 = time.time()
+    try:
+        yield
+    finally:
+        _counters[name] += time.time() - t0
+
+
+def _cpu_time(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _reset_peak_rss():
+    '''
+    Reset the peak resident set size of the process (Linux only), so that the
+    peak of a fold can be measured.
+    '''
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except IOError:
+        pass
+
+
+def _peak_rss_mb():
+    '''
+    Peak resident set size of the process (MB) since the last reset.
+    '''
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def _task_dir(config, task_name):
+    return "%s/%s" % (config.get_entry("global", "output_dir"),
+                      config.get_entry(task_name, "output_subdir"))
+
+
+@contextmanager
+def measure(config, task_name, fold=None):
+    '''
+    Context manager that measures the code in it (a task, or one fold of a
+    task) and appends the record to the metrics file of the task. Nothing is
+    measured when the global entry metrics is not set.
+
+    Parameters
+    ----------
+    config : an object of class ConfigState
+
+    task_name : the name of the task
+
+    fold : the name of the fold (None for the whole task)
+    '''
+    if not config.get_entry("global", "metrics"):
+        yield
+        return
+
+    # The peak of an enclosing measurement is kept before the reset
+    peak = _peak_rss_mb()
+    for record in _active:
+        record["peak_rss_mb"] = max(record["peak_rss_mb"], peak)
+    _reset_peak_rss()
+
+    record = {"task": task_name, "fold": fold, "pid": os.getpid(), "start": time.time(),
+              "peak_rss_mb": 0.0}
+    counters = dict(_counters)
+    cpu_time = _cpu_time(resource.RUSAGE_SELF)
+    children_cpu_time = _cpu_time(resource.RUSAGE_CHILDREN)
+    _active.append(record)
+    try:
+        yield
+    finally:
+        _active.remove(record)
+        record["wall_time"] = time.time() - record["start"]
+        record["cpu_time"] = _cpu_time(resource.RUSAGE_SELF) - cpu_time
+        if fold is None:
+            record["cpu_time"] += _cpu_time(resource.RUSAGE_CHILDREN) - children_cpu_time
+        peak = _peak_rss_mb()
+        record["peak_rss_mb"] = max(record["peak_rss_mb"], peak)
+        for outer in _active:
+            outer["peak_rss_mb"] = max(outer["peak_rss_mb"], peak)
+        for name in _counters:
+            record[name] = _counters[name] - counters[name]
+
+        task_dir = _task_dir(config, task_name)
+        config._create_directory(task_dir)
+        # One short line per write, so that the records of concurrent worker
+        # processes are not interleaved
+        with open("%s/%s" % (task_dir, METRICS_FILE), "a") as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+@contextmanager
+def profile(config, task_name):
+    '''
+    Context manager that runs the code in it under cProfile if the task is in
+    the global entry profile. Only the main process is profiled.
+    '''
+    if task_name not in (config.get_entry("global", "profile") or []):
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        task_dir = _task_dir(config, task_name)
+        config._create_directory(task_dir)
+        profiler.dump_stats("%s/profile.prof" % task_dir)
+        with open("%s/profile.txt" % task_dir, "w") as f:
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(30)
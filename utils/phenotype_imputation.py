@@ -12,22 +12,86 @@ from classes.config_state import ConfigState
 # System libraries 
 import logging
 import numpy as np
-import sklearn as skl
-from scipy.stats import pearsonr
 from sklearn import linear_model
 from sklearn import metrics #roc_curve, auc
-from sklearn import cross_validation
+from sklearn import preprocessing
 from sklearn.ensemble import BaggingClassifier
 
 # Pipeline auxiliary functions
-from generic_functions import find_vec_entries_that_contain
 from generic_functions import harden_labels
+from generic_functions import fold_seeds
+from generic_functions import scale_parameters
+from fold_parallel import run_task_folds
+from bagged_logit import BaggedLogisticRegression
+import perf_metrics
 
-import IPython as ip
+def impute_fold(i, data, config, seeds, clin_covariate_scaled):
+    '''
+    Function to impute the labels on II for one fold, based on the classifier
+    learned on I.
+
+    Parameters
+    ----------
+    i : the index of the fold
+
+    data : an object of class Dataset
+
+    config : an object of class ConfigState
+
+    seeds : the seeds of the random number generators, one per fold
+
+    clin_covariate_scaled : the clinical covariates, scaled to zero mean and
+        unit variance (the same for all folds)
+
+    Returns
+    -------
+    A tuple (soft_labels, roc_auc) with the imputed labels of II and the AUC of
+    the imputation on II.
+    '''
+    task_name    = "phenotype_imputation"
+    n_estimators = config.get_entry(task_name, "n_estimators")
+    romans_trn   = config.get_entry(task_name, "romans_used_for_learning")
+    romans_tst   = config.get_entry(task_name, "romans_used_for_imputing")
+    engine       = config.get_entry(task_name, "engine")
+    save_models  = config.get_entry(task_name, "save_models")
+
+    logging.info("Fold=%d" % (data.fold_offset + i + 1))
+    sel_trn = data.fold_index.get(i, romans_trn)
+    sel_tst = data.fold_index.get(i, romans_tst)
+
+    if engine == "batched":
+        # All the bootstrap replicates are fitted together (see bagged_logit.py)
+        model = BaggedLogisticRegression(n_estimators=n_estimators, max_samples=0.632,
+                    max_features=5, bootstrap=True, bootstrap_features=True,
+                    random_state=seeds[i])
+    else:
+        model = BaggingClassifier(base_estimator=linear_model.LogisticRegression(),
+                    n_estimators=n_estimators, max_samples=0.632, 
+# for small set I       n_estimators=n_estimators, max_samples=0.8, 
+                    max_features=5, 
+                    bootstrap=True, bootstrap_features=True, oob_score=False, 
+# for small set I       bootstrap=False, bootstrap_features=True, oob_score=False, 
+                    n_jobs=1, random_state=seeds[i], verbose=0)
+        
+    with perf_metrics.timer("fit_time"):
+        model.fit(clin_covariate_scaled[:,sel_trn].transpose(), data.labels[:,sel_trn].transpose())
+    if save_models:
+        # With the scaling of the covariates, to score new samples (see score.py)
+        mean, std = scale_parameters(data.clin_covariate)
+        config.save_model(task_name, "fold_%d" % (data.fold_offset + i + 1),
+                          {"model": model, "covariate_mean": mean, "covariate_std": std})
+
+    with perf_metrics.timer("predict_time"):
+        soft_labels = model.predict_proba(clin_covariate_scaled[:,sel_tst].transpose())[:,1]
+    fpr, tpr, _ = metrics.roc_curve(data.labels[0,sel_tst], soft_labels)
+    return soft_labels, metrics.auc(fpr, tpr)
 
 def phenotype_imputation(data, config):
     ''' 
     Function to impute the labels on II based on the classifier learned on I.
+    The folds are run by a pool of n_jobs worker processes and, if checkpoint
+    is set, saved one by one so that an interrupted run can be resumed. If
+    save_models is set, the fitted classifier of every fold is saved.
     
     Parameters 
     ---------- 
@@ -41,38 +105,31 @@ def phenotype_imputation(data, config):
     # Parameters for this task
     num_folds = data.num_folds  
     task_name    = "phenotype_imputation"
-    n_estimators = config.get_entry(task_name, "n_estimators")
-    romans_trn   = config.get_entry(task_name, "romans_used_for_learning")
     romans_tst   = config.get_entry(task_name, "romans_used_for_imputing")
+    n_jobs       = config.get_entry("global", "n_jobs")
+    save_models  = config.get_entry(task_name, "save_models")
+    seeds        = fold_seeds(config.get_entry("global", "seed"), num_folds, task_name,
+                              data.fold_offset)
     
-    # Iterate through the folds: 
-    i = 0
-    size_of_two = find_vec_entries_that_contain(data.folds[:,0], romans_tst).shape[0]
-    soft_labels = np.zeros((size_of_two, num_folds))
-    X_scaled = preprocessing.scale(data.clin_covariate.transpose()).transpose()
-    fpr = dict()
-    tpr = dict()
-    thres = dict()
+    size_of_two = data.fold_index.size(0, romans_tst)
+    # Column-major, so that one fold (column) can be read from a memory-mapped file
+    soft_labels = np.zeros((size_of_two, num_folds), order='F')
     roc_auc = np.zeros(num_folds)
-    for fold in data.folds.transpose():      
-        logging.info("Fold=%d" % (i + 1))
-        sel_trn = find_vec_entries_that_contain(fold,[romans_trn])
-        sel_tst = find_vec_entries_that_contain(fold,[romans_tst])
 
-        model = BaggingClassifier(base_estimator=linear_model.LogisticRegression(),
-                    n_estimators=n_estimators, max_samples=0.632, 
-# for small set I   n_estimators=n_estimators, max_samples=0.8, 
-                    max_features=5, 
-                    bootstrap=True, bootstrap_features=True, oob_score=False, 
-# for small set I   bootstrap=False, bootstrap_features=True, oob_score=False, 
-                    n_jobs=1, random_state=None, verbose=0)
-            
-        model.fit(X_scaled[:,sel_trn].transpose(), data.labels[:,sel_trn].transpose())
+    # The covariates are scaled once for all the folds
+    clin_covariate_scaled = preprocessing.scale(data.clin_covariate.transpose()).transpose()
 
-        soft_labels[:,i] = model.predict_proba(X_scaled[:,sel_tst].transpose())[:,1]
-        fpr[i], tpr[i], thres[i] = metrics.roc_curve(data.labels[0,sel_tst], soft_labels[:,i])
-        roc_auc[i] = metrics.auc(fpr[i], tpr[i])
-        i+=1
+    # Iterate through the folds: 
+    keys = dict((i, "fold_%d" % (data.fold_offset + i + 1)) for i in range(num_folds))
+    fold_results = run_task_folds(impute_fold, range(num_folds), keys, n_jobs, config,
+                                  task_name, ["soft_labels", "roc_auc"],
+                                  data_attributes=["clin_covariate", "labels"],
+                                  data=data, seeds=seeds,
+                                  clin_covariate_scaled=clin_covariate_scaled)
+    for i, fold_result in enumerate(fold_results):
+        soft_labels[:,i], roc_auc[i] = fold_result
 
-    # Save the output of this task
+    # Save the output of this task (and remove the models of other runs)
     config.save_variable(task_name, "%f", soft_labels=soft_labels, roc_auc=roc_auc)
+    config.remove_models(task_name, keys.values() if save_models else ())
+    config.remove_checkpoints(task_name)
@@ -14,19 +14,175 @@ from classes.config_state import ConfigState
 # System libraries 
 import logging
 import numpy as np
-import sklearn as skl
 from sklearn import metrics #roc_curve, auc
 from sklearn import preprocessing
+from sklearn.ensemble import RandomForestClassifier
 from scipy import interp
 
 # Pipeline auxiliary functions
-from generic_functions import find_vec_entries_that_contain
 from generic_functions import harden_labels
-import IPython as ip
+from generic_functions import fold_seeds
+from generic_functions import scale_parameters
+from fold_parallel import run_task_folds
+import perf_metrics
+
+def _oob_auc(model, trn_labels):
+    '''
+    Function to compute the out-of-bag AUC of a fitted random forest (trained
+    with oob_score=True). Samples that are in the bootstrap of every tree have
+    no out-of-bag prediction and are left out.
+    '''
+    oob_pred = model.oob_decision_function_[:, 1]
+    valid = ~np.isnan(oob_pred)
+    return metrics.roc_auc_score(trn_labels[valid], oob_pred[valid])
+
+def _sklearn_forest(**parameters):
+    '''
+    Function to construct a RandomForestClassifier with the parameters known
+    to the installed scikit-learn: min_density and compute_importances were
+    removed in 0.16, and warm_start (needed by adaptive) was added in 0.16.
+    '''
+    supported = RandomForestClassifier._get_param_names()
+    if parameters["warm_start"] and "warm_start" not in supported:
+        raise ValueError("adaptive needs scikit-learn >= 0.16 (warm_start)")
+    return RandomForestClassifier(**dict((name, value) for name, value in parameters.items()
+                                         if name in supported))
+
+def random_forest_fold(i, data, config, seeds, soft_labels, feature_ranking, mean_fpr,
+                       regular_covariate_scaled):
+    '''
+    Function to construct and evaluate the genotype classifier of one fold.
+
+    Parameters
+    ----------
+    i : the index of the fold
+
+    data : an object of class Dataset
+
+    config : an object of class ConfigState
+
+    seeds : the seeds of the random number generators, one per fold
+
+    soft_labels : the imputed labels, as saved by phenotype_imputation
+
+    feature_ranking : the SNP ranking, as saved by univ_feature_sel
+
+    mean_fpr : the false positive rates at which the ROC curve is interpolated
+
+    regular_covariate_scaled : the regular covariate, scaled to zero mean and
+        unit variance (the same for all folds)
+
+    Returns
+    -------
+    A tuple (results, tpr, roc_auc, n_trees) with the predictions on III, the
+    interpolated true positive rates, the AUC of the fold and the number of
+    trees of the forest.
+    '''
+    # Parameters
+    task_name    = "random_forest"
+    n_estimators = config.get_entry(task_name, "n_estimators")
+    criterion    = config.get_entry(task_name, "criterion")
+    n_select     = config.get_entry(task_name, "n_select")
+    romans_trn_gold     = config.get_entry(task_name, "golden_romans_used_for_learning")
+    romans_trn_silver   = config.get_entry(task_name, "silver_romans_used_for_learning")
+    adaptive       = config.get_entry(task_name, "adaptive")
+    tree_increment = config.get_entry(task_name, "tree_increment")
+    tolerance      = config.get_entry(task_name, "tolerance")
+    save_models    = config.get_entry(task_name, "save_models")
+
+    logging.info("Fold=%d" % (data.fold_offset + i + 1))
+    # Training data:
+    sel_trn_gold = data.fold_index.get(i, romans_trn_gold)
+    sel_trn_silver = data.fold_index.get(i, romans_trn_silver)
+    sel_trn = np.concatenate([sel_trn_gold, sel_trn_silver])
+    
+    # Testing data:
+    sel_tst = data.fold_index.get(i, 3)
+    
+    # The model used for training (in adaptive mode, it starts with
+    # tree_increment trees and grows while the out-of-bag AUC changes):
+    model = _sklearn_forest(
+        n_estimators=min(tree_increment, n_estimators) if adaptive else n_estimators,
+        criterion=criterion, max_depth=None, 
+        min_samples_split=2, min_samples_leaf=1, max_features='auto', max_leaf_nodes=None, 
+        bootstrap=True, oob_score=adaptive, n_jobs=1, random_state=seeds[i], 
+        verbose=0, min_density=None, compute_importances=None, warm_start=adaptive)
+    
+    # Slicing of the matrix
+    snp_index = np.asarray(feature_ranking[i,0:n_select], dtype='int64')
+    genotype_data_filtered = data.genotype_columns(snp_index).transpose()
+
+    data_filtered = np.concatenate([genotype_data_filtered,
+        regular_covariate_scaled]).transpose()
+    
+    # Harden the labels for classification (This could be an un-needed calculation if only gold data is used)
+    n_p = np.sum(data.labels[0, sel_trn_gold] == 1)
+    n_n = np.sum(data.labels[0, sel_trn_gold] == 0)
+    p_class = float(n_p)/float(n_p + n_n)
+    
+    hard_labels = harden_labels(soft_labels[range(len(sel_trn_silver)),i], p_class)
+    trn_labels = np.concatenate([data.labels[0,sel_trn_gold], hard_labels])        
+    
+    # Fitting of the model
+    with perf_metrics.timer("fit_time"):
+        model.fit(data_filtered[sel_trn,:], trn_labels)
+        if adaptive:
+            oob_auc = _oob_auc(model, trn_labels)
+            while model.n_estimators < n_estimators:
+                model.set_params(n_estimators=min(model.n_estimators + tree_increment, n_estimators))
+                model.fit(data_filtered[sel_trn,:], trn_labels)
+                previous_auc, oob_auc = oob_auc, _oob_auc(model, trn_labels)
+                if abs(oob_auc - previous_auc) < tolerance:
+                    break
+    logging.info("Fold=%d: %d trees" % (data.fold_offset + i + 1, model.n_estimators))
+    if save_models:
+        # With the selected SNPs and the scaling of the covariate, to score
+        # new samples (see score.py)
+        mean, std = scale_parameters(data.regular_covariate)
+        config.save_model(task_name, "fold_%d" % (data.fold_offset + i + 1),
+                          {"model": model, "snp_index": snp_index,
+                           "covariate_mean": mean, "covariate_std": std})
+    
+    # Generation of the results:
+    with perf_metrics.timer("predict_time"):
+        results = model.predict_proba(data_filtered[sel_tst, :])[:, 1] 
+    fpr, tpr, _ = metrics.roc_curve(data.labels[0, sel_tst], results)
+    return results, interp(mean_fpr, fpr, tpr), metrics.auc(fpr, tpr), model.n_estimators
+
+def mean_roc_curve(mean_fpr, tpr):
+    '''
+    Function to average the ROC curves of the folds.
+
+    Parameters
+    ----------
+    mean_fpr : the false positive rates at which the curves are interpolated
+
+    tpr : (num_folds x len(mean_fpr)) interpolated true positive rates of
+        every fold
+
+    Returns
+    -------
+    A tuple (mean_tpr, mean_auc) with the mean ROC curve and its AUC (an
+    array of length 1).
+    '''
+    # Accumulate the interpolated tpr, fold by fold
+    mean_tpr = 0.0
+    for fold_tpr in tpr:
+        mean_tpr += fold_tpr
+    mean_tpr /= tpr.shape[0]
+    mean_tpr[-1] = 1.0
+    # Save the mean auc computed in this way (to compare with the other values)
+    mean_auc = np.zeros(1)
+    mean_auc[0] = metrics.auc(mean_fpr, mean_tpr)
+    return mean_tpr, mean_auc
 
 def random_forest(data, config):
     ''' 
-    Function to construct a genotype classifier using random forest
+    Function to construct a genotype classifier using random forest. The folds
+    are run by a pool of n_jobs worker processes and, if checkpoint is set,
+    saved one by one so that an interrupted run can be resumed. If
+    save_models is set, the fitted forest of every fold is saved with the
+    indices of its SNPs.
     
     Parameters 
     ---------- 
@@ -40,71 +196,45 @@ def random_forest(data, config):
     
     # Parameters
     task_name    = "random_forest"
-    n_estimators = config.get_entry(task_name, "n_estimators")
-    criterion    = config.get_entry(task_name, "criterion")
-    n_select     = config.get_entry(task_name, "n_select")
     num_folds    = data.num_folds  
-    romans_trn_gold     = config.get_entry(task_name, "golden_romans_used_for_learning")
-    romans_trn_silver   = config.get_entry(task_name, "silver_romans_used_for_learning")
+    n_jobs       = config.get_entry("global", "n_jobs")
+    seeds        = fold_seeds(config.get_entry("global", "seed"), num_folds, task_name,
+                              data.fold_offset)
 
     # Load the output of the previous task(s)
-    soft_labels = config.load_variable("phenotype_imputation", "soft_labels")
-    feature_ranking = np.asarray(config.load_variable("univ_feature_sel", "feature_ranking"), dtype='int64')
+    # (memory-mapped if possible: only one column/row is used per fold)
+    soft_labels = config.load_variable("phenotype_imputation", "soft_labels", mmap=True)
+    feature_ranking = config.load_variable("univ_feature_sel", "feature_ranking", mmap=True)
+    n_select = config.get_entry(task_name, "n_select")
+    if feature_ranking.shape[-1] < n_select:
+        raise ValueError("The feature ranking has %d SNPs per fold, n_select is %d "
+                         "(increase top_k in univ_feature_sel)" % (feature_ranking.shape[-1], n_select))
     
     # Create array that can be filled with results
-    results = np.zeros((num_folds, find_vec_entries_that_contain(data.folds[:,0],[3]).shape[0]))    
+    results = np.zeros((num_folds, data.fold_index.size(0, 3)))    
     
+    # The covariate is scaled once for all the folds
+    regular_covariate_scaled = preprocessing.scale(data.regular_covariate.transpose()).transpose()
+
     # Iterate through the folds:  
-    i = 0
-    mean_tpr = 0.0
     mean_fpr = np.linspace(0, 1, 100)
+    tpr = np.zeros((num_folds, mean_fpr.shape[0]))
     roc_auc = np.zeros(num_folds)
-    for fold in data.folds.transpose():
-        logging.info("Fold=%d" % (i + 1))
-        # Training data:
-        sel_trn_gold = find_vec_entries_that_contain(fold, romans_trn_gold)
-        sel_trn_silver = find_vec_entries_that_contain(fold, romans_trn_silver)
-        sel_trn = np.concatenate([sel_trn_gold, sel_trn_silver])
-        
-        # Testing data:
-        sel_tst = find_vec_entries_that_contain(fold,[3])
-        
-        # The model used for training:
-        model = skl.ensemble.RandomForestClassifier(n_estimators=n_estimators, criterion=criterion, max_depth=None, 
-            min_samples_split=2, min_samples_leaf=1, max_features='auto', max_leaf_nodes=None, 
-            bootstrap=True, oob_score=False, n_jobs=1, random_state=None, 
-            verbose=0, min_density=None, compute_importances=None)
-        
-        # Slicing of the matrix
-        genotype_data_filtered = data.genotype[:,feature_ranking[i,0:n_select]].transpose()
-
-        data_filtered = np.concatenate([genotype_data_filtered,
-            preprocessing.scale(data.regular_covariate.transpose()).transpose()]).transpose()
-        
-        # Harden the labels for classification (This could be an un-needed calculation if only gold data is used)
-        n_p = np.sum(data.labels[0, sel_trn_gold] == 1)
-        n_n = np.sum(data.labels[0, sel_trn_gold] == 0)
-        p_class = float(n_p)/float(n_p + n_n)
-        
-        hard_labels = harden_labels(soft_labels[range(len(sel_trn_silver)),i], p_class)
-        trn_labels = np.concatenate([data.labels[0,sel_trn_gold], hard_labels])        
-        
-        # Fitting of the model
-        model.fit(data_filtered[sel_trn,:], trn_labels)
-        
-        # Generation of the results:
-        results[i,:] = model.predict_proba(data_filtered[sel_tst, :])[:, 1] 
-        fpr, tpr, _ = metrics.roc_curve(data.labels[0, sel_tst], results[i, :])
-        # Accumulate the interpolated tpr
-        mean_tpr += interp(mean_fpr, fpr, tpr)
-        roc_auc[i] = metrics.auc(fpr, tpr)
-        i += 1
+    n_trees = np.zeros(num_folds, dtype='int64')
+    keys = dict((i, "fold_%d" % (data.fold_offset + i + 1)) for i in range(num_folds))
+    fold_results = run_task_folds(random_forest_fold, range(num_folds), keys, n_jobs, config,
+                                  task_name, ["results", "tpr", "roc_auc", "n_trees"],
+                                  data_attributes=["genotype", "regular_covariate", "labels"],
+                                  data=data, seeds=seeds, soft_labels=soft_labels,
+                                  feature_ranking=feature_ranking, mean_fpr=mean_fpr,
+                                  regular_covariate_scaled=regular_covariate_scaled)
+    for i, fold_result in enumerate(fold_results):
+        results[i,:], tpr[i,:], roc_auc[i], n_trees[i] = fold_result
 
     # Compute the mean ROC curve values
-    mean_tpr /= num_folds
-    mean_tpr[-1] = 1.0
-    # Save the mean auc computed in this way (to compare with the other values)
-    mean_auc = np.zeros(1)
-    mean_auc[0] = metrics.auc(mean_fpr, mean_tpr)
+    mean_tpr, mean_auc = mean_roc_curve(mean_fpr, tpr)
     # Save the output of this task
-    config.save_variable(task_name, "%f", results=results, roc_auc=roc_auc, mean_fpr=mean_fpr, mean_tpr=mean_tpr, mean_auc=mean_auc)
+    config.save_variable(task_name, "%f", results=results, roc_auc=roc_auc, tpr=tpr, mean_fpr=mean_fpr, mean_tpr=mean_tpr, mean_auc=mean_auc)
+    config.save_variable(task_name, "%d", n_trees=n_trees)
+    config.remove_models(task_name, keys.values() if config.get_entry(task_name, "save_models") else ())
+    config.remove_checkpoints(task_name)
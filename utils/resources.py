@@ -0,0 +1,362 @@
+#-----------------------------------------------------------------------------
+# Estimates of the resources of the pipeline tasks before they are run
+#
+# From the shape of the dataset (read from the HDF5 file, no data is loaded)
+# and the configuration, every task gets an estimate of:
+#   memory : the peak resident memory of the run while the task runs (the
+#            genotype and fold information, the arrays of the task in the
+#            main process and those of the folds or blocks that run at the
+#            same time, one per worker process)
+#   disk   : the size of the files it writes, including its checkpoints
+#            (removed at the end of the task) and saved models
+#   time   : the wall time, from counts of the main operations (matrix
+#            products, tree node splits, ...) and their measured costs
+# The costs (COSTS) were measured with benchmarks/bench_pipeline.py and the
+# metrics of the tasks (see perf_metrics.py) on one core of a current
+# server. The estimates are meant to catch runs that cannot fit (e.g. a
+# num_folds x num_snps matrix that does not fit in memory), not to predict
+# the time to the minute.
+#
+# check_resources compares the estimates with the limits of the global
+# section (memory_limit_mb, disk_limit_mb, time_limit_h). A null limit is
+# the physical memory of the machine, the free space of the output
+# directory, or no limit for the time.
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import os
+import math
+import logging
+import tables as tb
+
+# Cost of the main operations (seconds)
+COSTS = {
+    "read_byte":       6e-10,   # reading the genotype from the HDF5 file, per byte
+    "convert_byte":    2e-9,    # converting/packing the genotype, per call
+    "fold_sample":     2e-7,    # creating the folds, per sample and fold
+    "flop":            4e-10,   # matrix products (multiply-add = 2 flops)
+    "bagged_logit":    4.3e-7,  # batched imputation engine fit, per sample and replicate
+    "bagged_predict":  1e-7,    # batched imputation engine prediction, per sample and replicate
+    "bagging":         5e-6,    # sklearn imputation engine, per sample and replicate
+    "tree_split":      2.4e-8,  # random forest, per sample, feature tried and tree level
+    "fold_overhead":   0.05,    # fixed cost of a fold (setup, ROC curve, ...)
+}
+
+# Memory of a process with the libraries of the pipeline loaded (Python,
+# NumPy, SciPy, scikit-learn and PyTables)
+PROCESS_BYTES = 110 * 1024 * 1024
+
+# Bytes of a node of a fitted decision tree (node record and class counts)
+TREE_NODE_BYTES = 80
+
+# Characters per value of the tab-separated files, by format
+CSV_CHARS = {"%f": 10, "%.6e": 14, "%.17g": 24}
+
+# Parameters of the logistic regression null model (intercept + 12
+# covariates, see univ_feature_sel.null_model_covariates)
+NULL_MODEL_PARAMETERS = 13
+
+
+def dataset_shapes(config):
+    '''
+    Function to read the shape of the dataset from the HDF5 input file.
+
+    Returns
+    -------
+    A tuple (num_samples, num_snps, itemsize), itemsize being the size (in
+    bytes) of a genotype call in the file.
+    '''
+    input_path = "%s/%s" % (config.get_entry("global", "input_dir"),
+                            config.get_entry("global", "input_file"))
+    hdf = tb.open_file(input_path, mode='r')
+    try:
+        gt = hdf.root.GTBox.gt
+        return hdf.root.GTBox.covar.shape[1], gt.shape[1], gt.atom.itemsize
+    finally:
+        hdf.close()
+
+
+def _set_sizes(config, num_samples):
+    sizes = config.get_entry("cv_set_creation", "sizes")
+    return [int(round(sizes[name] * num_samples)) for name in ["set_I", "set_II", "set_III"]]
+
+
+def _variable_bytes(config, num_values, format_string, itemsize=8):
+    '''
+    Size of a saved variable of num_values values (save_option, csv_export).
+    '''
+    size = 0
+    if config.get_entry("global", "save_option") == "npy":
+        size += num_values * itemsize
+    if config.get_entry("global", "save_option") == "csv" or config.get_entry("global", "csv_export"):
+        size += num_values * CSV_CHARS.get(format_string, 8)
+    return size
+
+
+def _tree_nodes(num_samples):
+    # A fully grown tree on a bootstrap sample: about 0.63 n distinct
+    # samples, each in its own leaf
+    return 2 * 0.632 * num_samples
+
+
+def _genotype_bytes(storage, num_samples, num_snps, itemsize):
+    '''
+    Memory held by the genotype in the main process, by genotype_storage.
+    '''
+    if storage == "memory":
+        return num_samples * num_snps * itemsize
+    if storage in ("int8", "mmap"):
+        return num_samples * num_snps
+    if storage == "packed":
+        return num_snps * ((num_samples + 3) // 4)
+    return 0
+
+
+def task_estimates(config, task_name, num_samples, num_snps, itemsize, num_folds):
+    '''
+    Function to estimate the resources of one task.
+
+    Parameters
+    ----------
+    config : an object of class ConfigState
+
+    task_name : the name of the task
+
+    num_samples, num_snps, itemsize : the shape of the dataset (see
+        dataset_shapes)
+
+    num_folds : the number of folds run (those of the shard, if any)
+
+    Returns
+    -------
+    A dictionary with the bytes of the main process (main), the bytes of one
+    fold or block (unit), the number of units (units), the bytes written
+    (disk), and the time (seconds) of the main process (serial_time) and of
+    one unit (unit_time).
+    '''
+    n, m, F = num_samples, num_snps, num_folds
+    n_I, n_II, n_III = _set_sizes(config, n)
+    storage = config.get_entry("global", "genotype_storage")
+    checkpoint = config.get_entry("global", "checkpoint")
+    est = {"main": 0, "unit": 0, "units": F, "disk": 0, "serial_time": 0.0,
+           "unit_time": COSTS["fold_overhead"]}
+
+    if task_name == "cv_set_creation":
+        est["main"] = 3 * n * F * 8
+        est["unit"] = 0
+        est["unit_time"] = 0.0
+        est["serial_time"] = n * F * COSTS["fold_sample"]
+        if config.get_entry(task_name, "materialize"):
+            est["disk"] = 2 * _variable_bytes(config, n * F, "%d")
+        else:
+            est["disk"] = _variable_bytes(config, F, "%d")
+
+    elif task_name == "phenotype_imputation":
+        n_estimators = config.get_entry(task_name, "n_estimators")
+        est["main"] = n_II * F * 8
+        if config.get_entry(task_name, "engine") == "batched":
+            # The bootstrap counts of all replicates and the design matrices
+            # of a batch of 1000 replicates (fit on I, prediction on II)
+            batch = min(n_estimators, 1000)
+            est["unit"] = n_estimators * n_I * 8 + 3 * batch * n_I * 6 * 8 + 2 * batch * n_II * 6 * 8
+            est["unit_time"] += n_estimators * (n_I * COSTS["bagged_logit"] +
+                                                n_II * COSTS["bagged_predict"])
+        else:
+            est["unit"] = n_estimators * 4096 + n_II * n_estimators * 8
+            est["unit_time"] += n_estimators * (n_I + n_II) * COSTS["bagging"]
+        est["disk"] = _variable_bytes(config, n_II * F + F, "%f")
+        if checkpoint:
+            # The results of every fold are saved twice (checkpoints and output)
+            est["disk"] *= 2
+        if config.get_entry(task_name, "save_models"):
+            est["disk"] += F * n_estimators * (6 + 5) * 8
+
+    elif task_name == "univ_feature_sel":
+        block_size = min(config.get_entry(task_name, "block_size"), m)
+        top_k = config.get_entry(task_name, "top_k")
+        permutations = config.get_entry(task_name, "permutations")
+        logit = config.get_entry(task_name, "method") == "logit_regression"
+        products = 2 + NULL_MODEL_PARAMETERS if logit else 3
+        num_keys = 2 if permutations > 0 else 1
+        num_ranked = m if top_k is None else min(top_k, m)
+        # Training mask and labels, the null models, the sort keys and the
+        # ranking
+        est["main"] = 2 * n * F * 8 + num_keys * F * num_ranked * 8 + F * num_ranked * 8
+        if logit:
+            est["main"] += n * F * (NULL_MODEL_PARAMETERS + 2) * 8
+        if top_k is not None:
+            est["main"] += 3 * num_keys * F * (num_ranked + block_size) * 8
+        # A block: the squared calls (and the calls, unless the block is a
+        # view of a float64 matrix in memory), the products and the
+        # permutations of a fold
+        copies = 1 if (storage == "memory" and itemsize == 8) else 2
+        est["unit"] = copies * n * block_size * 8 + products * block_size * F * 8
+        if permutations > 0:
+            batch = min(permutations, 500)
+            est["unit"] += n * batch * 8 + 2 * block_size * batch * 8
+        est["units"] = int(math.ceil(float(m) / block_size))
+        flops = 2.0 * n * block_size * F * (products + permutations)
+        est["unit_time"] = flops * COSTS["flop"]
+        if storage == "hdf5":
+            est["unit_time"] += n * block_size * itemsize * COSTS["read_byte"]
+        if logit:
+            est["serial_time"] = 25 * 2.0 * n * F * NULL_MODEL_PARAMETERS ** 2 * COSTS["flop"]
+        est["disk"] = _variable_bytes(config, F * num_ranked, "%d")
+        if top_k is not None or permutations > 0:
+            est["disk"] += _variable_bytes(config, F * num_ranked, "%.6e")
+        if checkpoint:
+            # The p-values of every block and fold
+            est["disk"] += num_keys * F * m * 8
+        save_statistics = config.get_entry(task_name, "save_statistics")
+        if save_statistics or len(config.get_entry(task_name, "added_samples")) > 0:
+            # The sums sx, sxx and sxy and the p-values of all SNPs in every
+            # fold (see feature_statistics.py)
+            est["main"] += 4 * F * m * 8
+            if save_statistics:
+                est["disk"] += 3 * _variable_bytes(config, F * m, "%.17g")
+
+    elif task_name == "random_forest":
+        n_estimators = config.get_entry(task_name, "n_estimators")
+        n_select = config.get_entry(task_name, "n_select")
+        n_trn = n_I + n_II
+        # The selected columns, the design matrix and the training rows
+        est["main"] = F * n_III * 8 + F * 100 * 8
+        est["unit"] = 3 * n * (n_select + 1) * 8 + n_estimators * _tree_nodes(n_trn) * TREE_NODE_BYTES
+        depth = math.log(max(n_trn, 2), 2)
+        est["unit_time"] += (n_estimators * 0.632 * n_trn * math.sqrt(n_select + 1) * depth *
+                             COSTS["tree_split"])
+        if storage == "hdf5":
+            est["unit_time"] += n * m * itemsize * COSTS["read_byte"]
+        est["disk"] = _variable_bytes(config, F * (n_III + 100 + 2) + 201, "%f")
+        if checkpoint:
+            est["disk"] *= 2
+        if config.get_entry(task_name, "save_models"):
+            est["disk"] += F * n_estimators * _tree_nodes(n_trn) * TREE_NODE_BYTES
+    return est
+
+
+def estimate_resources(config, tasks, num_samples, num_snps, itemsize, num_folds):
+    '''
+    Function to estimate the peak memory (MB), the disk space written (MB)
+    and the wall time (seconds) of every task in tasks.
+
+    In the fused execution (see fused.py), phenotype_imputation and
+    univ_feature_sel are run within the folds of random_forest and are
+    estimated together with it (under random_forest).
+
+    Returns
+    -------
+    A list of (task_name, memory_mb, disk_mb, time_s), and the memory (MB)
+    and time (seconds) of loading the dataset.
+    '''
+    storage = config.get_entry("global", "genotype_storage")
+    n_jobs = config.get_entry("global", "n_jobs")
+    fused = config.get_entry("global", "execution") == "fused"
+    mb = 1024.0 * 1024.0
+
+    # The dataset and, after cv_set_creation, the folds and the fold index
+    base = (PROCESS_BYTES + _genotype_bytes(storage, num_samples, num_snps, itemsize) +
+            14 * num_samples * 8)
+    load_time = num_samples * num_snps * itemsize * COSTS["read_byte"]
+    if storage in ("int8", "mmap", "packed"):
+        load_time += num_samples * num_snps * COSTS["convert_byte"]
+    if storage == "hdf5":
+        load_time = 0.0
+    folds = 2 * num_samples * num_folds * 8
+
+    estimates = []
+    for task_name in tasks:
+        if fused and task_name in ("phenotype_imputation", "univ_feature_sel"):
+            continue
+        est = task_estimates(config, task_name, num_samples, num_snps, itemsize, num_folds)
+        if fused and task_name == "random_forest":
+            # Every fold runs the three tasks on one fold, serially
+            unit = 0
+            unit_time = 0.0
+            disk = est["disk"]
+            for fused_task in ["phenotype_imputation", "univ_feature_sel", "random_forest"]:
+                fold_est = task_estimates(config, fused_task, num_samples, num_snps, itemsize, 1)
+                unit = max(unit, fold_est["main"] + fold_est["unit"])
+                unit_time += fold_est["serial_time"] + fold_est["unit_time"] * fold_est["units"]
+            est.update({"unit": unit, "units": num_folds, "unit_time": unit_time, "disk": disk})
+
+        workers = max(1, min(n_jobs, est["units"]))
+        memory = base + (folds if task_name != "cv_set_creation" else 0) + est["main"]
+        memory += workers * est["unit"]
+        rounds = int(math.ceil(float(est["units"]) / workers))
+        time_s = est["serial_time"] + rounds * est["unit_time"]
+        estimates.append((task_name, memory / mb, est["disk"] / mb, time_s))
+    return estimates, (base / mb, load_time)
+
+
+def resource_limits(config):
+    '''
+    Function to get the limits of the resource check: the memory (MB), the
+    disk space (MB) and the time of a task (seconds). Null limits in the
+    configuration are the physical memory and the free space of the output
+    directory (or None if they are not known) and no time limit.
+    '''
+    memory_limit = config.get_entry("global", "memory_limit_mb")
+    if memory_limit is None:
+        try:
+            memory_limit = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024.0 * 1024.0)
+        except (AttributeError, ValueError, OSError):
+            pass
+    disk_limit = config.get_entry("global", "disk_limit_mb")
+    if disk_limit is None:
+        output_dir = config.get_entry("global", "output_dir")
+        while not os.path.exists(output_dir) and os.path.dirname(output_dir) != output_dir:
+            output_dir = os.path.dirname(output_dir)
+        try:
+            stat = os.statvfs(output_dir)
+            disk_limit = stat.f_bavail * stat.f_frsize / (1024.0 * 1024.0)
+        except (AttributeError, OSError):
+            pass
+    time_limit = config.get_entry("global", "time_limit_h")
+    return memory_limit, disk_limit, None if time_limit is None else time_limit * 3600.0
+
+
+def resource_messages(config, estimates):
+    '''
+    Function to compare the estimates of estimate_resources with the limits
+    (resource_limits). The disk space is the total of the tasks.
+
+    Returns
+    -------
+    The list of messages of the estimates above their limits.
+    '''
+    memory_limit, disk_limit, time_limit = resource_limits(config)
+    messages = []
+    for task_name, memory_mb, disk_mb, time_s in estimates:
+        if memory_limit is not None and memory_mb > memory_limit:
+            messages.append("%s: estimated peak memory %.0f MB > limit %.0f MB"
+                            % (task_name, memory_mb, memory_limit))
+        if time_limit is not None and time_s > time_limit:
+            messages.append("%s: estimated time %.1f h > limit %.1f h"
+                            % (task_name, time_s / 3600.0, time_limit / 3600.0))
+    disk_mb = sum(estimate[2] for estimate in estimates)
+    if disk_limit is not None and disk_mb > disk_limit:
+        messages.append("estimated disk space %.0f MB > limit %.0f MB" % (disk_mb, disk_limit))
+    return messages
+
+
+def check_resources(config, estimates):
+    '''
+    Function to check the estimates of estimate_resources before the tasks
+    are run (global entry resource_check): with warn, every estimate above
+    its limit is logged as a warning; with refuse, a ValueError is raised.
+    '''
+    mode = config.get_entry("global", "resource_check")
+    # An unquoted off is read as a boolean by the YAML parser
+    if mode is False or mode == "off":
+        return
+    if mode not in ("warn", "refuse"):
+        raise ValueError("Unknown resource_check %s (off, warn or refuse)" % mode)
+    messages = resource_messages(config, estimates)
+    for message in messages:
+        logging.warning("Resources: %s" % message)
+    if mode == "refuse" and len(messages) > 0:
+        raise ValueError("Estimated resources above the limits (set resource_check: warn "
+                         "to run anyway):\n  %s" % "\n  ".join(messages))
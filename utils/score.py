@@ -0,0 +1,147 @@
+#-----------------------------------------------------------------------------
+# Score new samples with the models saved by the pipeline
+#
+# The fitted models of every fold (saved with save_models, see
+# phenotype_imputation and random_forest) are applied to the samples of a
+# new HDF5 file with the layout of the input file (GTBox/gt and
+# GTBox/covar; GTBox/lbl is not needed). Nothing is fitted: the covariates
+# are scaled with the parameters of the training dataset and the random
+# forests use the SNPs selected for their fold. The predictions of the folds
+# are averaged.
+#
+# Every model is loaded once and applied to the samples in batches of
+# batch_size samples, and its predictions are added to those of the other
+# folds. Only one model is in memory at a time, and only the SNPs selected
+# for the fold of a random forest are read from the genotype.
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import logging
+import numpy as np
+import tables as tb
+
+
+def _scale(covariate, saved):
+    '''
+    Scale the covariates (variables x samples) with the saved parameters.
+    Returns a (samples x variables) matrix.
+    '''
+    return ((covariate - saved["covariate_mean"][:, np.newaxis]) /
+            saved["covariate_std"][:, np.newaxis]).transpose()
+
+
+def genotype_features(saved, gt, start, stop, covariate):
+    '''
+    Function to build the features of the random forest of a fold: the
+    selected SNPs followed by the scaled regular covariate.
+
+    Parameters
+    ----------
+    saved : the model of the fold, as saved by random_forest
+
+    gt : the genotype array of the HDF5 file (samples x SNPs). Only the
+        selected SNPs of the samples start..stop-1 are read
+
+    start, stop : the samples of the batch
+
+    covariate : (12 x batch_size) covariates of the samples
+    '''
+    if saved["snp_index"].max() >= gt.shape[1]:
+        raise ValueError("The model uses SNP %d, the genotype has %d SNPs"
+                         % (saved["snp_index"].max() + 1, gt.shape[1]))
+    # The columns are read in increasing order, each once
+    columns, position = np.unique(saved["snp_index"], return_inverse=True)
+    genotype = gt[start:stop, columns.tolist()]
+    return np.column_stack([genotype[:, position], _scale(covariate[0:1], saved)])
+
+
+def clinical_features(saved, gt, start, stop, covariate):
+    '''
+    Function to build the features of the imputation model of a fold: the
+    scaled clinical covariates.
+    '''
+    return _scale(covariate[1:12], saved)
+
+
+def mean_prediction(config, task_name, keys, features, hdf, batch_size):
+    '''
+    Function to average the probability of the positive class predicted by
+    the saved models of a task for all the samples of an HDF5 file. Every
+    model is loaded once and applied batch by batch.
+
+    Parameters
+    ----------
+    config : an object of class ConfigState
+
+    task_name : the task that saved the models
+
+    keys : the names of the models
+
+    features : function that builds the features of a model for a batch
+        (genotype_features or clinical_features)
+
+    hdf : the open HDF5 file with the samples
+
+    batch_size : the number of samples read and scored at once
+    '''
+    num_samples = hdf.root.GTBox.covar.shape[1]
+    prediction = np.zeros(num_samples)
+    for key in keys:
+        logging.info("Model %s/%s" % (task_name, key))
+        saved = config.load_model(task_name, key)
+        for start in range(0, num_samples, batch_size):
+            stop = min(start + batch_size, num_samples)
+            covariate = hdf.root.GTBox.covar[:, start:stop]
+            batch_features = features(saved, hdf.root.GTBox.gt, start, stop, covariate)
+            prediction[start:stop] += saved["model"].predict_proba(batch_features)[:, 1]
+    return prediction / len(keys)
+
+
+def score_samples(config, input_path, output_path, batch_size):
+    '''
+    Function to score the samples of an HDF5 file with the saved models and
+    write the averaged predictions to a tab-separated file with one line per
+    sample: the index of the sample, the prediction of the random forests
+    (genotype) and the prediction of the imputation models (clinical
+    covariates). A column is left out if its task saved no models.
+
+    Parameters
+    ----------
+    config : an object of class ConfigState, the configuration with which the
+        models were trained
+
+    input_path : the HDF5 file with the new samples
+
+    output_path : the file with the predictions
+
+    batch_size : the number of samples read and scored at once
+    '''
+    genotype_keys = config.model_keys("random_forest")
+    clinical_keys = config.model_keys("phenotype_imputation")
+    if len(genotype_keys) == 0 and len(clinical_keys) == 0:
+        raise ValueError("No saved models in %s (set save_models and run the pipeline)"
+                         % config.get_entry("global", "output_dir"))
+
+    header = ["sample"]
+    if len(genotype_keys) > 0:
+        header.append("genotype_prediction")
+    if len(clinical_keys) > 0:
+        header.append("clinical_prediction")
+
+    hdf = tb.open_file(input_path, mode='r')
+    try:
+        columns = [np.arange(hdf.root.GTBox.covar.shape[1])]
+        if len(genotype_keys) > 0:
+            columns.append(mean_prediction(config, "random_forest", genotype_keys,
+                                           genotype_features, hdf, batch_size))
+        if len(clinical_keys) > 0:
+            columns.append(mean_prediction(config, "phenotype_imputation", clinical_keys,
+                                           clinical_features, hdf, batch_size))
+    finally:
+        hdf.close()
+    with open(output_path, "w") as f:
+        f.write("\t".join(header) + "\n")
+        np.savetxt(f, np.column_stack(columns), delimiter='\t',
+                   fmt=["%d"] + ["%f"] * (len(columns) - 1))
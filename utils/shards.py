@@ -0,0 +1,191 @@
+#-----------------------------------------------------------------------------
+# Fold shards: run the folds of the pipeline in separate jobs and merge them
+#
+# A shard is a range of folds start..stop-1. A shard job runs the fold tasks
+# (phenotype_imputation, univ_feature_sel and random_forest) on its folds
+# only and writes their outputs, checkpoints and keys to the subdirectory
+# shard_<start>_<stop> of the output subdirectory of every task. The folds
+# themselves (cv_set_creation) must be created before, once, for all shards.
+#
+# Once all shards are done, merge_shards concatenates the per-fold outputs of
+# the shards in fold order and saves them, with their task keys, where a
+# single run would have saved them (the mean ROC curve of random_forest is
+# recomputed from the ROC curves of all folds). The outputs are the same as
+# those of a single run, which then finds them up to date.
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import os
+import logging
+import numpy as np
+from contextlib import contextmanager
+
+from task_cache import task_key, folds_key, load_key, save_key, TASK_DEPENDENCIES
+
+# The tasks that are run by the shards
+SHARDED_TASKS = ["phenotype_imputation", "univ_feature_sel", "random_forest"]
+
+# The per-fold outputs of the sharded tasks: (variable, fold axis, format).
+# Variables that are missing in the shards (e.g. feature_pval without top_k
+# or permutations) are skipped
+SHARD_VARIABLES = {
+    "phenotype_imputation": [("soft_labels", 1, "%f"), ("roc_auc", 0, "%f")],
+    "univ_feature_sel":     [("feature_ranking", 0, "%d"), ("feature_pval", 0, "%.6e")],
+    "random_forest":        [("results", 0, "%f"), ("roc_auc", 0, "%f"), ("tpr", 0, "%f"),
+                             ("n_trees", 0, "%d")],
+}
+
+
+def parse_fold_range(folds, shard, num_folds):
+    '''
+    Function to get the fold range of a shard job.
+
+    Parameters
+    ----------
+    folds : a range "start:stop" of folds (0-based, stop excluded), or None
+
+    shard : "i/n", the shard i (0-based) of n shards of nearly equal size, or
+        None
+
+    num_folds : the number of folds of the run
+
+    Returns
+    -------
+    A tuple (start, stop), or None if neither folds nor shard is given.
+    '''
+    if folds is not None:
+        start, stop = [int(x) for x in folds.split(":")]
+    elif shard is not None:
+        i, n = [int(x) for x in shard.split("/")]
+        if not 0 <= i < n:
+            raise ValueError("Invalid shard %s: the shard must be in 0..%d" % (shard, n - 1))
+        start, stop = i * num_folds // n, (i + 1) * num_folds // n
+    else:
+        return None
+    if not 0 <= start < stop <= num_folds:
+        raise ValueError("Invalid fold range %d:%d for %d folds" % (start, stop, num_folds))
+    return start, stop
+
+
+def shard_subdir(config, task_name, start, stop):
+    '''
+    Function to get the output subdirectory of a task in the shard start:stop.
+    '''
+    return "%s/shard_%d_%d" % (config.get_entry(task_name, "output_subdir"), start, stop)
+
+
+def use_shard(config, start, stop):
+    '''
+    Function to redirect the outputs of the sharded tasks to the
+    subdirectories of the shard start:stop (in the configuration object
+    only).
+    '''
+    for task_name in SHARDED_TASKS:
+        config.config[task_name]["output_subdir"] = shard_subdir(config, task_name, start, stop)
+
+
+@contextmanager
+def shard_outputs(config, task_name, start, stop):
+    '''
+    Context manager in which the outputs of a task are read from (and written
+    to) the subdirectory of the shard start:stop.
+    '''
+    output_subdir = config.get_entry(task_name, "output_subdir")
+    config.config[task_name]["output_subdir"] = shard_subdir(config, task_name, start, stop)
+    try:
+        yield
+    finally:
+        config.config[task_name]["output_subdir"] = output_subdir
+
+
+def find_shards(config, task_name, num_folds):
+    '''
+    Function to find the shards of a task that cover the folds 0..num_folds-1.
+
+    Returns
+    -------
+    The sorted list of (start, stop) ranges. A ValueError is raised if the
+    shards do not cover every fold exactly once.
+    '''
+    task_dir = "%s/%s" % (config.get_entry("global", "output_dir"),
+                          config.get_entry(task_name, "output_subdir"))
+    shards = []
+    if os.path.exists(task_dir):
+        for name in os.listdir(task_dir):
+            if name.startswith("shard_") and os.path.isdir("%s/%s" % (task_dir, name)):
+                start, stop = [int(x) for x in name[len("shard_"):].split("_")]
+                shards.append((start, stop))
+    shards.sort()
+    bounds = [0] + [bound for shard in shards for bound in shard] + [num_folds]
+    if any(bounds[j] != bounds[j + 1] for j in range(0, len(bounds), 2)):
+        raise ValueError("%s: the shards %s do not cover the %d folds exactly once"
+                         % (task_name, ", ".join("%d:%d" % shard for shard in shards), num_folds))
+    return shards
+
+
+def merge_shards(config, num_folds, digest):
+    '''
+    Function to merge the outputs of the shards of every sharded task. The
+    shards must have been computed with the same dataset and configuration
+    (their task keys are checked). The saved models of the shards are moved
+    to the models subdirectory of the task.
+
+    Parameters
+    ----------
+    config : an object of class ConfigState
+
+    num_folds : the number of folds of the run
+
+    digest : the digest of the dataset file (see task_cache.dataset_digest)
+    '''
+    output_dir = config.get_entry("global", "output_dir")
+    keys = {}
+    for task_name, dependencies in TASK_DEPENDENCIES:
+        key = task_key(config, task_name, [keys[name] for name in dependencies], digest)
+        if task_name == "cv_set_creation":
+            key = folds_key(config, key)
+        keys[task_name] = key
+        if task_name not in SHARDED_TASKS:
+            if key is None or load_key(config, task_name) != key:
+                raise ValueError("The output of %s is not up to date" % task_name)
+            continue
+
+        logging.info("Merging task: %s" % task_name)
+        shards = find_shards(config, task_name, num_folds)
+        for start, stop in shards:
+            with shard_outputs(config, task_name, start, stop):
+                if load_key(config, task_name) != key:
+                    raise ValueError("%s: shard %d:%d is not finished or was computed with "
+                                     "other inputs" % (task_name, start, stop))
+
+        save_key(config, task_name, None)
+        for var_name, axis, format_string in SHARD_VARIABLES[task_name]:
+            parts = []
+            for start, stop in shards:
+                with shard_outputs(config, task_name, start, stop):
+                    if config.has_variable(task_name, var_name):
+                        parts.append(config.load_variable(task_name, var_name))
+            if len(parts) > 0:
+                config.save_variable(task_name, format_string,
+                                     **{var_name: np.concatenate(parts, axis=axis)})
+
+        # The fitted models of the folds
+        config.remove_models(task_name)
+        model_dir = "%s/%s/models" % (output_dir, config.get_entry(task_name, "output_subdir"))
+        for start, stop in shards:
+            shard_model_dir = "%s/%s/models" % (output_dir, shard_subdir(config, task_name, start, stop))
+            if os.path.exists(shard_model_dir):
+                config._create_directory(model_dir)
+                for name in os.listdir(shard_model_dir):
+                    os.rename("%s/%s" % (shard_model_dir, name), "%s/%s" % (model_dir, name))
+
+        if task_name == "random_forest":
+            from random_forest import mean_roc_curve
+            with shard_outputs(config, task_name, shards[0][0], shards[0][1]):
+                mean_fpr = config.load_variable(task_name, "mean_fpr")
+            mean_tpr, mean_auc = mean_roc_curve(mean_fpr, config.load_variable(task_name, "tpr"))
+            config.save_variable(task_name, "%f", mean_fpr=mean_fpr, mean_tpr=mean_tpr,
+                                 mean_auc=mean_auc)
+        save_key(config, task_name, key)
@@ -0,0 +1,144 @@
+#-----------------------------------------------------------------------------
+# Sweeps: run the pipeline for a grid of configurations on one dataset
+#
+# A sweep file (YAML) maps entries "section.key" of the configuration to the
+# list of values to try, e.g.
+#   cv_set_creation.sizes: [{set_I: 0.1, set_II: 0.7, set_III: 0.2},
+#                           {set_I: 0.2, set_II: 0.6, set_III: 0.2}]
+#   random_forest.n_select: [50, 100]
+# Every combination of values (the Cartesian product) is a configuration of
+# the sweep. The configuration k (from 1, in the order of the sorted entries)
+# writes its outputs to the subtree <output_dir>/config_<k> of the output
+# directory of the base configuration, with the configuration itself
+# (config.txt) and the outputs of random_forest.
+#
+# The dataset is loaded once for all configurations. The outputs of the
+# upstream tasks (cv_set_creation, phenotype_imputation and
+# univ_feature_sel) are stored once per task key (see task_cache.py) in
+# <output_dir>/shared, and the subdirectories of these tasks in the subtree
+# of a configuration are symbolic links to them: configurations whose
+# upstream entries match share the folds, soft labels and feature rankings,
+# which are computed once. The mean AUC of every configuration is written
+# to <output_dir>/sweep.tsv.
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import os
+import copy
+import shutil
+import itertools
+import yaml
+
+from task_cache import task_key, TASK_DEPENDENCIES, DIGEST_FILE
+
+# The tasks whose outputs are shared by the configurations of a sweep
+SHARED_TASKS = ["cv_set_creation", "phenotype_imputation", "univ_feature_sel"]
+
+# Name of the summary of a sweep, in the output directory
+SUMMARY_FILE = "sweep.tsv"
+
+
+def load_grid(config, sweep_file):
+    '''
+    Function to read a sweep file and expand its grid.
+
+    Parameters
+    ----------
+    config : the base configuration (an object of class ConfigState)
+
+    sweep_file : the YAML file with the lists of values of the entries
+
+    Returns
+    -------
+    The list of configurations of the sweep, each a list of overrides
+    (section, key, value).
+    '''
+    with open(sweep_file) as f:
+        grid = yaml.safe_load(f)
+    if not isinstance(grid, dict) or len(grid) == 0:
+        raise ValueError("%s: expected entries section.key: [values]" % sweep_file)
+    entries = []
+    for name in sorted(grid):
+        section, _, key = name.partition(".")
+        if section not in config.config or key not in config.config[section]:
+            raise ValueError("%s: unknown entry %s" % (sweep_file, name))
+        if section == "global":
+            # The dataset and its storage are shared by the configurations
+            raise ValueError("%s: the global entries cannot be swept (%s)" % (sweep_file, name))
+        values = grid[name] if isinstance(grid[name], list) else [grid[name]]
+        if len(values) == 0:
+            raise ValueError("%s: no values for %s" % (sweep_file, name))
+        entries.append([(section, key, value) for value in values])
+    return [list(overrides) for overrides in itertools.product(*entries)]
+
+
+def sweep_config(config, overrides, output_dir):
+    '''
+    Function to get the configuration of a sweep: a copy of the base
+    configuration with the overrides, writing its outputs to output_dir.
+    '''
+    config = copy.deepcopy(config)
+    for section, key, value in overrides:
+        config.config[section][key] = value
+    config.config["global"]["output_dir"] = output_dir
+    return config
+
+
+def task_keys(config, digest):
+    '''
+    Function to compute the keys of the outputs of all the tasks of a
+    configuration.
+    '''
+    keys = {}
+    for task_name, dependencies in TASK_DEPENDENCIES:
+        keys[task_name] = task_key(config, task_name, [keys[name] for name in dependencies],
+                                   digest)
+    return keys
+
+
+def link_shared_outputs(config, digest, shared_dir):
+    '''
+    Function to point the output subdirectories of the shared tasks of a
+    configuration to the shared directories of their keys (created if
+    needed), and to save the configuration in its output directory with the
+    cached digest of the dataset (so that the configuration can be run or
+    checked on its own, see run_cotraining.py --dry-run).
+    '''
+    output_dir = config.get_entry("global", "output_dir")
+    keys = task_keys(config, digest)
+    for task_name in SHARED_TASKS:
+        target = "%s/%s_%s" % (shared_dir, task_name, keys[task_name][:16])
+        config._create_directory(target)
+        link = "%s/%s" % (output_dir, config.get_entry(task_name, "output_subdir"))
+        config._create_directory(os.path.dirname(link))
+        relative_target = os.path.relpath(target, os.path.dirname(link))
+        if os.path.islink(link):
+            if os.readlink(link) == relative_target:
+                continue
+            os.remove(link)
+        elif os.path.exists(link):
+            raise ValueError("%s exists and is not a link to the shared outputs" % link)
+        os.symlink(relative_target, link)
+    with open("%s/config.txt" % output_dir, "w") as f:
+        yaml.dump(config.config, f, default_flow_style=False)
+    shutil.copy("%s/%s" % (os.path.dirname(shared_dir), DIGEST_FILE), output_dir)
+
+
+def write_summary(output_dir, names, grid, configs):
+    '''
+    Function to write the summary of a sweep: one line per configuration with
+    its name, the values of the swept entries and its mean AUC (empty if it
+    has no random_forest output yet).
+    '''
+    header = ["name"] + ["%s.%s" % (section, key) for section, key, _ in grid[0]] + ["mean_auc"]
+    with open("%s/%s" % (output_dir, SUMMARY_FILE), "w") as f:
+        f.write("\t".join(header) + "\n")
+        for name, overrides, config in zip(names, grid, configs):
+            mean_auc = ""
+            if config.has_variable("random_forest", "mean_auc"):
+                mean_auc = "%f" % config.load_variable("random_forest", "mean_auc")[0]
+            values = [yaml.safe_dump(value, default_flow_style=True).strip().replace("\n...", "")
+                      for _, _, value in overrides]
+            f.write("\t".join([name] + values + [mean_auc]) + "\n")
@@ -0,0 +1,220 @@
+#-----------------------------------------------------------------------------
+# Dependency graph of the pipeline tasks and content-addressed cache of their
+# outputs
+#
+# Every task output is keyed by a hash of everything it depends on: the
+# content of the dataset file (and of the other input files of the task), the
+# configuration entries of the task (and the global entries that change
+# results) and the keys of its upstream tasks. The key of cv_set_creation
+# also covers the folds it created (see folds_key): with seed null, creating
+# the folds again gives other folds.
+# The key is saved next to the output when the task finishes. A task whose
+# saved key equals its current key is up to date and is not run again; a
+# change of any input changes the key of the task and, through the upstream
+# keys, the keys of all the tasks downstream of it.
+#
+# Authors: Menno Witteveen
+#          Damian Roqueiro
+#-----------------------------------------------------------------------------
+
+import os
+import json
+import hashlib
+import numpy as np
+
+# The tasks in execution order, with the tasks whose outputs they read
+TASK_DEPENDENCIES = [
+    ("cv_set_creation",      []),
+    ("phenotype_imputation", ["cv_set_creation"]),
+    ("univ_feature_sel",     ["cv_set_creation", "phenotype_imputation"]),
+    ("random_forest",        ["cv_set_creation", "phenotype_imputation", "univ_feature_sel"]),
+]
+
+# The tasks that save checkpoints (see fold_parallel.run_task_folds)
+CHECKPOINTED_TASKS = ["phenotype_imputation", "univ_feature_sel", "random_forest"]
+
+# Entries of the global section that change the outputs of every task
+GLOBAL_KEYS = ["save_option", "seed"]
+
+# Entries of the task sections that do not change the outputs
+IGNORED_KEYS = ["output_subdir", "block_size"]
+
+# Entries of the task sections that list input files (besides the dataset):
+# the content of the files is part of the key
+INPUT_FILE_KEYS = {"univ_feature_sel": "added_samples"}
+
+# Name of the file with the key of a task output
+KEY_FILE = "task_hash.txt"
+
+# Name of the file with the cached digest of the dataset, in the output
+# directory
+DIGEST_FILE = "dataset_digest.txt"
+
+
+def file_digest(path):
+    '''
+    Function to compute the SHA-1 digest of the content of a file.
+    '''
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 24), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def input_file_paths(config, task_name):
+    '''
+    Function to get the paths of the input files listed in the section of a
+    task (see INPUT_FILE_KEYS), relative to the input directory.
+    '''
+    if task_name not in INPUT_FILE_KEYS:
+        return []
+    return [os.path.join(config.get_entry("global", "input_dir"), path)
+            for path in config.get_entry(task_name, INPUT_FILE_KEYS[task_name])]
+
+
+def dataset_digest(config, cached_only=False):
+    '''
+    Function to compute the SHA-1 digest of the content of the dataset file.
+    The digest is cached in the output directory together with the size and
+    modification time of the file, so the file is only read again when it
+    changes.
+
+    Parameters
+    ----------
+    config : an object of class ConfigState
+
+    cached_only : return the cached digest, or None if the file changed since
+        it was cached (the file is not read)
+    '''
+    input_path = "%s/%s" % (config.get_entry("global", "input_dir"),
+                            config.get_entry("global", "input_file"))
+    cache_file = "%s/%s" % (config.get_entry("global", "output_dir"), DIGEST_FILE)
+    stamp = "%s %d %d" % (os.path.abspath(input_path), os.path.getsize(input_path),
+                          int(os.path.getmtime(input_path)))
+
+    if os.path.exists(cache_file):
+        with open(cache_file) as f:
+            cached_stamp, _, digest = f.read().strip().rpartition(" ")
+        if cached_stamp == stamp:
+            return digest
+    if cached_only:
+        return None
+
+    digest = file_digest(input_path)
+    with open(cache_file, "w") as f:
+        f.write("%s %s\n" % (stamp, digest))
+    return digest
+
+
+def folds_digest(folds):
+    '''
+    Function to compute the SHA-1 digest of the folds (the set of every
+    sample in every fold).
+    '''
+    folds = np.ascontiguousarray(folds, dtype='float64')
+    sha = hashlib.sha1(str(folds.shape))
+    sha.update(folds.tostring())
+    return sha.hexdigest()
+
+
+def folds_key(config, key):
+    '''
+    Function to compute the key of the folds saved by cv_set_creation: a hash
+    of the key of the task and of its output, the seeds of the folds and the
+    folds themselves when they are materialized (otherwise they are
+    regenerated from the seeds, see Dataset.add_fold_information). Returns
+    None if the folds have not been created.
+
+    Parameters
+    ----------
+    config : an object of class ConfigState
+
+    key : the key of cv_set_creation (see task_key)
+    '''
+    task_name = "cv_set_creation"
+    outputs = [key]
+    if config.has_variable(task_name, "fold_seeds"):
+        seeds = np.atleast_1d(config.load_variable(task_name, "fold_seeds")).astype('int64')
+        outputs.append(hashlib.sha1(seeds.tostring()).hexdigest())
+    if config.get_entry(task_name, "materialize") or len(outputs) == 1:
+        if not config.has_variable(task_name, "folds"):
+            return None
+        outputs.append(folds_digest(config.load_variable(task_name, "folds", mmap=True)))
+    return hashlib.sha1(" ".join(outputs)).hexdigest()
+
+
+def task_key(config, task_name, upstream_keys, digest):
+    '''
+    Function to compute the key of the output of a task.
+
+    Parameters
+    ----------
+    config : an object of class ConfigState
+
+    task_name : the name of the task
+
+    upstream_keys : the keys of the outputs of the tasks it depends on
+
+    digest : the digest of the dataset file (see dataset_digest)
+    '''
+    section = dict((key, value) for key, value in config.config[task_name].items()
+                   if key not in IGNORED_KEYS)
+    global_entries = dict((key, config.get_entry("global", key)) for key in GLOBAL_KEYS)
+    inputs = [task_name, digest, section, global_entries, list(upstream_keys)]
+    input_files = input_file_paths(config, task_name)
+    if len(input_files) > 0:
+        inputs.append([file_digest(path) for path in input_files])
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+
+def _key_file(config, task_name, checkpoint=False):
+    '''
+    Function to get the path of the file with the key of a task output (or of
+    its checkpoints).
+    '''
+    task_dir = "%s/%s" % (config.get_entry("global", "output_dir"),
+                          config.get_entry(task_name, "output_subdir"))
+    if checkpoint:
+        task_dir = "%s/checkpoint" % task_dir
+    return "%s/%s" % (task_dir, KEY_FILE)
+
+
+def load_key(config, task_name, checkpoint=False):
+    '''
+    Function to read the saved key of a task output. Returns None if the task
+    has no saved key.
+    '''
+    key_file = _key_file(config, task_name, checkpoint)
+    if not os.path.exists(key_file):
+        return None
+    with open(key_file) as f:
+        return f.read().strip()
+
+
+def save_key(config, task_name, key, checkpoint=False):
+    '''
+    Function to save the key of a task output. With key None, the saved key is
+    removed (the output is not valid any more).
+    '''
+    key_file = _key_file(config, task_name, checkpoint)
+    if key is None:
+        if os.path.exists(key_file):
+            os.remove(key_file)
+        return
+    key_dir = os.path.dirname(key_file)
+    if not os.path.exists(key_dir):
+        os.makedirs(key_dir)
+    with open(key_file, "w") as f:
+        f.write("%s\n" % key)
+
+
+def prepare_checkpoints(config, task_name, key):
+    '''
+    Function to discard the checkpoints of a task that were computed for other
+    inputs (including other folds, see folds_key) and to tag the checkpoints
+    with the key of the task.
+    '''
+    if load_key(config, task_name, checkpoint=True) != key:
+        config.remove_checkpoints(task_name)
+        save_key(config, task_name, key, checkpoint=True)
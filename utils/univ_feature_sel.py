@@ -1,7 +1,7 @@
 #-----------------------------------------------------------------------------
 # Perform univariate feature selection on the totality of SNPs
-# Rank SNPs according to the correlation between their genotype and class
-# labels
+# Rank SNPs according to the association between their genotype and class
+# labels (Pearson correlation or logistic regression score test)
 # 
 # Authors: Menno Witteveen
 #          Damian Roqueiro
@@ -13,47 +13,314 @@ from classes.config_state import ConfigState
 
 import logging
 import numpy as np
-from scipy.stats import pearsonr 
 
 # Pipeline auxiliary functions
-from generic_functions import find_vec_entries_that_contain
+from batched_pearson import pearson_from_moments
+from batched_pearson import pearson_pval_from_r
+from batched_pearson import pearson_permutations
+from logit_score import fit_null_models
+from logit_score import score_test_pval
+from feature_statistics import update_statistics
+from generic_functions import fold_seeds
+from generic_functions import scale_parameters
+from fold_parallel import run_task_folds
+
+def training_label_matrix(data, soft_labels, romans_trn_gold, romans_trn_silver):
+    '''
+    Function to describe the training set of every fold as two matrices of size
+    (num_samples x num_folds): a mask with the training samples and the
+    training labels (gold labels for the golden romans and imputed soft labels
+    for the silver romans).
+
+    Parameters
+    ----------
+    data : an object of class Dataset with the labels and the random folds
+
+    soft_labels : the imputed labels, as saved by phenotype_imputation
+
+    romans_trn_gold : the romans with gold standard labels
+
+    romans_trn_silver : the romans with silver standard (imputed) labels
+    '''
+    mask = np.zeros((data.num_samples, data.folds.shape[1]))
+    trn_labels = np.zeros((data.num_samples, data.folds.shape[1]))
+    for i in range(data.folds.shape[1]):
+        sel_trn_gold = data.fold_index.get(i, romans_trn_gold)
+        sel_trn_silver = data.fold_index.get(i, romans_trn_silver)
+        mask[sel_trn_gold, i] = 1
+        mask[sel_trn_silver, i] = 1
+        trn_labels[sel_trn_gold, i] = data.labels[0, sel_trn_gold]
+        trn_labels[sel_trn_silver, i] = soft_labels[range(len(sel_trn_silver)), i]
+    return mask, trn_labels
+
+def null_model_covariates(data):
+    '''
+    Function to get the covariates of the logistic regression null model: the
+    clinical and regular covariates, scaled, as a (num_samples x 12) matrix.
+    '''
+    covariate = np.vstack([data.clin_covariate, data.regular_covariate])
+    mean, std = scale_parameters(covariate)
+    return ((covariate - mean[:, np.newaxis]) / std[:, np.newaxis]).transpose()
+
+def score_block(start, data, config, mask, trn_labels, seeds, null_models=None):
+    '''
+    Function to compute the p-values of the block of SNPs that starts at SNP
+    start against the training labels of all folds. With the method
+    logit_regression, null_models are the null models of the folds (see
+    logit_score.fit_null_models).
+
+    Returns
+    -------
+    A tuple with the (num_folds x block_size) matrix of p-values and, with
+    permutations, the (num_folds x block_size) empirical p-values (test
+    empirical) or the (num_folds x permutations) maximum |r| of the block in
+    every permutation (test maxT).
+    '''
+    task_name = "univ_feature_sel"
+    stop = min(start + config.get_entry(task_name, "block_size"), data.num_snps)
+    num_permutations = config.get_entry(task_name, "permutations")
+    test = config.get_entry(task_name, "permutation_test")
+    logging.info("SNPs=%d-%d" % (start + 1, stop))
+    if null_models is not None:
+        residual, weights, projection = null_models
+        products = data.genotype_products(start, stop, np.hstack([residual, projection]), weights)
+        return (score_test_pval(products, mask.shape[1]).transpose(),)
+    moments = data.genotype_moments(start, stop, mask, trn_labels)
+    pval = pearson_from_moments(*moments)[1]
+    if num_permutations == 0:
+        return (pval.transpose(),)
+
+    result = pearson_permutations(data.genotype_block(start, stop), moments, mask, trn_labels,
+                                  seeds, num_permutations, test)
+    if test == "maxT":
+        return pval.transpose(), result
+    perm_pval = (1.0 + result) / (1.0 + num_permutations)
+    perm_pval[np.isnan(pval)] = np.nan
+    return pval.transpose(), perm_pval.transpose()
+
+def sum_block(start, data, config, mask, trn_labels):
+    '''
+    Function to compute the sums sx, sxx and sxy of the block of SNPs that
+    starts at SNP start over the training samples of every fold, as
+    (num_folds x block_size) matrices (see feature_statistics.py).
+    '''
+    stop = min(start + config.get_entry("univ_feature_sel", "block_size"), data.num_snps)
+    logging.info("SNPs=%d-%d" % (start + 1, stop))
+    _, sx, sxx, _, _, sxy = data.genotype_moments(start, stop, mask, trn_labels)
+    return sx.transpose(), sxx.transpose(), sxy.transpose()
+
+def merge_top_k(best_keys, best_index, block_keys, start, k):
+    '''
+    Function to merge the p-values of a block of SNPs into the best k SNPs of
+    every fold, using a partial selection. SNPs with a NaN p-value (constant
+    SNPs) come last, as in a full sort.
+
+    Parameters
+    ----------
+    best_keys, best_index : lists of (num_folds x k') sort keys (e.g. the
+        p-values) and SNP indices of the best SNPs so far (k' <= k, in no
+        particular order). The first key decides and the next ones break ties
+
+    block_keys : the lists of (num_folds x block_size) sort keys of the SNPs
+        of the block
+
+    start : the index of the first SNP of the block
+
+    k : the number of SNPs to keep
+
+    Returns
+    -------
+    The (num_folds x min(k, k' + block_size)) sort keys and SNP indices of
+    the best SNPs.
+    '''
+    num_folds, width = block_keys[0].shape
+    block_index = np.tile(np.arange(start, start + width), (num_folds, 1))
+    keys = [np.hstack([best, block]) for best, block in zip(best_keys, block_keys)]
+    index = np.hstack([best_index, block_index])
+    if index.shape[1] <= k:
+        return keys, index
+    # The NaN keys are sorted as inf, but kept as NaN in the output
+    sort_keys = [np.where(np.isnan(key), np.inf, key) for key in keys]
+    rows = np.arange(num_folds)[:, np.newaxis]
+    if len(keys) == 1:
+        best = np.argpartition(sort_keys[0], k - 1, axis=1)[:, :k]
+    else:
+        best = np.lexsort(sort_keys[::-1])[:, :k]
+    return [key[rows, best] for key in keys], index[rows, best]
+
+def maxT_pval(pval, perm_max, n):
+    '''
+    Function to compute the max-T (family-wise) corrected p-values of the SNPs
+    of every fold: the fraction of permutations in which the best SNP is at
+    least as significant as the SNP.
+
+    Parameters
+    ----------
+    pval : (num_folds x num_snps) p-values of the observed labels
+
+    perm_max : (num_folds x permutations) maximum |r| over all SNPs in every
+        permutation
+
+    n : the number of training samples of every fold
+    '''
+    # The p-value of the best SNP of every permutation
+    perm_min_pval = np.sort(pearson_pval_from_r(perm_max, n[:, np.newaxis]), axis=1)
+    corrected = np.zeros(pval.shape)
+    for i in range(pval.shape[0]):
+        count = np.searchsorted(perm_min_pval[i], pval[i], side='right')
+        corrected[i] = (1.0 + count) / (1.0 + perm_max.shape[1])
+    corrected[np.isnan(pval)] = np.nan
+    return corrected
 
 def univ_feature_sel(data, config):
     ''' 
-    Do univariate feature selection  
-     
-    
+    Do univariate feature selection. In every fold, the SNPs are ranked by the
+    p-value of their association with the training labels (method):
+        pearson : the Pearson correlation between the genotype and the labels
+        logit_regression : the score test of the SNP in a logistic regression
+            of the labels on the clinical and regular covariates. The null
+            model (without SNP) is fitted once per fold
+    The SNPs are processed in blocks of block_size columns and each
+    block is scored against all folds at once. When the genotype is streamed
+    from the HDF5 file, only one block is held in memory. If top_k is set, only
+    the best top_k SNPs of every fold are kept (merged block by block) and
+    saved, with their p-values, instead of the ranking of all SNPs. The
+    blocks are run by
+    a pool of n_jobs worker processes and, if checkpoint is set, saved one by
+    one so that an interrupted run can be resumed.
+
+    With save_statistics, the sufficient statistics of the Pearson correlation
+    in every fold are saved too. The samples of the files of added_samples are
+    added to the training set of every fold: with saved statistics, new
+    samples are added by reading their files only (see feature_statistics.py).
+
+    With permutations, the labels of every fold are also permuted among its
+    training samples and the SNPs are ranked by permutation p-values
+    (empirical, or max-T corrected over all SNPs), ties being broken by the
+    asymptotic p-value. The permutation p-values are saved in feature_pval
+    (in the order of the SNPs, or of the ranking with top_k).
+
+    Parameters 
+    ---------- 
+    data : an object of class Dataset that contains: genotypes, covariates, 
+        labels and information about random folds 
+
+    config : an object of class ConfigState. It contains the user-entered 
+        parameters in a YAML format.
+        See the config_file parameter in the main script for more details.
     '''
     
     # Parameters
     task_name = "univ_feature_sel"
     romans_trn_gold     = config.get_entry(task_name, "golden_romans_used_for_learning")
     romans_trn_silver   = config.get_entry(task_name, "silver_romans_used_for_learning")
+    block_size          = config.get_entry(task_name, "block_size")
+    top_k               = config.get_entry(task_name, "top_k")
+    num_permutations    = config.get_entry(task_name, "permutations")
+    test                = config.get_entry(task_name, "permutation_test")
+    method              = config.get_entry(task_name, "method")
+    save_stats          = config.get_entry(task_name, "save_statistics")
+    added_samples       = config.get_entry(task_name, "added_samples")
+    n_jobs              = config.get_entry("global", "n_jobs")
+    checkpoint          = config.get_entry("global", "checkpoint")
+    # Every block must use the same permutations: the seeds are fixed here.
+    # Seeds drawn at random (seed null) are saved with the checkpoints of the
+    # blocks, so that a resumed run uses the permutations of the interrupted one
+    seeds = fold_seeds(config.get_entry("global", "seed"), data.folds.shape[1], task_name,
+                       data.fold_offset)
+    if checkpoint and None in seeds and config.has_checkpoint(task_name, "seeds", ["perm_seeds"]):
+        seeds = [int(seed) for seed in config.load_checkpoint(task_name, "seeds", "perm_seeds")]
+    elif None in seeds:
+        seeds = [np.random.randint(2**31 - 1) if seed is None else seed for seed in seeds]
+        if checkpoint and num_permutations > 0:
+            config.save_checkpoint(task_name, "seeds", perm_seeds=np.array(seeds))
     
     # Load the output of the previous task(s)
-    soft_labels = config.load_variable("phenotype_imputation", "soft_labels")
+    soft_labels = config.load_variable("phenotype_imputation", "soft_labels", mmap=True)
     
     # ---------------------------
-    feature_ranking = np.ones((data.folds.shape[1], data.genotype.shape[1]))
-    feature_pval = np.ones((data.folds.shape[1], data.genotype.shape[1]))    
+    mask, trn_labels = training_label_matrix(data, soft_labels, romans_trn_gold, romans_trn_silver)
+    incremental = save_stats or len(added_samples) > 0
+    if incremental and (method != "pearson" or num_permutations > 0):
+        raise ValueError("univ_feature_sel: save_statistics and added_samples are only "
+                         "supported with method pearson and no permutations")
+    if method == "logit_regression":
+        if num_permutations > 0:
+            raise ValueError("univ_feature_sel: permutations are only supported with method pearson")
+        null_models = fit_null_models(null_model_covariates(data), mask, trn_labels)
+    elif method == "pearson":
+        null_models = None
+    else:
+        raise ValueError("univ_feature_sel: unknown or unsupported method %s "
+                         "(pearson or logit_regression)" % method)
+    num_folds = data.folds.shape[1]
+    var_names = ["feature_pval"]
+    if num_permutations > 0:
+        var_names.append("perm_max" if test == "maxT" else "perm_pval")
+    # The SNPs are sorted by the keys: the permutation p-value (empirical)
+    # and the p-value
+    num_keys = 2 if (num_permutations > 0 and test == "empirical") else 1
+    if top_k is None:
+        feature_keys = [np.ones((num_folds, data.num_snps)) for _ in range(num_keys)]
+    else:
+        # The best top_k SNPs of the blocks seen so far
+        feature_keys = [np.zeros((num_folds, 0)) for _ in range(num_keys)]
+        feature_index = np.zeros((num_folds, 0), dtype='int64')
+    perm_max = np.zeros((num_folds, num_permutations))
     
-    # Iterate through the folds:
-    i = 0
-    for fold in data.folds.transpose():
-        logging.info("Fold=%d" % (i + 1))
-        sel_trn_gold = find_vec_entries_that_contain(fold, romans_trn_gold)
-        sel_trn_silver = find_vec_entries_that_contain(fold, romans_trn_silver)
-        sel_trn = np.concatenate([sel_trn_gold, sel_trn_silver])
-        trn_labels = np.concatenate([data.labels[0,sel_trn_gold], soft_labels[range(len(sel_trn_silver)),i]])
-        j = 0
-        # ---------------
-        for genotype_snp in data.genotype.transpose():
-            feature_pval[i,j] = pearsonr(genotype_snp[sel_trn], trn_labels)[1]                   
-            j+=1
-        # ---------------
-        i+=1
+    # Iterate through the blocks of SNPs (all folds at once):
+    block_starts = range(0, data.num_snps, block_size)
+    keys = dict((start, "snps_%d_%d" % (start + 1, min(start + block_size, data.num_snps)))
+                for start in block_starts)
+    if incremental:
+        # The p-values of all SNPs from the sufficient statistics of the folds
+        # (with the added samples), as a single block
+        def cohort_sums():
+            block_sums = run_task_folds(sum_block, block_starts, keys, n_jobs, config,
+                                        task_name, ["stat_sx", "stat_sxx", "stat_sxy"],
+                                        data_attributes=["genotype"],
+                                        data=data, mask=mask, trn_labels=trn_labels)
+            return [np.hstack(sums) for sums in zip(*block_sums)]
+        n, sx, sxx, sy, syy, sxy = update_statistics(config, task_name, mask, trn_labels,
+            cohort_sums, save_stats and task_name not in config.memory)
+        pval = pearson_from_moments(n[:, np.newaxis], sx, sxx, sy[:, np.newaxis],
+                                    syy[:, np.newaxis], sxy)[1]
+        block_starts, block_results = [0], [(pval,)]
+    else:
+        block_results = run_task_folds(score_block, block_starts, keys, n_jobs, config,
+                                       task_name, var_names, data_attributes=["genotype"],
+                                       data=data, mask=mask, trn_labels=trn_labels, seeds=seeds,
+                                       null_models=null_models)
+    for start, block_result in zip(block_starts, block_results):
+        block_keys = [block_result[0]]
+        if num_permutations > 0 and test == "maxT":
+            perm_max = np.maximum(perm_max, block_result[1])
+        elif num_permutations > 0:
+            block_keys.insert(0, block_result[1])
+        if top_k is None:
+            for key, block_key in zip(feature_keys, block_keys):
+                key[:, start:start + block_key.shape[1]] = block_key
+        else:
+            feature_keys, feature_index = merge_top_k(feature_keys, feature_index,
+                                                      block_keys, start, top_k)
         
-    feature_ranking = feature_pval.argsort()
     # ---------------------------
     # Save the output of this task
-    config.save_variable(task_name, "%d", feature_ranking=feature_ranking)
+    feature_pval = feature_keys[-1]
+    if num_permutations > 0 and test == "maxT":
+        feature_keys.insert(0, maxT_pval(feature_pval, perm_max, mask.sum(axis=0)))
+    if top_k is None:
+        if num_permutations == 0:
+            feature_ranking = feature_pval.argsort()
+            config.save_variable(task_name, "%d", feature_ranking=feature_ranking)
+        else:
+            feature_ranking = np.lexsort(feature_keys[::-1])
+            config.save_variable(task_name, "%d", feature_ranking=feature_ranking)
+            config.save_variable(task_name, "%.6e", feature_pval=feature_keys[0])
+    else:
+        # Sort the top_k SNPs by p-value (and SNP index for equal p-values)
+        rows = np.arange(num_folds)[:, np.newaxis]
+        order = np.lexsort([feature_index] + feature_keys[::-1])
+        config.save_variable(task_name, "%d", feature_ranking=feature_index[rows, order])
+        config.save_variable(task_name, "%.6e", feature_pval=feature_keys[0][rows, order])
+    config.remove_checkpoints(task_name)